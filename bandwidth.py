@@ -0,0 +1,221 @@
+import threading
+import time
+
+
+DIRECTIONS = ("upload", "download")
+# The rates of a schedule are looked up again at most this often.
+RATE_CHECK_SECONDS = 1.0
+# A throttled transfer sleeps in slices this long, so cancelling a sync does not wait for a long pause to end.
+MAX_SLEEP_SECONDS = 0.5
+
+
+def minute_of_day(clock_time: str) -> int:
+    """
+    :param clock_time: str time of day "HH:MM", e.g. "09:30".
+    :return: int minutes since midnight.
+    """
+    hours, minutes = clock_time.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class TokenBucket:
+    def __init__(self, rate: float = None, burst_seconds: float = 1.0, clock=time.monotonic):
+        """
+        Token bucket holding up to burst_seconds worth of bytes at the given rate. Transfers take their bytes out of
+        the bucket after each chunk even if there are not enough left; the debt is paid back by waiting, so a chunk
+        larger than the bucket still goes through and the average rate stays at the limit. Safe to share between
+        threads.
+
+        :param rate: float bytes per second, None for no limit.
+        :param burst_seconds: float seconds of transfer at the full rate the bucket holds when it is full.
+        :param clock: callable returning monotonic seconds, for tests.
+        """
+        self.lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.rate = None
+        self.tokens = 0.0
+        self.last_time = clock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        """
+        :param rate: float bytes per second, None for no limit. Debt taken on at the old rate is kept.
+        :return: None
+        :raises ValueError: if the rate is not positive.
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError("Bandwidth limits must be positive, got %r" % rate)
+        with self.lock:
+            if rate == self.rate:
+                return
+            self._refill()
+            if rate is None:
+                self.tokens = 0.0
+            elif self.rate is None:
+                self.tokens = rate * self.burst_seconds
+            else:
+                self.tokens = min(self.tokens, rate * self.burst_seconds)
+            self.rate = rate
+
+    def reserve(self, byte_count: int) -> float:
+        """
+        Take bytes out of the bucket.
+
+        :param byte_count: int number of bytes transferred.
+        :return: float seconds the caller has to wait before transferring more, 0 if there is no limit.
+        """
+        with self.lock:
+            if self.rate is None:
+                return 0.0
+            self._refill()
+            self.tokens -= byte_count
+            return max(0.0, -self.tokens / self.rate)
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate is not None:
+            self.tokens = min(self.rate * self.burst_seconds, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+
+class RateWindow:
+    def __init__(self, start: str, end: str, total_rate: float = None, upload_rate: float = None,
+                 download_rate: float = None):
+        """
+        Bandwidth limits that apply during part of every day, e.g. business hours. A window may span midnight, e.g.
+        "22:00" to "06:00".
+
+        :param start: str time of day "HH:MM" the window starts at.
+        :param end: str time of day "HH:MM" the window ends at, exclusive.
+        :param total_rate: float bytes per second of uploads and downloads together, None for the limiter's default.
+        :param upload_rate: float bytes per second of uploads, None for the limiter's default.
+        :param download_rate: float bytes per second of downloads, None for the limiter's default.
+        """
+        self.start = start
+        self.end = end
+        self.start_minute = minute_of_day(start)
+        self.end_minute = minute_of_day(end)
+        self.total_rate = total_rate
+        self.upload_rate = upload_rate
+        self.download_rate = download_rate
+
+    def contains(self, minute: int) -> bool:
+        """
+        :param minute: int minutes since midnight.
+        :return: True if the window is open at that time of day.
+        """
+        if self.start_minute <= self.end_minute:
+            return self.start_minute <= minute < self.end_minute
+        return minute >= self.start_minute or minute < self.end_minute
+
+    def to_dict(self) -> dict:
+        return {"start": self.start, "end": self.end, "total": self.total_rate, "upload": self.upload_rate,
+                "download": self.download_rate}
+
+    @classmethod
+    def from_dict(cls, window_conf: dict):
+        return cls(window_conf["start"], window_conf["end"], window_conf.get("total", None),
+                   window_conf.get("upload", None), window_conf.get("download", None))
+
+
+class BandwidthLimiter:
+    def __init__(self, total_rate: float = None, upload_rate: float = None, download_rate: float = None,
+                 schedule=(), clock=time.localtime, monotonic_clock=time.monotonic, sleep=time.sleep):
+        """
+        Caps the bandwidth of every transfer sharing this limiter, e.g. all sync roots of a process. Uploads take
+        their bytes from the total and the upload bucket, downloads from the total and the download bucket, after
+        every chunk, so one transfer waits as soon as the transfers together exceed a limit. Safe to share between
+        threads.
+
+        :param total_rate: float bytes per second of uploads and downloads together, None for no limit.
+        :param upload_rate: float bytes per second of uploads, None for no limit.
+        :param download_rate: float bytes per second of downloads, None for no limit.
+        :param schedule: iterable of RateWindow. The first window open at the current time of day replaces the limits
+        it sets; the limits above apply outside every window.
+        :param clock: callable returning the current local time as a time.struct_time, for tests.
+        :param monotonic_clock: callable returning monotonic seconds the buckets refill by, for tests.
+        :param sleep: callable waiting for a number of seconds, for tests.
+        """
+        self.total_rate = total_rate
+        self.upload_rate = upload_rate
+        self.download_rate = download_rate
+        self.schedule = list(schedule)
+        self.clock = clock
+        self.monotonic_clock = monotonic_clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.buckets = {"total": TokenBucket(total_rate, clock=monotonic_clock),
+                        "upload": TokenBucket(upload_rate, clock=monotonic_clock),
+                        "download": TokenBucket(download_rate, clock=monotonic_clock)}
+        self.last_rate_check = None
+
+    def current_rates(self) -> dict:
+        """
+        :return: dict of float bytes per second or None, indexed by "total", "upload" and "download", in effect at
+        the current time of day.
+        """
+        rates = {"total": self.total_rate, "upload": self.upload_rate, "download": self.download_rate}
+        now = self.clock()
+        minute = now.tm_hour * 60 + now.tm_min
+        for window in self.schedule:
+            if window.contains(minute):
+                for key, rate in (("total", window.total_rate), ("upload", window.upload_rate),
+                                  ("download", window.download_rate)):
+                    if rate is not None:
+                        rates[key] = rate
+                break
+        return rates
+
+    def refresh_rates(self):
+        """
+        Apply the limits of the schedule window open now, at most once every RATE_CHECK_SECONDS.
+
+        :return: None
+        """
+        if not self.schedule:
+            return
+        with self.lock:
+            now = self.monotonic_clock()
+            if self.last_rate_check is not None and now - self.last_rate_check < RATE_CHECK_SECONDS:
+                return
+            self.last_rate_check = now
+        for key, rate in self.current_rates().items():
+            self.buckets[key].set_rate(rate)
+
+    def acquire(self, direction: str, byte_count: int, check_cancelled=None) -> float:
+        """
+        Account for bytes a transfer moved and wait until it may move more.
+
+        :param direction: str "upload" or "download".
+        :param byte_count: int number of bytes just transferred.
+        :param check_cancelled: callable raising if the sync operation was cancelled, called while waiting.
+        :return: float seconds waited.
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError("Unknown transfer direction " + direction)
+        self.refresh_rates()
+        delay = max(self.buckets["total"].reserve(byte_count), self.buckets[direction].reserve(byte_count))
+        waited = 0.0
+        while waited < delay:
+            if check_cancelled is not None:
+                check_cancelled()
+            sleep_seconds = min(MAX_SLEEP_SECONDS, delay - waited)
+            self.sleep(sleep_seconds)
+            waited += sleep_seconds
+        return waited
+
+    def to_dict(self) -> dict:
+        return {"total": self.total_rate, "upload": self.upload_rate, "download": self.download_rate,
+                "schedule": [window.to_dict() for window in self.schedule]}
+
+    @classmethod
+    def from_dict(cls, bandwidth_conf: dict):
+        """
+        :param bandwidth_conf: dict as stored in the configuration file, e.g. {"total": 1000000, "schedule":
+        [{"start": "09:00", "end": "17:00", "upload": 250000}]}. Rates are in bytes per second; every key is optional.
+        :return: BandwidthLimiter
+        """
+        return cls(bandwidth_conf.get("total", None), bandwidth_conf.get("upload", None),
+                   bandwidth_conf.get("download", None),
+                   [RateWindow.from_dict(window_conf) for window_conf in bandwidth_conf.get("schedule", [])])
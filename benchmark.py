@@ -0,0 +1,382 @@
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from compression import COMPRESSION_CODECS, DEFAULT_COMPRESSION_LEVEL, CompressionPolicy
+from drive_backend import FakeDriveBackend
+from fake_drive import FakeDriveStore
+from hash_pool import HashPool, default_hash_worker_count
+from synchronizer import Synchronizer, DEFAULT_CHUNK_SIZE
+from transfer_scheduler import DEFAULT_WORKER_COUNT
+
+OPERATIONS = ("upload", "download", "listing", "reset", "edit", "head", "sync", "hash", "startup")
+MATRIX_OPERATIONS = ("upload", "download", "listing", "reset", "edit", "head", "sync")
+DEFAULT_FILE_COUNTS = (10, 200)
+DEFAULT_FILE_SIZES = (1024, 1024 * 1024)
+DEFAULT_LATENCY = 0.01
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_REPEAT = 3
+TIME_SLACK = 0.05
+FILES_PER_FOLDER = 100
+# The edit scenario inserts this many bytes into the middle of every file after the first upload, shifting everything
+# behind it, and measures the upload of that change.
+EDIT_SIZE = 64
+# The head scenario reads this many bytes from the start of every file with open_remote instead of downloading it.
+HEAD_SIZE = 64 * 1024
+REPO_PATH = Path(__file__).resolve().parent
+BASELINE_PATH = REPO_PATH / "benchmark_baselines.json"
+# Work done before the first network operation: the command line console and the synchronizer the GUI creates. The
+# GUI itself needs a display and Windows' os.startfile, so its Tk setup is not part of this measurement.
+STARTUP_SCRIPTS = {"startup/cli": "import command_line_test; command_line_test.Console()",
+                   "startup/synchronizer": "import synchronizer; synchronizer.Synchronizer('files')"}
+STARTUP_PRELUDE = "import sys, time; start_time = time.perf_counter(); sys.path.insert(0, %r); "
+STARTUP_EPILOGUE = "; print(time.perf_counter() - start_time)"
+
+
+def size_label(size: int) -> str:
+    """
+    :param size: int number of bytes.
+    :return: str short human readable size, e.g. "1KiB".
+    """
+    for unit, factor in (("MiB", 1024 * 1024), ("KiB", 1024)):
+        if size >= factor and size % factor == 0:
+            return str(size // factor) + unit
+    return str(size) + "B"
+
+
+def scenario_name(operation: str, file_count: int, file_size: int) -> str:
+    return "%s/%dx%s" % (operation, file_count, size_label(file_size))
+
+
+def local_file_path(dir_path: Path, index: int) -> Path:
+    folder_index = index // FILES_PER_FOLDER
+    folder_path = dir_path if folder_index == 0 else dir_path / ("folder%03d" % folder_index)
+    return folder_path / ("file%05d.bin" % index)
+
+
+def write_local_files(dir_path: Path, file_count: int, file_size: int, random_content: bool = False):
+    """
+    Fill a folder with file_count files of file_size bytes, FILES_PER_FOLDER per sub folder after the first batch
+    so nested folders are exercised too.
+
+    :param random_content: bool True for seeded random bytes that do not repeat within a file, False for a pattern
+    that is quick to generate.
+    :return: None
+    """
+    for index in range(file_count):
+        file_path = local_file_path(dir_path, index)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if random_content:
+            content = random.Random(index).getrandbits(8 * file_size).to_bytes(file_size, "little")
+        else:
+            content = ("%08d" % index).encode("ascii") * (file_size // 8 + 1)
+        file_path.write_bytes(content[:file_size])
+
+
+def edit_local_files(dir_path: Path, file_count: int):
+    """
+    Insert EDIT_SIZE bytes into the middle of every file written by write_local_files.
+
+    :return: None
+    """
+    for index in range(file_count):
+        file_path = local_file_path(dir_path, index)
+        content = file_path.read_bytes()
+        middle = len(content) // 2
+        file_path.write_bytes(content[:middle] + b"e" * EDIT_SIZE + content[middle:])
+
+
+def run_scenario(operation: str, file_count: int, file_size: int, options) -> dict:
+    """
+    Run one benchmark scenario against a fresh fake Drive in a temporary working directory, so the state files of the
+    run never touch the real ones.
+
+    :param operation: str one of MATRIX_OPERATIONS. "edit" uploads files with EDIT_SIZE bytes inserted after a first
+    upload, so with deduplication the bytes sent track the size of the edit rather than of the files. "head" reads the
+    first HEAD_SIZE bytes of every file through open_remote, starting from a fresh listing. "sync" runs a two-way sync
+    of a folder that is already in sync, so it measures what a steady-state sync costs without changes.
+    :param file_count: int number of files in the synced folder.
+    :param file_size: int size in bytes of every file.
+    :param options: argparse.Namespace with the fake network and synchronizer settings.
+    :return: dict with seconds, requests and transferred bytes of the measured operation.
+    """
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            store = FakeDriveStore(options.rate_limit)
+            backend = FakeDriveBackend(store, options.latency, options.bandwidth, options.error_rate, options.seed)
+            local_path = Path(work_dir) / "local"
+            local_path.mkdir()
+            write_local_files(local_path, file_count, file_size, random_content=operation == "edit")
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                synchronizer = Synchronizer(str(local_path), options.workers, options.chunk_size, backend,
+                                            pack_threshold=options.pack_threshold,
+                                            dedup_threshold=options.dedup_threshold,
+                                            compression=compression_policy(options))
+                if operation != "upload":
+                    synchronizer.upload()
+                if operation in ("download", "head"):
+                    copy_path = Path(work_dir) / "copy"
+                    copy_path.mkdir()
+                    synchronizer = Synchronizer(str(copy_path), options.workers, options.chunk_size, backend,
+                                                pack_threshold=options.pack_threshold,
+                                                dedup_threshold=options.dedup_threshold,
+                                                compression=compression_policy(options))
+                elif operation == "edit":
+                    edit_local_files(local_path, file_count)
+                elif operation == "sync":
+                    synchronizer.sync()
+
+                store.reset_counters()
+                start_time = time.perf_counter()
+                if operation in ("upload", "edit"):
+                    synchronizer.upload()
+                elif operation == "download":
+                    synchronizer.download()
+                elif operation == "listing":
+                    synchronizer.refresh_remote_index()
+                elif operation == "sync":
+                    synchronizer.sync()
+                elif operation == "head":
+                    for file_name in synchronizer.get_drive_file_names():
+                        with synchronizer.open_remote(file_name) as remote_file:
+                            remote_file.read(HEAD_SIZE)
+                else:
+                    synchronizer.reset_drive()
+                seconds = time.perf_counter() - start_time
+        finally:
+            os.chdir(old_cwd)
+
+    return {"seconds": round(seconds, 4),
+            "requests": store.request_count(),
+            "bytes_uploaded": store.bytes_uploaded,
+            "bytes_downloaded": store.bytes_downloaded}
+
+
+def default_hash_worker_counts() -> list:
+    """
+    :return: list of int worker counts the hash scenario runs with: powers of two up to the number of cores, and the
+    number of cores itself.
+    """
+    core_count = default_hash_worker_count()
+    worker_counts = set([core_count])
+    worker_count = 1
+    while worker_count < core_count:
+        worker_counts.add(worker_count)
+        worker_count *= 2
+    return sorted(worker_counts)
+
+
+def run_hash(file_count: int, file_size: int, worker_count: int) -> dict:
+    """
+    Hash a folder of files with a HashPool of the given size and nothing in the hash cache, as on the first sync of a
+    large folder. The files were just written, so they are read from the OS page cache; the measurement shows how
+    hashing scales with cores rather than disk speed.
+
+    :param file_count: int number of files.
+    :param file_size: int size in bytes of every file.
+    :param worker_count: int number of hashing processes.
+    :return: dict with seconds of hashing every file; no requests or bytes are transferred.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        local_path = Path(work_dir) / "local"
+        write_local_files(local_path, file_count, file_size)
+        file_sizes = [(str(local_file_path(local_path, index)), file_size) for index in range(file_count)]
+        start_time = time.perf_counter()
+        for _ in HashPool(worker_count, min_pool_bytes=0).iter_hashes(file_sizes):
+            pass
+        seconds = time.perf_counter() - start_time
+    return {"seconds": round(seconds, 4),
+            "requests": 0,
+            "bytes_uploaded": 0,
+            "bytes_downloaded": 0}
+
+
+def run_startup(script: str) -> dict:
+    """
+    Measure a cold start in a fresh interpreter in an empty working directory, so no module or state file is cached.
+
+    :param script: str python statements that import and construct what a frontend needs before its first network
+    operation.
+    :return: dict with seconds from the first import until construction finished and process_seconds for the whole
+    interpreter run.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        Path(work_dir, "files").mkdir()
+        start_time = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_PRELUDE % str(REPO_PATH) + script + STARTUP_EPILOGUE],
+                                cwd=work_dir, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        process_seconds = time.perf_counter() - start_time
+    return {"seconds": round(float(output.split()[-1]), 4),
+            "process_seconds": round(process_seconds, 4),
+            "requests": 0,
+            "bytes_uploaded": 0,
+            "bytes_downloaded": 0}
+
+
+def list_scenarios(options) -> list:
+    """
+    :return: list of (str, callable) scenario names and functions running them once.
+    """
+    scenarios = []
+    for operation in options.operations:
+        if operation == "startup":
+            scenarios += [(name, lambda script=script: run_startup(script))
+                          for name, script in sorted(STARTUP_SCRIPTS.items())]
+            continue
+        if operation == "hash":
+            scenarios += [(scenario_name(operation, file_count, file_size) + "/%dw" % worker_count,
+                           lambda file_count=file_count, file_size=file_size, worker_count=worker_count:
+                           run_hash(file_count, file_size, worker_count))
+                          for file_count in options.file_counts for file_size in options.file_sizes
+                          for worker_count in options.hash_workers]
+            continue
+        for file_count in options.file_counts:
+            for file_size in options.file_sizes:
+                scenarios.append((scenario_name(operation, file_count, file_size),
+                                  lambda operation=operation, file_count=file_count, file_size=file_size:
+                                  run_scenario(operation, file_count, file_size, options)))
+    return scenarios
+
+
+def compression_policy(options) -> CompressionPolicy:
+    """
+    :return: CompressionPolicy selected by the options, None if uploads are not compressed.
+    """
+    if options.compression is None:
+        return None
+    return CompressionPolicy(options.compression, options.compression_level)
+
+
+def settings_of(options) -> dict:
+    """
+    :return: dict of the settings that affect results. Baselines are only compared when these match.
+    """
+    return {"latency": options.latency,
+            "bandwidth": options.bandwidth,
+            "error_rate": options.error_rate,
+            "rate_limit": options.rate_limit,
+            "workers": options.workers,
+            "chunk_size": options.chunk_size,
+            "pack_threshold": options.pack_threshold,
+            "dedup_threshold": options.dedup_threshold,
+            "compression": options.compression,
+            "compression_level": options.compression_level}
+
+
+def read_baselines(baseline_path: Path) -> dict:
+    try:
+        with open(baseline_path, "r") as baseline_file:
+            return json.load(baseline_file)
+    except (OSError, ValueError):
+        return {"settings": None, "results": dict()}
+
+
+def find_regressions(name: str, result: dict, baseline: dict, tolerance: float) -> list:
+    """
+    :param name: str scenario name.
+    :param result: dict measured result.
+    :param baseline: dict stored result of the same scenario.
+    :param tolerance: float allowed relative slowdown before wall time counts as a regression. TIME_SLACK seconds are
+    allowed on top so scheduling noise in very short scenarios does not count.
+    :return: list of str describing every regression. Request counts and transferred bytes are deterministic on the
+    fake backend, so any increase counts.
+    """
+    regressions = []
+    if result["seconds"] > baseline["seconds"] * (1 + tolerance) + TIME_SLACK:
+        regressions.append("%s: %.3fs, baseline %.3fs" % (name, result["seconds"], baseline["seconds"]))
+    for key in ("requests", "bytes_uploaded", "bytes_downloaded"):
+        if result[key] > baseline[key]:
+            regressions.append("%s: %d %s, baseline %d" % (name, result[key], key, baseline[key]))
+    return regressions
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Benchmark Simple-Sync against an in process fake Google Drive.")
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--file-counts", nargs="+", type=int, default=list(DEFAULT_FILE_COUNTS))
+    parser.add_argument("--file-sizes", nargs="+", type=int, default=list(DEFAULT_FILE_SIZES),
+                        help="file sizes in bytes")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second per connection")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a retryable request error")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="requests per second the fake account allows before it answers with rate limit errors")
+    parser.add_argument("--seed", type=int, default=0, help="seed for error injection")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKER_COUNT)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--pack-threshold", type=int, default=None,
+                        help="pack files up to this many bytes into pack objects")
+    parser.add_argument("--dedup-threshold", type=int, default=None,
+                        help="upload files from this many bytes as deduplicated content defined chunks")
+    parser.add_argument("--compression", choices=COMPRESSION_CODECS, default=None,
+                        help="compress uploads of compressible files with this codec")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help="1 (fastest) to 9 (smallest)")
+    parser.add_argument("--hash-workers", nargs="+", type=int, default=default_hash_worker_counts(),
+                        help="hashing process counts the hash scenario runs with")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown in wall time")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="runs per scenario, the fastest one is reported")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Run the benchmark matrix and compare it with the stored baseline.
+
+    :return: int exit status, 1 if a scenario failed or regressed.
+    """
+    options = parse_arguments(argv)
+    baselines = read_baselines(options.baseline)
+    compare = baselines["settings"] == settings_of(options)
+    if not compare and not options.save_baseline:
+        print("Baseline settings differ from this run, results are not compared.")
+
+    results = dict()
+    failures = []
+    for name, scenario in list_scenarios(options):
+        try:
+            result = min((scenario() for _ in range(max(1, options.repeat))),
+                         key=lambda run_result: run_result["seconds"])
+        except Exception as error:
+            print("%-24s failed: %s" % (name, error))
+            failures.append("FAILED %s: %s" % (name, error))
+            continue
+        results[name] = result
+        baseline = baselines["results"].get(name, None) if compare else None
+        line = "%-24s %8.3fs %6d requests" % (name, result["seconds"], result["requests"])
+        if baseline is not None:
+            line += "  (baseline %.3fs %d requests)" % (baseline["seconds"], baseline["requests"])
+            failures += ["REGRESSION " + regression
+                         for regression in find_regressions(name, result, baseline, options.tolerance)]
+        print(line)
+
+    if options.save_baseline:
+        if compare:
+            results = dict(baselines["results"], **results)
+        with open(options.baseline, "w") as baseline_file:
+            json.dump({"settings": settings_of(options), "results": results}, baseline_file, indent=2,
+                      sort_keys=True)
+        print("Saved baseline to " + str(options.baseline))
+
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+from collections import namedtuple
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+
+CHUNK_INDEX_PATH = Path("chunk_index.json")
+CHUNK_OBJECT_PREFIX = ".simple-sync-chunk-"
+# Value of the codec app property of a file whose content in Google Drive is a chunk manifest.
+CHUNKED_CODEC = "chunked"
+DEFAULT_DEDUP_THRESHOLD = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 128 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# A chunk ends after BOUNDARY_RUN bytes in a row that all fall into the boundary class, which on random data happens
+# about once per 2 ** (BOUNDARY_RUN + 1) bytes, so chunks average about 640KiB. The class of a byte depends on nothing
+# but its value, so boundaries follow the content: an insert or delete only moves the boundaries next to it.
+BOUNDARY_RUN = 18
+BOUNDARY_SCAN_SIZE = 256 * 1024
+_BOUNDARY_MARK = b"\x01" * BOUNDARY_RUN
+# Exactly half of the byte values, in a fixed pseudo random order, make up the boundary class.
+_BOUNDARY_VALUES = set(sorted(range(256), key=lambda value: hashlib.md5(b"simple-sync-chunk" + bytes([value])).digest())
+                       [:128])
+_BOUNDARY_TABLE = bytes(1 if value in _BOUNDARY_VALUES else 0 for value in range(256))
+
+ChunkRef = namedtuple("ChunkRef", ["digest", "offset", "length"])
+
+
+def is_chunk_object_name(file_name: str) -> bool:
+    """
+    Determine if a name in Google Drive is a chunk object rather than a synced file. Chunk objects live at the top of
+    the appDataFolder and the name prefix is reserved for them.
+
+    :param file_name: str path relative to the sync folder.
+    :return: True if the name belongs to a chunk object.
+    """
+    return "/" not in file_name and file_name.startswith(CHUNK_OBJECT_PREFIX)
+
+
+def chunk_object_name(digest: str) -> str:
+    return CHUNK_OBJECT_PREFIX + digest
+
+
+def find_boundary(data, start: int = 0, min_size: int = MIN_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE) -> int:
+    """
+    Find where the chunk starting at the given offset of data ends. The search runs in slices of BOUNDARY_SCAN_SIZE
+    bytes with bytes.translate and bytes.find, so it stops soon after the boundary without looking at every byte in
+    Python.
+
+    :param data: bytes or bytearray holding the chunk. Should hold at least max_size bytes from start unless the file
+    ends.
+    :param start: int offset of the chunk in data.
+    :param min_size: int smallest chunk size, except for the last chunk of a file.
+    :param max_size: int largest chunk size; a chunk without boundary is cut there.
+    :return: int length of the chunk.
+    """
+    limit = min(len(data), start + max_size)
+    position = start + min_size
+    while position < limit:
+        scan_start = position - BOUNDARY_RUN
+        scan_end = min(limit, position + BOUNDARY_SCAN_SIZE)
+        # Slices overlap by BOUNDARY_RUN bytes so runs crossing a slice border are found.
+        found = data[scan_start:scan_end].translate(_BOUNDARY_TABLE).find(_BOUNDARY_MARK)
+        if found >= 0:
+            return scan_start + found + BOUNDARY_RUN - start
+        position = scan_end
+    return limit - start
+
+
+def iter_chunks(file_obj, min_size: int = MIN_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE):
+    """
+    Generator splitting a file into content defined chunks. Memory use is bounded by about three times max_size.
+
+    :param file_obj: binary file object read to its end.
+    :return: generator of bytes chunks.
+    """
+    buffer = bytearray()
+    start = 0
+    end_of_file = False
+    while True:
+        if not end_of_file and len(buffer) - start < max_size:
+            # Consumed bytes are only dropped when refilling, not after every chunk.
+            del buffer[:start]
+            start = 0
+            while not end_of_file and len(buffer) < 2 * max_size:
+                block = file_obj.read(max_size)
+                if not block:
+                    end_of_file = True
+                buffer += block
+        if start >= len(buffer):
+            return
+        length = find_boundary(buffer, start, min_size, max_size)
+        yield bytes(buffer[start:start + length])
+        start += length
+
+
+def chunk_file(file_path) -> list:
+    """
+    :param file_path: str or Path of a local file.
+    :return: list of ChunkRef of the file's chunks in order, identified by their sha256 digest.
+    """
+    chunks = []
+    offset = 0
+    with open(str(file_path), "rb") as chunked_file:
+        for data in iter_chunks(chunked_file):
+            chunks.append(ChunkRef(hashlib.sha256(data).hexdigest(), offset, len(data)))
+            offset += len(data)
+    return chunks
+
+
+def manifest_to_bytes(chunks: list) -> bytes:
+    """
+    :param chunks: list of ChunkRef of a file.
+    :return: bytes gzipped json form of the manifest stored in Google Drive in place of the file's content.
+    """
+    return gzip.compress(json.dumps({"chunks": [[chunk.digest, chunk.length] for chunk in chunks]},
+                                    separators=(",", ":")).encode("utf-8"))
+
+
+def manifest_from_bytes(data: bytes) -> list:
+    """
+    :param data: bytes in the form written by manifest_to_bytes.
+    :return: list of ChunkRef of the file.
+    """
+    chunks = []
+    offset = 0
+    for digest, length in json.loads(gzip.decompress(data).decode("utf-8"))["chunks"]:
+        chunks.append(ChunkRef(digest, offset, length))
+        offset += length
+    return chunks
+
+
+def manifest_key(remote_file) -> str:
+    """
+    :param remote_file: RemoteFile of a chunked file.
+    :return: str key under which its manifest is cached. It changes whenever the manifest is replaced, also when that
+    happens twice within the resolution of the modified time.
+    """
+    return "%s@%s@%s" % (remote_file.id, remote_file.modified_time, remote_file.md5)
+
+
+class ChunkIndex:
+    def __init__(self, state_path: Path = CHUNK_INDEX_PATH):
+        """
+        Local index of chunks of large files: where the content of a chunk can be found on disk, by sha256 digest, and
+        the manifests of chunked files in Google Drive seen before. Finding out whether a chunk is available locally
+        is a dict lookup plus a stat of the file it was found in; the chunk is checked against its digest when read.
+        Safe to share between transfer worker threads.
+
+        :param state_path: Path to the json file the index is stored in.
+        """
+        self.state_path = Path(state_path)
+        self.lock = threading.RLock()
+        self.files = dict()
+        self.chunks = dict()
+        self.manifests = dict()
+
+    def read_state(self):
+        """
+        Read the index from disk. A missing or corrupt file results in an empty index.
+
+        :return: None
+        """
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            files = {file_path: (size, mtime_ns, self._refs(chunks))
+                     for file_path, (size, mtime_ns, chunks) in state["files"].items()}
+            manifests = {key: self._refs(chunks) for key, chunks in state["manifests"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            files = dict()
+            manifests = dict()
+        with self.lock:
+            self.files = dict()
+            self.chunks = dict()
+            for file_path, (size, mtime_ns, chunks) in files.items():
+                self._add_file(file_path, size, mtime_ns, chunks)
+            self.manifests = manifests
+
+    @staticmethod
+    def _refs(chunks: list) -> list:
+        refs = []
+        offset = 0
+        for digest, length in chunks:
+            refs.append(ChunkRef(digest, offset, length))
+            offset += length
+        return refs
+
+    def save(self):
+        """
+        Write the index to disk through a temporary file so a crash never leaves a truncated index behind.
+
+        :return: None
+        """
+        with self.lock:
+            state = {"files": {file_path: [size, mtime_ns, [[chunk.digest, chunk.length] for chunk in chunks]]
+                               for file_path, (size, mtime_ns, chunks) in self.files.items()},
+                     "manifests": {key: [[chunk.digest, chunk.length] for chunk in chunks]
+                                   for key, chunks in self.manifests.items()}}
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump(state, state_file, separators=(",", ":"))
+        os.replace(str(tmp_path), str(self.state_path))
+
+    def _add_file(self, file_path: str, size: int, mtime_ns: int, chunks: list):
+        self.files[file_path] = (size, mtime_ns, chunks)
+        for chunk in chunks:
+            self.chunks[chunk.digest] = (file_path, chunk)
+
+    def forget_file(self, file_path: str):
+        """
+        Forget the chunks of a local file, e.g. because it changed.
+
+        :return: None
+        """
+        with self.lock:
+            entry = self.files.pop(str(file_path), None)
+            if entry is None:
+                return
+            for chunk in entry[2]:
+                if self.chunks.get(chunk.digest, (None, None))[0] == str(file_path):
+                    del self.chunks[chunk.digest]
+
+    def record_file(self, file_path, chunks: list, stat: os.stat_result = None):
+        """
+        Remember where the chunks of a local file are.
+
+        :param file_path: str or Path of the local file.
+        :param chunks: list of ChunkRef of the file.
+        :param stat: os.stat_result of the file taken before it was chunked, None to stat it now.
+        :return: None
+        """
+        if stat is None:
+            stat = os.stat(str(file_path))
+        with self.lock:
+            self.forget_file(str(file_path))
+            self._add_file(str(file_path), stat.st_size, stat.st_mtime_ns, chunks)
+
+    def get_file_chunks(self, file_path) -> list:
+        """
+        :param file_path: str or Path of a local file.
+        :return: list of ChunkRef of the file, or None if it was not chunked since it last changed.
+        """
+        with self.lock:
+            entry = self.files.get(str(file_path), None)
+        if entry is None or not self._is_unchanged(str(file_path), entry):
+            return None
+        return entry[2]
+
+    def _is_unchanged(self, file_path: str, entry: tuple) -> bool:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return stat.st_size == entry[0] and stat.st_mtime_ns == entry[1]
+
+    def read_chunk(self, digest: str) -> bytes:
+        """
+        Read a chunk from a local file that contains it.
+
+        :param digest: str sha256 digest of the chunk.
+        :return: bytes content of the chunk, or None if no unchanged local file contains it.
+        """
+        with self.lock:
+            file_path, chunk = self.chunks.get(digest, (None, None))
+            entry = self.files.get(file_path, None)
+        if entry is None or not self._is_unchanged(file_path, entry):
+            return None
+        try:
+            with open(file_path, "rb") as chunk_file:
+                chunk_file.seek(chunk.offset)
+                data = chunk_file.read(chunk.length)
+        except OSError:
+            return None
+        return data if hashlib.sha256(data).hexdigest() == digest else None
+
+    def get_manifest(self, key: str) -> list:
+        """
+        :param key: str manifest_key of a chunked file in Google Drive.
+        :return: list of ChunkRef, or None if the manifest is not cached.
+        """
+        with self.lock:
+            return self.manifests.get(key, None)
+
+    def set_manifest(self, key: str, chunks: list):
+        with self.lock:
+            self.manifests[key] = chunks
+
+    def retain_manifests(self, keys):
+        """
+        Forget every cached manifest but the given ones.
+
+        :param keys: iterable of str manifest keys of the chunked files currently in Google Drive.
+        :return: None
+        """
+        keys = set(keys)
+        with self.lock:
+            self.manifests = {key: chunks for key, chunks in self.manifests.items() if key in keys}
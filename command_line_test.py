@@ -1,10 +1,19 @@
-from synchronizer import Synchronizer
+from configure_file_handler import ConfigurationHandler
+from metrics import print_progress_event
+from sync_roots import MultiRootSync
+from watcher import SyncWatcher
 
 
 class Console:
     def __init__(self):
         self.command = ""
-        self.syncer = Synchronizer()
+        self.conf_handler = ConfigurationHandler()
+        # Every command runs through the configured roots, so the primary root's synchronizer only ever touches its
+        # own remote folder.
+        self.multi_sync = MultiRootSync(self.conf_handler.get_roots(),
+                                        bandwidth=self.conf_handler.get_bandwidth_limiter())
+        self.multi_sync.metrics.subscribe(print_progress_event)
+        self.syncer = self.multi_sync.synchronizers[self.conf_handler.get_primary_root().name]
 
     def sync_test_file(self):
         self.syncer.download()
@@ -14,9 +23,33 @@ class Console:
         self.syncer.upload()
         print("Everything is uploaded.")
 
+    def two_way_sync(self):
+        self.syncer.sync()
+        print("Two-way sync finished.")
+
+    def show_sync_plan(self):
+        self.syncer.sync(dry_run=True)
+
+    def sync_all_roots(self):
+        errors = self.multi_sync.run()
+        for root_name, error in errors.items():
+            print(root_name, ":", "synced" if error is None else "failed (" + str(error) + ")")
+
     def reset_drive(self):
         self.syncer.reset_drive()
 
+    def watch(self):
+        watcher = SyncWatcher(self.syncer)
+        print("Watching for changes. Press Ctrl+C to stop...")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+        print("Stopped watching.")
+
+    def show_metrics(self):
+        print(self.syncer.metrics.to_prometheus(), end="")
+
     def get_command(self):
         self.command = input_get_str("> ").lower()
 
@@ -32,10 +65,20 @@ class Console:
             self.sync_test_file()
         elif self.command == "u":
             self.upload_test_file()
+        elif self.command == "b":
+            self.two_way_sync()
+        elif self.command == "p":
+            self.show_sync_plan()
+        elif self.command == "a":
+            self.sync_all_roots()
         elif self.command == "r":
             self.reset_drive()
         elif self.command == "l":
             self.list_files()
+        elif self.command == "w":
+            self.watch()
+        elif self.command == "m":
+            self.show_metrics()
         elif self.command == "q":
             # Handled in outer function
             pass
@@ -44,9 +87,12 @@ class Console:
 
     def run_command_prompt(self):
         print_start_message()
-        while not self.command == "q":
-            self.get_command()
-            self.process_command()
+        try:
+            while not self.command == "q":
+                self.get_command()
+                self.process_command()
+        finally:
+            self.multi_sync.close()
 
 
 """
@@ -69,9 +115,14 @@ def print_menu():
     menu = ("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n"
             "u - uploads all files in sync folder\n"
             "s - Downloads all files in drive\n"
+            "b - syncs both ways, applying changes made on either side\n"
+            "p - shows what b would do without changing anything\n"
+            "a - syncs every sync root in conf.json both ways at once\n"
             "h - displays this menu\n"
             "r - deletes all files in drive\n"
             "l - lists all files in drive\n"
+            "w - watches sync folder and syncs changes until Ctrl+C\n"
+            "m - shows api call, transfer and timing metrics\n"
             "q - exits menu\n"
             "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
     print(menu)
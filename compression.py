@@ -0,0 +1,165 @@
+from pathlib import Path
+import bz2
+import hashlib
+import lzma
+import zlib
+
+
+# Codec names as stored in the codec app property of a compressed file. All of them stream with bounded memory.
+COMPRESSION_CODECS = ("gzip", "bz2", "lzma")
+DEFAULT_COMPRESSION_CODEC = "gzip"
+DEFAULT_COMPRESSION_LEVEL = 6
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+# Files whose sample does not shrink below this fraction of its size are uploaded as they are.
+DEFAULT_MAX_RATIO = 0.9
+DEFAULT_MIN_COMPRESSION_SIZE = 4 * 1024
+# Formats that are compressed already, skipped without sampling.
+COMPRESSED_EXTENSIONS = frozenset([
+    ".7z", ".aac", ".apk", ".avi", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz", ".heic", ".jar", ".jpeg", ".jpg",
+    ".lz", ".lz4", ".lzma", ".m4a", ".mkv", ".mov", ".mp3", ".mp4", ".odt", ".ogg", ".opus", ".png", ".pptx", ".rar",
+    ".tgz", ".webm", ".webp", ".xlsx", ".xz", ".zip", ".zst"])
+# Formats that practically always compress well, compressed without sampling.
+COMPRESSIBLE_EXTENSIONS = frozenset([
+    ".csv", ".htm", ".html", ".ini", ".js", ".json", ".jsonl", ".log", ".md", ".py", ".sql", ".svg", ".tsv", ".txt",
+    ".xml", ".yaml", ".yml"])
+
+
+def is_compression_codec(codec: str) -> bool:
+    """
+    :param codec: str value of the codec app property of a file in Google Drive, None if it has none.
+    :return: True if the file's content in Google Drive is compressed with that codec.
+    """
+    return codec in COMPRESSION_CODECS
+
+
+def new_compressor(codec: str, level: int = DEFAULT_COMPRESSION_LEVEL):
+    """
+    :param codec: str one of COMPRESSION_CODECS.
+    :param level: int compression level, 1 (fastest) to 9 (smallest).
+    :return: compressor object with compress(bytes) and flush() methods.
+    """
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if codec == "bz2":
+        return bz2.BZ2Compressor(level)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError("Unknown compression codec: " + str(codec))
+
+
+def new_decompressor(codec: str):
+    """
+    :param codec: str one of COMPRESSION_CODECS.
+    :return: decompressor object with a decompress(bytes) method.
+    """
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    if codec == "bz2":
+        return bz2.BZ2Decompressor()
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    raise ValueError("Unknown compression codec: " + str(codec))
+
+
+def compress_stream(codec: str, level: int, source, out) -> tuple:
+    """
+    Compress a stream block by block.
+
+    :param codec: str one of COMPRESSION_CODECS.
+    :param level: int compression level.
+    :param source: binary file object read to its end.
+    :param out: binary file object the compressed data is written to.
+    :return: (str, int) md5 checksum and size of the uncompressed content.
+    """
+    compressor = new_compressor(codec, level)
+    md5_hash = hashlib.md5()
+    size = 0
+    while True:
+        block = source.read(COMPRESSION_BLOCK_SIZE)
+        if not block:
+            break
+        md5_hash.update(block)
+        size += len(block)
+        out.write(compressor.compress(block))
+    out.write(compressor.flush())
+    return md5_hash.hexdigest(), size
+
+
+def decompress_stream(codec: str, source, out) -> tuple:
+    """
+    Decompress a stream block by block. Output is produced in blocks of at most COMPRESSION_BLOCK_SIZE bytes, so
+    memory use stays bounded even for data that expands a lot.
+
+    :param codec: str one of COMPRESSION_CODECS.
+    :param source: binary file object of compressed data, read to its end.
+    :param out: binary file object the content is written to.
+    :return: (str, int) md5 checksum and size of the content.
+    """
+    decompressor = new_decompressor(codec)
+    md5_hash = hashlib.md5()
+    size = 0
+    while True:
+        data = source.read(COMPRESSION_BLOCK_SIZE)
+        if not data:
+            break
+        while True:
+            block = decompressor.decompress(data, COMPRESSION_BLOCK_SIZE)
+            md5_hash.update(block)
+            size += len(block)
+            out.write(block)
+            # zlib hands back the input it did not get to, bz2 and lzma keep it and ask for no new input until done.
+            if codec == "gzip":
+                data = decompressor.unconsumed_tail
+                if not data:
+                    break
+            else:
+                data = b""
+                if decompressor.eof or decompressor.needs_input:
+                    break
+    if not decompressor.eof:
+        raise ValueError("Compressed data ends before the end of the " + codec + " stream")
+    return md5_hash.hexdigest(), size
+
+
+class CompressionPolicy:
+    def __init__(self, codec: str = DEFAULT_COMPRESSION_CODEC, level: int = DEFAULT_COMPRESSION_LEVEL,
+                 max_ratio: float = DEFAULT_MAX_RATIO, min_size: int = DEFAULT_MIN_COMPRESSION_SIZE,
+                 sample_size: int = COMPRESSION_SAMPLE_SIZE):
+        """
+        Decides which files are compressed before they are uploaded. Files of well known compressed formats are
+        skipped and well known text formats are compressed right away; for anything else the first sample_size bytes
+        are compressed and the file is only compressed if that sample shrinks enough. A faster codec or lower level
+        trades upload bandwidth for CPU time, max_ratio sets how much a file has to shrink to be worth it.
+
+        :param codec: str one of COMPRESSION_CODECS.
+        :param level: int compression level, 1 (fastest) to 9 (smallest).
+        :param max_ratio: float compressed to original size ratio a sample has to stay below.
+        :param min_size: int size in bytes below which files are not compressed.
+        :param sample_size: int number of bytes compressed to estimate the ratio.
+        """
+        new_compressor(codec, level)
+        self.codec = codec
+        self.level = level
+        self.max_ratio = max_ratio
+        self.min_size = min_size
+        self.sample_size = sample_size
+
+    def choose_codec(self, file_path: str, size: int) -> str:
+        """
+        :param file_path: str path of the local file.
+        :param size: int size of the file in bytes.
+        :return: str codec to compress the file with, None to upload it as it is.
+        """
+        if size < self.min_size:
+            return None
+        extension = Path(file_path).suffix.lower()
+        if extension in COMPRESSED_EXTENSIONS:
+            return None
+        if extension in COMPRESSIBLE_EXTENSIONS:
+            return self.codec
+        with open(file_path, "rb") as sample_file:
+            sample = sample_file.read(self.sample_size)
+        compressor = new_compressor(self.codec, self.level)
+        compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+        return self.codec if compressed_size < len(sample) * self.max_ratio else None
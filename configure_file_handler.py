@@ -1,6 +1,9 @@
 from pathlib import Path
 import json
 
+from bandwidth import BandwidthLimiter
+from sync_roots import SyncRoot, LEGACY_ROOT_NAME, check_roots
+
 
 CONF_FILE_PATH = Path("conf.json")
 
@@ -23,8 +26,9 @@ class ConfigurationHandler:
     def conf_file_exists(self):
         try:
             if CONF_FILE_PATH.exists():
-                conf_file = open(CONF_FILE_PATH, "r")
-                json.load(conf_file)
+                with open(CONF_FILE_PATH, "r") as conf_file:
+                    json.load(conf_file)
+                return True
             else:
                 return False
         except:
@@ -39,6 +43,63 @@ class ConfigurationHandler:
         else:
             raise KeyError(conf_key)
 
+    def get_roots(self) -> list:
+        """
+        Sync roots described by the configuration. A configuration without a "roots" entry describes a single root,
+        the file_dir_path folder mirrored to the appDataFolder itself with its state in the working directory, so
+        existing setups keep working. Once there is a "roots" entry, file_dir_path only picks the primary root.
+
+        :return: list of SyncRoot.
+        :raises ValueError: if the roots cannot run side by side, see check_roots.
+        """
+        if "roots" not in self.conf:
+            return [SyncRoot(LEGACY_ROOT_NAME, self.conf["file_dir_path"], remote_path="", state_dir=Path("."))]
+        roots = [SyncRoot.from_dict(root_conf) for root_conf in self.conf["roots"]]
+        check_roots(roots)
+        return roots
+
+    def get_primary_root(self) -> SyncRoot:
+        """
+        :return: SyncRoot single root commands act on: the root whose local folder is file_dir_path, the first root if
+        there is none.
+        """
+        roots = self.get_roots()
+        dir_path = Path(self.conf.get("file_dir_path", ".")).resolve()
+        for root in roots:
+            if Path(root.file_dir_path).resolve() == dir_path:
+                return root
+        return roots[0]
+
+    def change_file_dir_path(self, new_dir: str):
+        """
+        Move the primary root to another local folder. Call save_conf to store the change.
+
+        :param new_dir: str path of the new local folder.
+        :return: None
+        """
+        primary_root_name = self.get_primary_root().name
+        for root_conf in self.conf.get("roots", []):
+            if root_conf["name"] == primary_root_name:
+                root_conf["file_dir_path"] = new_dir
+        self.conf["file_dir_path"] = new_dir
+
+    def set_roots(self, roots: list):
+        """
+        Replace the sync roots of the configuration. Call save_conf to store them.
+
+        :param roots: list of SyncRoot.
+        :return: None
+        """
+        self.conf["roots"] = [root.to_dict() for root in roots]
+
+    def get_bandwidth_limiter(self):
+        """
+        :return: BandwidthLimiter described by the "bandwidth" entry of the configuration, None if there is none.
+        """
+        if "bandwidth" not in self.conf:
+            return None
+        return BandwidthLimiter.from_dict(self.conf["bandwidth"])
+
     def save_conf(self):
         with open(CONF_FILE_PATH, "w") as conf_file:
             json.dump(self.conf, conf_file)
@@ -0,0 +1,244 @@
+from pathlib import Path
+import datetime
+import itertools
+import os
+import pickle
+import threading
+import time
+
+SCOPES = ["https://www.googleapis.com/auth/drive.appdata", "https://www.googleapis.com/auth/drive.file"]
+TOKEN_PATH = Path("token.pickle")
+CLIENT_SECRETS_PATH = Path("credentials.json")
+DISCOVERY_CACHE_PATH = Path("drive_v3_discovery.json")
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+DISCOVERY_MAX_AGE = 30 * 24 * 60 * 60
+TOKEN_REFRESH_MARGIN = 5 * 60
+TOKEN_REFRESH_RETRY_DELAY = 60
+
+_discovery_lock = threading.Lock()
+_discovery_document = None
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+
+def _read_discovery_cache(cache_path: Path, max_age: float):
+    try:
+        if max_age is not None and time.time() - os.path.getmtime(str(cache_path)) > max_age:
+            return None
+        with open(cache_path, "r") as cache_file:
+            return cache_file.read()
+    except OSError:
+        return None
+
+
+def _fetch_discovery_document() -> str:
+    """
+    :return: str Drive v3 discovery document, preferably the copy bundled with googleapiclient, otherwise fetched from
+    the discovery service.
+    """
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc("drive", "v3")
+        if document is not None:
+            return document
+    except ImportError:
+        pass
+    import httplib2
+    resp, content = httplib2.Http().request(DISCOVERY_URL)
+    if resp.status >= 400:
+        raise OSError("Could not fetch the Drive discovery document: HTTP %d" % resp.status)
+    return content.decode("utf-8")
+
+
+def load_discovery_document(cache_path: Path = DISCOVERY_CACHE_PATH) -> str:
+    """
+    Return the Drive v3 discovery document. It is read from disk at most once per process and only fetched when the
+    on disk copy is missing or older than DISCOVERY_MAX_AGE, so building a service object never waits for the network.
+
+    :param cache_path: Path of the on disk copy.
+    :return: str discovery document json.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is not None:
+            return _discovery_document
+        document = _read_discovery_cache(cache_path, DISCOVERY_MAX_AGE)
+        if document is None:
+            try:
+                document = _fetch_discovery_document()
+            except (OSError, ImportError):
+                # Offline, an outdated copy is still better than none.
+                document = _read_discovery_cache(cache_path, None)
+                if document is None:
+                    raise
+            else:
+                tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+                with open(tmp_path, "w") as cache_file:
+                    cache_file.write(document)
+                os.replace(str(tmp_path), str(cache_path))
+        _discovery_document = document
+        return document
+
+
+def shared_backend():
+    """
+    :return: GoogleDriveBackend shared by every handler in this process, so credentials are loaded once and kept fresh
+    by a single refresh thread.
+    """
+    global _shared_backend
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            _shared_backend = GoogleDriveBackend()
+        return _shared_backend
+
+
+class GoogleDriveBackend:
+    def __init__(self, token_path: Path = TOKEN_PATH):
+        """
+        Backend that talks to the real Google Drive api with the user's OAuth credentials. The Google libraries are
+        only imported once credentials or a service object are first needed, so creating handlers stays cheap.
+
+        :param token_path: Path of the pickled user credentials.
+        """
+        self.token_path = Path(token_path)
+        self.lock = threading.Lock()
+        self.creds = None
+        self.refresh_thread = None
+        self.stop_event = threading.Event()
+
+    def get_credentials(self):
+        """
+        Return the user's credentials, loading or prompting for them on first use. Later calls return the same
+        credentials object, which a background thread refreshes shortly before it expires.
+
+        :return: Credentials
+        """
+        with self.lock:
+            if self.creds is None:
+                self.creds = self.load_credentials()
+                self.start_refresh_thread()
+            return self.creds
+
+    def load_credentials(self):
+        """
+        Retrieves stored user credentials if one exists or prompts User to authorize application.
+
+        :return: Credentials
+        """
+        from google.auth.transport.requests import Request
+
+        creds = None
+        # The file token.pickle stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if self.token_path.exists() and self.token_path.stat().st_size > 0:
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    str(CLIENT_SECRETS_PATH), SCOPES)
+                creds = flow.run_local_server()
+            # Save the credentials for the next run
+            self.save_credentials(creds)
+        return creds
+
+    def save_credentials(self, creds):
+        tmp_path = self.token_path.with_name(self.token_path.name + ".tmp")
+        with open(tmp_path, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(str(tmp_path), str(self.token_path))
+
+    def start_refresh_thread(self):
+        if self.refresh_thread is None and getattr(self.creds, "refresh_token", None):
+            self.refresh_thread = threading.Thread(target=self.refresh_loop, name="token-refresh", daemon=True)
+            self.refresh_thread.start()
+
+    def refresh_loop(self):
+        """
+        Refresh the access token TOKEN_REFRESH_MARGIN seconds before it expires, so no api call has to wait for a
+        refresh. Runs until stop() is called.
+
+        :return: None
+        """
+        from google.auth.transport.requests import Request
+
+        while True:
+            expiry = getattr(self.creds, "expiry", None)
+            if expiry is None:
+                return
+            # google-auth keeps expiry as a naive UTC datetime.
+            delay = (expiry - datetime.datetime.utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN
+            if self.stop_event.wait(max(0, delay)):
+                return
+            try:
+                with self.lock:
+                    self.creds.refresh(Request())
+                    self.save_credentials(self.creds)
+            except Exception:
+                # Most likely offline; api calls refresh on their own if needed, try again later.
+                if self.stop_event.wait(TOKEN_REFRESH_RETRY_DELAY):
+                    return
+
+    def stop(self):
+        """
+        Stop the background token refresh.
+
+        :return: None
+        """
+        self.stop_event.set()
+
+    def build_service(self, creds):
+        """
+        :param creds: Credentials returned by get_credentials.
+        :return: Drive v3 service object with its own http connection, built from the cached discovery document.
+        """
+        from googleapiclient.discovery import build_from_document
+
+        return build_from_document(load_discovery_document(), credentials=creds)
+
+
+class FakeDriveBackend:
+    def __init__(self, store=None, latency: float = 0.0, bandwidth: float = None, error_rate: float = 0.0,
+                 seed: int = None):
+        """
+        Backend that serves the Drive api from an in process fake, so sync runs can be tested and benchmarked without
+        a Google account or network access. Every service object gets its own FakeDriveHttp on the shared store.
+
+        :param store: FakeDriveStore shared between all service objects. A new empty store is created if None.
+        :param latency: float seconds added to every request.
+        :param bandwidth: float bytes per second limit applied to every request, None for unlimited.
+        :param error_rate: float probability in [0, 1] that a request fails with a retryable 500 or 503 error.
+        :param seed: int seed for error injection. Each service object derives its own seed from it.
+        """
+        from fake_drive import FakeDriveStore
+
+        self.store = store if store is not None else FakeDriveStore()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.seed = seed
+        self.http_counter = itertools.count()
+
+    def get_credentials(self):
+        """
+        :return: None, the fake service does not check credentials.
+        """
+        return None
+
+    def build_service(self, creds):
+        """
+        :param creds: ignored.
+        :return: Drive v3 service object built from the cached discovery document on top of a FakeDriveHttp.
+        """
+        from googleapiclient.discovery import build_from_document
+        from fake_drive import FakeDriveHttp
+
+        http_index = next(self.http_counter)
+        seed = None if self.seed is None else self.seed + http_index
+        http = FakeDriveHttp(self.store, self.latency, self.bandwidth, self.error_rate, seed)
+        return build_from_document(load_discovery_document(), http=http)
@@ -0,0 +1,78 @@
+import threading
+
+from bandwidth import BandwidthLimiter
+from drive_backend import shared_backend
+from metrics import Metrics
+from request_executor import RequestExecutor
+from transfer_scheduler import TransferQueue, DEFAULT_WORKER_COUNT
+
+
+class DriveClient:
+    def __init__(self, backend=None, metrics: Metrics = None, executor: RequestExecutor = None,
+                 worker_count: int = DEFAULT_WORKER_COUNT, bandwidth: BandwidthLimiter = None):
+        """
+        Connection to Google Drive that several synchronizers share, e.g. one per sync root. They use the same
+        credentials, one service object per thread, one RequestExecutor, one queue of transfers and one bandwidth
+        limiter. That way every api call of the process goes through a single rate limiter, transfers of all roots are
+        ranked against each other, and running more roots costs no extra service builds or worker threads. Safe to
+        share between threads.
+
+        :param backend: object providing get_credentials() and build_service(creds), the GoogleDriveBackend shared by
+        the whole process if None.
+        :param metrics: Metrics recording the api calls and transfers of every synchronizer using this client.
+        :param executor: RequestExecutor retrying and rate limiting every api call, one allowing worker_count calls in
+        flight if None.
+        :param worker_count: int number of transfer worker threads shared by every synchronizer.
+        :param bandwidth: BandwidthLimiter capping the transfers of every synchronizer together, None for no limit.
+        """
+        self.backend = backend if backend is not None else shared_backend()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.executor = executor if executor is not None else RequestExecutor(worker_count, metrics=self.metrics)
+        self.worker_count = max(1, worker_count)
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+        self.creds = None
+        self.creds_loaded = False
+        self.queue = None
+
+    def get_credentials(self):
+        """
+        :return: Credentials loaded once for every synchronizer using this client.
+        """
+        with self.lock:
+            if not self.creds_loaded:
+                self.creds = self.backend.get_credentials()
+                self.creds_loaded = True
+            return self.creds
+
+    def service(self):
+        """
+        :return: Drive service object of the calling thread, built on its first call. Service objects are not
+        thread-safe, so every thread gets its own, shared by all synchronizers running on that thread.
+        """
+        service = getattr(self.thread_local, "service", None)
+        if service is None:
+            service = self.thread_local.service = self.backend.build_service(self.get_credentials())
+        return service
+
+    def transfer_queue(self) -> TransferQueue:
+        """
+        :return: TransferQueue running the transfers of every synchronizer using this client, created on first use.
+        """
+        with self.lock:
+            if self.queue is None:
+                self.queue = TransferQueue(self.worker_count)
+            return self.queue
+
+    def close(self):
+        """
+        Stop the transfer worker threads once the transfers queued so far are done.
+
+        :return: None
+        """
+        with self.lock:
+            queue = self.queue
+            self.queue = None
+        if queue is not None:
+            queue.shutdown(wait=True)
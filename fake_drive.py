@@ -0,0 +1,419 @@
+from email.parser import FeedParser
+from urllib.parse import urlsplit, parse_qs, unquote
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+import httplib2
+
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+ROOT_URL = "https://www.googleapis.com"
+APP_DATA_FOLDER = "appDataFolder"
+APP_DATA_FOLDER_ID = "fakeAppDataFolderId"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _now_rfc3339() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + ".000Z"
+
+
+class FakeDriveStore:
+    def __init__(self, rate_limit: float = None):
+        """
+        In memory state of a fake Google Drive: files, upload sessions and the change log. Shared by every
+        FakeDriveHttp that talks to the same fake account so concurrent clients see the same data.
+
+        :param rate_limit: float requests per second the fake account allows before it answers with 403
+        userRateLimitExceeded like Google Drive, None for no quota.
+        """
+        self.lock = threading.RLock()
+        self.rate_limit = rate_limit
+        self.quota_tokens = rate_limit
+        self.quota_time = time.monotonic()
+        self.files = dict()
+        self.sessions = dict()
+        self.changes = []
+        self.id_counter = itertools.count(1)
+        self.request_counts = dict()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def reset_counters(self):
+        """
+        Zero the request and byte counters, e.g. after preparing a benchmark.
+
+        :return: None
+        """
+        with self.lock:
+            self.request_counts = dict()
+            self.bytes_uploaded = 0
+            self.bytes_downloaded = 0
+
+    def request_count(self) -> int:
+        """
+        :return: int number of http requests served since the counters were last reset. A batch request counts once.
+        """
+        with self.lock:
+            return sum(self.request_counts.values())
+
+    def take_quota(self) -> bool:
+        """
+        Spend one request of the per second quota. The quota refills continuously and allows bursts of up to one
+        second worth of requests.
+
+        :return: bool False if the request exceeds the quota.
+        """
+        if self.rate_limit is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.quota_tokens = min(self.rate_limit, self.quota_tokens + (now - self.quota_time) * self.rate_limit)
+            self.quota_time = now
+            if self.quota_tokens < 1:
+                return False
+            self.quota_tokens -= 1
+            return True
+
+    def new_id(self, prefix: str = "fake") -> str:
+        return "%s%08d" % (prefix, next(self.id_counter))
+
+    def resource(self, file: dict) -> dict:
+        """
+        :param file: dict stored file.
+        :return: dict file resource as the Drive api would return it, without content.
+        """
+        return {key: value for key, value in file.items() if key != "content"}
+
+    def set_content(self, file: dict, content: bytes):
+        """
+        Store new file content together with its size and md5Checksum, so listings do not hash every file again.
+
+        :return: None
+        """
+        file["content"] = content
+        if file["mimeType"] != FOLDER_MIME_TYPE:
+            file["size"] = str(len(content))
+            file["md5Checksum"] = hashlib.md5(content).hexdigest()
+
+    def resolve_id(self, file_id: str) -> str:
+        """
+        :param file_id: str file id or the appDataFolder alias.
+        :return: str file id with the alias replaced by the real id of the appDataFolder.
+        """
+        return APP_DATA_FOLDER_ID if file_id == APP_DATA_FOLDER else file_id
+
+    def record_change(self, file_id: str, removed: bool):
+        file = self.files.get(file_id, None)
+        self.changes.append({"kind": "drive#change",
+                             "fileId": file_id,
+                             "removed": removed,
+                             "file": None if removed else self.resource(file)})
+
+    def create(self, metadata: dict, content: bytes = b"") -> dict:
+        file = {"id": self.new_id(),
+                "name": metadata.get("name", "Untitled"),
+                "mimeType": metadata.get("mimeType", "application/octet-stream"),
+                "parents": [self.resolve_id(parent) for parent in metadata.get("parents", [APP_DATA_FOLDER])],
+                "appProperties": dict(metadata.get("appProperties", {})),
+                "modifiedTime": _now_rfc3339(),
+                "trashed": False}
+        self.set_content(file, content)
+        self.files[file["id"]] = file
+        self.record_change(file["id"], False)
+        return file
+
+    def update(self, file_id: str, metadata: dict, content: bytes = None) -> dict:
+        file = self.files[file_id]
+        if "name" in metadata:
+            file["name"] = metadata["name"]
+        if "appProperties" in metadata:
+            for key, value in metadata["appProperties"].items():
+                if value is None:
+                    file["appProperties"].pop(key, None)
+                else:
+                    file["appProperties"][key] = value
+        if content is not None:
+            self.set_content(file, content)
+        file["modifiedTime"] = _now_rfc3339()
+        self.record_change(file_id, False)
+        return file
+
+    def delete(self, file_id: str):
+        del self.files[file_id]
+        self.record_change(file_id, True)
+        for child_id in [child_id for child_id, file in self.files.items() if file_id in file["parents"]]:
+            if child_id in self.files:
+                self.delete(child_id)
+
+
+class FakeDriveHttp:
+    def __init__(self, store: FakeDriveStore = None, latency: float = 0.0, bandwidth: float = None,
+                 error_rate: float = 0.0, seed: int = None):
+        """
+        httplib2.Http compatible object that serves the subset of the Drive v3 REST api used by Simple-Sync from an
+        in memory FakeDriveStore. Latency, bandwidth and error rate can be injected to emulate real networks.
+
+        :param store: FakeDriveStore shared between clients. A new empty store is created if None.
+        :param latency: float seconds added to every request.
+        :param bandwidth: float bytes per second limit applied to request and response bodies, None for unlimited.
+        :param error_rate: float probability in [0, 1] that a request fails with a retryable 500 or 503 error.
+        :param seed: int seed for the error injection random generator.
+        """
+        self.store = store if store is not None else FakeDriveStore()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        Serve a single http request.
+
+        :return: (httplib2.Response, bytes) like httplib2.Http.request.
+        """
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        if body is not None and hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.store.take_quota():
+            with self.store.lock:
+                self.store.request_counts["rate limited"] = self.store.request_counts.get("rate limited", 0) + 1
+            return self._json_response(403, {"error": {"code": 403, "message": "User Rate Limit Exceeded",
+                                                       "errors": [{"reason": "userRateLimitExceeded"}]}})
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.store.lock:
+                self.store.request_counts["injected error"] = self.store.request_counts.get("injected error", 0) + 1
+            status = self.random.choice([500, 503])
+            return self._json_response(status, {"error": {"code": status, "message": "Injected error",
+                                                          "errors": [{"reason": "backendError"}]}})
+
+        parsed = urlsplit(uri)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        with self.store.lock:
+            endpoint = method + " " + parsed.path
+            self.store.request_counts[endpoint] = self.store.request_counts.get(endpoint, 0) + 1
+            resp, content = self._dispatch(method, parsed.path, query, headers, body)
+
+        if self.bandwidth:
+            time.sleep((len(body) + len(content)) / self.bandwidth)
+        return resp, content
+
+    def _dispatch(self, method, path, query, headers, body):
+        store = self.store
+        match = re.match(r"^/drive/v3/files/([^/]+)$", path)
+        if path == "/drive/v3/files" and method == "GET":
+            return self._list_files(query)
+        if path == "/drive/v3/files" and method == "POST":
+            metadata = json.loads(body.decode("utf-8") or "{}")
+            if self._missing_parent(metadata):
+                return self._json_response(404, {"error": {"code": 404, "message": "Parent not found"}})
+            file = store.create(metadata)
+            return self._json_response(200, store.resource(file))
+        if match is not None:
+            file_id = store.resolve_id(unquote(match.group(1)))
+            if file_id == APP_DATA_FOLDER_ID and method == "GET":
+                return self._json_response(200, {"id": APP_DATA_FOLDER_ID, "name": APP_DATA_FOLDER,
+                                                 "mimeType": FOLDER_MIME_TYPE})
+            if file_id not in store.files:
+                return self._json_response(404, {"error": {"code": 404, "message": "File not found: " + file_id,
+                                                           "errors": [{"reason": "notFound"}]}})
+            if method == "GET" and query.get("alt") == "media":
+                return self._download(store.files[file_id], headers)
+            if method == "GET":
+                return self._json_response(200, store.resource(store.files[file_id]))
+            if method == "PATCH":
+                file = store.update(file_id, json.loads(body.decode("utf-8") or "{}"))
+                return self._json_response(200, store.resource(file))
+            if method == "DELETE":
+                store.delete(file_id)
+                return httplib2.Response({"status": 204}), b""
+        if path in ("/upload/drive/v3/files", ) or path.startswith("/upload/drive/v3/files/"):
+            return self._start_upload(method, path, query, headers, body)
+        if path.startswith("/upload/sessions/"):
+            return self._upload_chunk(path.rsplit("/", 1)[1], headers, body)
+        if path == "/batch/drive/v3" and method == "POST":
+            return self._batch(headers, body)
+        if path == "/drive/v3/changes/startPageToken":
+            return self._json_response(200, {"startPageToken": str(len(store.changes))})
+        if path == "/drive/v3/changes":
+            return self._list_changes(query)
+        return self._json_response(400, {"error": {"code": 400, "message": "Unsupported request " + path}})
+
+    def _missing_parent(self, metadata: dict) -> bool:
+        return any(self.store.resolve_id(parent) != APP_DATA_FOLDER_ID and self.store.resolve_id(parent) not in
+                   self.store.files for parent in metadata.get("parents", []))
+
+    def _json_response(self, status: int, data: dict):
+        return httplib2.Response({"status": status, "content-type": "application/json"}), \
+            json.dumps(data).encode("utf-8")
+
+    def _list_files(self, query: dict):
+        files = [file for file in self.store.files.values() if self._matches(file, query.get("q", ""))]
+        files.sort(key=lambda file: (file["name"], file["id"]))
+        page_size = min(int(query.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        start = int(query.get("pageToken", 0))
+        result = {"files": [self.store.resource(file) for file in files[start:start + page_size]]}
+        if start + page_size < len(files):
+            result["nextPageToken"] = str(start + page_size)
+        return self._json_response(200, result)
+
+    def _matches(self, file: dict, q: str) -> bool:
+        for clause in [clause.strip() for clause in re.split(r"\s+and\s+", q) if clause.strip()]:
+            match = re.match(r"^(name|mimeType)\s*(=|!=)\s*'(.*)'$", clause)
+            if match is not None:
+                value = match.group(3).replace("\\'", "'")
+                if (file[match.group(1)] == value) != (match.group(2) == "="):
+                    return False
+                continue
+            match = re.match(r"^'(.*)'\s+in\s+parents$", clause)
+            if match is not None:
+                if self.store.resolve_id(match.group(1)) not in file["parents"]:
+                    return False
+                continue
+            match = re.match(r"^trashed\s*=\s*(true|false)$", clause)
+            if match is not None:
+                if file["trashed"] != (match.group(1) == "true"):
+                    return False
+                continue
+            raise ValueError("Unsupported query clause: " + clause)
+        return True
+
+    def _download(self, file: dict, headers: dict):
+        content = file["content"]
+        total = len(content)
+        range_header = headers.get("range", None)
+        if range_header is None:
+            self.store.bytes_downloaded += total
+            return httplib2.Response({"status": 200, "content-length": str(total)}), content
+        start, end = range_header.split("=", 1)[1].split("-")
+        start = int(start)
+        end = min(int(end) if end else total - 1, total - 1)
+        if start >= total:
+            return httplib2.Response({"status": 416, "content-range": "bytes */%d" % total}), b""
+        self.store.bytes_downloaded += end - start + 1
+        return httplib2.Response({"status": 206, "content-range": "bytes %d-%d/%d" % (start, end, total)}), \
+            content[start:end + 1]
+
+    def _start_upload(self, method, path, query, headers, body):
+        file_id = path.rsplit("/", 1)[1] if path.startswith("/upload/drive/v3/files/") else None
+        if file_id is not None and file_id not in self.store.files:
+            return self._json_response(404, {"error": {"code": 404, "message": "File not found: " + file_id}})
+        if query.get("uploadType") == "multipart":
+            metadata, content = self._parse_multipart_related(headers, body)
+            if file_id is None:
+                file = self.store.create(metadata, content)
+            else:
+                file = self.store.update(file_id, metadata, content)
+            self.store.bytes_uploaded += len(content)
+            return self._json_response(200, self.store.resource(file))
+        if query.get("uploadType") == "media":
+            if file_id is None:
+                file = self.store.create({}, body or b"")
+            else:
+                file = self.store.update(file_id, {}, body or b"")
+            self.store.bytes_uploaded += len(body or b"")
+            return self._json_response(200, self.store.resource(file))
+        metadata = json.loads(body.decode("utf-8") or "{}")
+        if self._missing_parent(metadata):
+            return self._json_response(404, {"error": {"code": 404, "message": "Parent not found"}})
+        session_id = self.store.new_id("session")
+        self.store.sessions[session_id] = {"file_id": file_id,
+                                           "metadata": metadata,
+                                           "content": bytearray()}
+        return httplib2.Response({"status": 200,
+                                  "location": ROOT_URL + "/upload/sessions/" + session_id}), b""
+
+    def _parse_multipart_related(self, headers: dict, body: bytes):
+        parser = FeedParser()
+        parser.feed("content-type: %s\r\n\r\n" % headers["content-type"])
+        parser.feed(body.decode("latin-1"))
+        parts = parser.close().get_payload()
+        metadata = json.loads(parts[0].get_payload())
+        content = parts[1].get_payload().encode("latin-1")
+        return metadata, content
+
+    def _upload_chunk(self, session_id: str, headers: dict, body: bytes):
+        session = self.store.sessions.get(session_id, None)
+        if session is None:
+            return self._json_response(404, {"error": {"code": 404, "message": "Upload session expired"}})
+        content_range = headers.get("content-range", None)
+        total = None
+        if content_range is not None:
+            range_str, total_str = content_range.split(" ", 1)[1].split("/")
+            total = None if total_str == "*" else int(total_str)
+            if range_str != "*":
+                start = int(range_str.split("-")[0])
+                if start != len(session["content"]):
+                    return self._json_response(400, {"error": {"code": 400, "message": "Invalid range"}})
+                session["content"] += body
+                self.store.bytes_uploaded += len(body)
+        else:
+            total = len(body)
+            session["content"] += body
+
+        if total is not None and len(session["content"]) >= total:
+            del self.store.sessions[session_id]
+            if session["file_id"] is None:
+                file = self.store.create(session["metadata"], bytes(session["content"]))
+            else:
+                file = self.store.update(session["file_id"], session["metadata"], bytes(session["content"]))
+            return self._json_response(200, self.store.resource(file))
+
+        response = {"status": 308}
+        if len(session["content"]) > 0:
+            response["range"] = "bytes=0-%d" % (len(session["content"]) - 1)
+        return httplib2.Response(response), b""
+
+    def _batch(self, headers: dict, body: bytes):
+        parser = FeedParser()
+        parser.feed("content-type: %s\r\n\r\n" % headers["content-type"])
+        parser.feed(body.decode("utf-8"))
+        boundary = "fake_batch_boundary"
+        response_parts = []
+        for part in parser.close().get_payload():
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, request_uri = request_line.split(" ")[0:2]
+            inner_header_str, _, inner_body = rest.replace("\r\n", "\n").partition("\n\n")
+            inner_headers = dict()
+            for line in inner_header_str.split("\n"):
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    inner_headers[key.strip().lower()] = value.strip()
+            parsed = urlsplit(request_uri)
+            query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+            resp, content = self._dispatch(method, parsed.path, query, inner_headers,
+                                           inner_body.encode("utf-8"))
+            response_parts.append("--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n"
+                                  "HTTP/1.1 %d OK\r\nContent-Type: application/json\r\n\r\n%s\r\n"
+                                  % (boundary, part["Content-ID"][1:-1], resp.status, content.decode("utf-8")))
+        content = "".join(response_parts) + "--%s--\r\n" % boundary
+        return httplib2.Response({"status": 200,
+                                  "content-type": 'multipart/mixed; boundary="%s"' % boundary}), \
+            content.encode("utf-8")
+
+    def _list_changes(self, query: dict):
+        try:
+            start = int(query["pageToken"])
+        except ValueError:
+            start = -1
+        if not 0 <= start <= len(self.store.changes):
+            return self._json_response(400, {"error": {"code": 400, "message": "Invalid value for pageToken"}})
+        page_size = min(int(query.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        changes = self.store.changes[start:start + page_size]
+        result = {"changes": changes}
+        if start + page_size < len(self.store.changes):
+            result["nextPageToken"] = str(start + page_size)
+        else:
+            result["newStartPageToken"] = str(len(self.store.changes))
+        return self._json_response(200, result)
@@ -0,0 +1,154 @@
+from pathlib import Path
+import json
+import os
+import threading
+
+
+FOLDER_CACHE_PATH = Path("folder_cache.json")
+ROOT_FOLDER_ID = "appDataFolder"
+
+
+def parent_path(rel_path: str) -> str:
+    """
+    :param rel_path: str posix path relative to the sync folder, e.g. "a/b/c.txt".
+    :return: str relative path of the containing folder, "" for the sync folder itself.
+    """
+    if "/" not in rel_path:
+        return ""
+    return rel_path.rsplit("/", 1)[0]
+
+
+def base_name(rel_path: str) -> str:
+    """
+    :param rel_path: str posix path relative to the sync folder, e.g. "a/b/c.txt".
+    :return: str last component of the path.
+    """
+    return rel_path.rsplit("/", 1)[-1]
+
+
+class FolderCache:
+    def __init__(self, cache_path: Path = FOLDER_CACHE_PATH, root_path: str = ""):
+        """
+        In memory and on disk cache of Google Drive folder ids by path relative to the sync folder, so resolving the
+        parent of a deeply nested file does not cost one lookup per level. The sync folder itself is the
+        appDataFolder, or the folder at root_path inside it, cached under the empty path once its real id is known.
+        Safe to share between transfer worker threads.
+
+        :param cache_path: Path to the json file the cache is stored in.
+        :param root_path: str posix path of the folder inside the appDataFolder the sync folder is mirrored to, e.g.
+        "photos", or "" for the appDataFolder itself.
+        """
+        self.cache_path = Path(cache_path)
+        self.root_path = root_path.strip("/")
+        self.lock = threading.RLock()
+        self.ids_by_path = dict()
+        self.paths_by_id = dict()
+        self.read_cache()
+
+    def read_cache(self):
+        """
+        Read cached folder ids from disk. A missing or corrupt cache file results in an empty cache.
+
+        :return: None
+        """
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                self.replace_all(json.load(cache_file))
+        except (OSError, ValueError, AttributeError):
+            self.replace_all(dict())
+
+    def save(self):
+        """
+        Write cached folder ids to disk through a temporary file so a crash never leaves a truncated cache.
+
+        :return: None
+        """
+        with self.lock:
+            tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+            with open(tmp_path, "w") as cache_file:
+                json.dump(self.ids_by_path, cache_file)
+            os.replace(str(tmp_path), str(self.cache_path))
+
+    def replace_all(self, ids_by_path: dict):
+        """
+        Replace the whole cache, e.g. with the result of a fresh folder listing.
+
+        :param ids_by_path: dict of folder id indexed by relative folder path.
+        :return: None
+        """
+        with self.lock:
+            self.ids_by_path = dict(ids_by_path)
+            self.paths_by_id = {folder_id: folder_path for folder_path, folder_id in self.ids_by_path.items()}
+
+    def get_id(self, folder_path: str) -> str:
+        """
+        :param folder_path: str relative folder path, "" for the sync folder.
+        :return: str folder id or None if the folder is not cached.
+        """
+        with self.lock:
+            if folder_path == "":
+                return self.ids_by_path.get("", ROOT_FOLDER_ID if self.root_path == "" else None)
+            return self.ids_by_path.get(folder_path, None)
+
+    def get_path(self, folder_id: str) -> str:
+        """
+        :param folder_id: str Google Drive folder id.
+        :return: str relative folder path or None if the folder is not cached.
+        """
+        with self.lock:
+            return self.paths_by_id.get(folder_id, None)
+
+    def set_id(self, folder_path: str, folder_id: str):
+        """
+        :param folder_path: str relative folder path.
+        :param folder_id: str Google Drive folder id.
+        :return: None
+        """
+        with self.lock:
+            self.ids_by_path[folder_path] = folder_id
+            self.paths_by_id[folder_id] = folder_path
+
+    def remove(self, folder_path: str):
+        """
+        Forget a folder and every folder below it.
+
+        :param folder_path: str relative folder path.
+        :return: None
+        """
+        with self.lock:
+            prefix = folder_path + "/"
+            for cached_path in [cached_path for cached_path in self.ids_by_path
+                                if cached_path == folder_path or cached_path.startswith(prefix)]:
+                self.paths_by_id.pop(self.ids_by_path.pop(cached_path), None)
+
+    def has_root_id(self) -> bool:
+        """
+        :return: True if the real id of the sync folder's folder in Google Drive is cached.
+        """
+        with self.lock:
+            return "" in self.ids_by_path
+
+    def folder_paths(self):
+        """
+        :return: list of all cached relative folder paths, excluding the sync folder itself.
+        """
+        with self.lock:
+            return [folder_path for folder_path in self.ids_by_path if folder_path != ""]
+
+    def resolve_path(self, file_info: dict) -> str:
+        """
+        Determine the relative path of a Google Drive file from its parent folder.
+
+        :param file_info: dict file resource with name and parents fields.
+        :return: str relative path of the file or None if its parent folder is not cached, e.g. because it is outside
+        root_path.
+        """
+        parents = file_info.get("parents", None)
+        if not parents or parents[0] == ROOT_FOLDER_ID:
+            return file_info["name"] if self.root_path == "" else None
+        folder_path = self.get_path(parents[0])
+        if folder_path is None:
+            return None
+        if folder_path == "":
+            return file_info["name"]
+        return folder_path + "/" + file_info["name"]
@@ -1,13 +1,26 @@
 from tkinter import *
 from tkinter import ttk, filedialog
 from configure_file_handler import ConfigurationHandler
+from collections import deque
 from pathlib import Path
+from queue import Queue, Empty
 from time import ctime
 from os import startfile
-from synchronizer import Synchronizer
+import threading
+import time
+from local_tree import scan_dir_entries
+from metrics import ProgressEvent, print_progress_event
+from request_executor import SyncCancelled
 
 
 IMG_DIR = Path("res/")
+FRAME_INTERVAL_MS = 16
+MAX_EVENTS_PER_FRAME = 2000
+RATE_WINDOW = 3.0
+SCAN_BATCH_SIZE = 500
+SCAN_FRAME_BUDGET = 0.008
+DEFAULT_ROW_HEIGHT = 20
+WHEEL_ROWS = 3
 
 
 # Static Helper Functions
@@ -15,16 +28,115 @@ def convert_b_to_kb_str(num: int):
     return str(round(num / 1000.0)) + " KB"
 
 
+def convert_b_to_size_str(num: float):
+    for unit, factor in (("GB", 1000.0 ** 3), ("MB", 1000.0 ** 2), ("KB", 1000.0)):
+        if num >= factor:
+            return "%.1f %s" % (num / factor, unit)
+    return "%d B" % num
+
+
+def convert_seconds_to_eta_str(seconds: float):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return "%d:%02d" % (seconds // 60, seconds % 60)
+
+
 def path_str_to_photo_image(path_str: str):
     path_str = Path(path_str).resolve()
     photo_img = PhotoImage(file=path_str)
     return photo_img
 
 
+class SyncProgress:
+    def __init__(self):
+        """
+        Aggregate the progress events of one sync operation into per-file status and overall bytes, rate and ETA.
+        Only used on the Tk thread.
+        """
+        self.file_sizes = dict()
+        self.file_done = dict()
+        self.samples = deque()
+
+    def add_event(self, event: ProgressEvent):
+        """
+        :param event: ProgressEvent emitted by the Synchronizer.
+        :return: str new status of the file the event is about or None if the event is not about a transfer.
+        """
+        if event.kind == "transfer_queued":
+            self.file_sizes[event.name] = event.total or 0
+            self.file_done[event.name] = 0
+            return "Queued"
+        if event.kind in ("download_progress", "upload_progress"):
+            if event.total is not None:
+                self.file_sizes[event.name] = event.total
+            self.file_done[event.name] = event.done
+            return "%d%%" % (100 if not event.total else event.done * 100 // event.total)
+        if event.kind == "transfer_finished":
+            if event.message is not None:
+                return "Failed"
+            self.file_done[event.name] = self.file_sizes.get(event.name, self.file_done.get(event.name, 0))
+            return "Done"
+        return None
+
+    def done_bytes(self) -> int:
+        return sum(self.file_done.values())
+
+    def total_bytes(self) -> int:
+        return sum(self.file_sizes.values())
+
+    def sample(self, now: float):
+        """
+        Remember the bytes transferred so far, so the rate is measured over the last RATE_WINDOW seconds.
+
+        :param now: float monotonic time.
+        :return: None
+        """
+        self.samples.append((now, self.done_bytes()))
+        while len(self.samples) > 2 and self.samples[0][0] < now - RATE_WINDOW:
+            self.samples.popleft()
+
+    def bytes_per_second(self) -> float:
+        if len(self.samples) < 2 or self.samples[-1][0] <= self.samples[0][0]:
+            return 0.0
+        (start_time, start_bytes), (end_time, end_bytes) = self.samples[0], self.samples[-1]
+        return max(0.0, (end_bytes - start_bytes) / (end_time - start_time))
+
+    def summary(self) -> str:
+        """
+        :return: str overall progress, e.g. "12.0 MB of 1.2 GB, 4.5 MB/s, 4:27 left".
+        """
+        done_bytes = self.done_bytes()
+        total_bytes = self.total_bytes()
+        text = convert_b_to_size_str(done_bytes) + " of " + convert_b_to_size_str(total_bytes)
+        rate = self.bytes_per_second()
+        if rate > 0:
+            text += ", " + convert_b_to_size_str(rate) + "/s, " + \
+                    convert_seconds_to_eta_str(max(0, total_bytes - done_bytes) / rate) + " left"
+        return text
+
+
 class SimplySyncGui:
     def __init__(self):
         self.conf_handler = ConfigurationHandler()
-        self.sync_handler = Synchronizer(self.conf_handler.get_conf_entry("file_dir_path"))
+        # Only the primary root is shown, synced within its own remote folder so the other roots are left alone.
+        self.sync_handler = self.conf_handler.get_primary_root().new_synchronizer(
+            bandwidth=self.conf_handler.get_bandwidth_limiter())
+        self.sync_handler.metrics.subscribe(print_progress_event)
+        # Events arrive on sync threads and are handed to the Tk thread through this queue.
+        self.events = Queue()
+        self.sync_handler.metrics.subscribe(self.events.put)
+        self.sync_thread = None
+        self.progress = SyncProgress()
+        self.file_statuses = dict()
+        # Rows of the file view, in display order. Only the visible window of rows exists as Treeview items.
+        self.file_names = []
+        self.file_rows = dict()
+        self.rendered_rows = dict()
+        self.view_offset = 0
+        self.scan_batches = Queue()
+        self.scan_generation = 0
+        self.scanned_names = set()
         # self.sync_handler = "Testing. Delete this when done."
 
         self.root = Tk()
@@ -43,55 +155,284 @@ class SimplySyncGui:
         self.sync_dir.set(Path(self.conf_handler.get_conf_entry("file_dir_path")).resolve())
         self.mainframe = ttk.Frame(self.root, padding="0 0 0 0")
         self.file_view = None
+        self.vsb = None
+        self.row_height = DEFAULT_ROW_HEIGHT
+        self.status_text = StringVar()
+        self.progress_bar = None
+        self.sync_buttons = []
+        self.cancel_btn = None
         self.init_gui_elements()
 
         self.refresh_file_view()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(FRAME_INTERVAL_MS, self.poll_events)
 
     def run(self):
         self.root.mainloop()
 
+    def on_close(self):
+        self.sync_handler.cancel()
+        self.root.destroy()
+
     def change_file_folder_path(self):
         new_dir = filedialog.askdirectory()
         if new_dir != "":
-            self.conf_handler.change_conf_entry("file_dir_path", new_dir)
+            self.conf_handler.change_file_dir_path(new_dir)
             self.conf_handler.save_conf()
             self.sync_dir.set(Path(self.conf_handler.get_conf_entry("file_dir_path")).resolve())
+            self.file_names = []
+            self.file_rows = dict()
+            self.render_file_view()
             self.refresh_file_view()
             self.sync_handler.set_file_dir_path(self.conf_handler.get_conf_entry("file_dir_path"))
 
     def on_upload_btn_click(self):
-        self.sync_handler.upload()
-        self.refresh_file_view()
+        self.start_sync(self.sync_handler.upload)
 
     def on_download_btn_click(self):
-        self.sync_handler.download()
+        self.start_sync(self.sync_handler.download)
+
+    def on_cancel_btn_click(self):
+        self.sync_handler.cancel()
+        self.cancel_btn.state(["disabled"])
+        self.status_text.set("Cancelling...")
+
+    def start_sync(self, sync_function):
+        """
+        Run a sync operation on a background thread so the window stays responsive. Its progress events are shown by
+        poll_events.
+
+        :param sync_function: callable Synchronizer operation, e.g. self.sync_handler.upload.
+        :return: None
+        """
+        if self.sync_thread is not None:
+            return
+        self.sync_handler.clear_cancel()
+        self.progress = SyncProgress()
+        self.file_statuses = dict()
+        self.render_file_view()
+        for button in self.sync_buttons:
+            button.state(["disabled"])
+        self.cancel_btn.state(["!disabled"])
+        self.progress_bar.configure(value=0, maximum=1)
+        self.status_text.set("Syncing...")
+        self.sync_thread = threading.Thread(target=self.run_sync, args=(sync_function,), name="sync", daemon=True)
+        self.sync_thread.start()
+
+    def run_sync(self, sync_function):
+        """
+        Body of the sync thread. Never touches Tk; the outcome is queued as a "sync_finished" event.
+
+        :return: None
+        """
+        try:
+            sync_function()
+        except SyncCancelled:
+            message = "Cancelled"
+        except Exception as error:
+            message = "Sync failed: " + str(error)
+        else:
+            message = "Sync complete"
+        self.events.put(ProgressEvent("sync_finished", message=message))
+
+    def finish_sync(self, message: str):
+        self.sync_thread.join()
+        self.sync_thread = None
+        for button in self.sync_buttons:
+            button.state(["!disabled"])
+        self.cancel_btn.state(["disabled"])
+        self.status_text.set(message + " - " + self.progress.summary())
         self.refresh_file_view()
 
+    def poll_events(self):
+        """
+        Apply queued progress events on the Tk thread once per frame. At most MAX_EVENTS_PER_FRAME events are handled
+        per frame and each file's status is only updated once, so a flood of events cannot stall the window.
+
+        :return: None
+        """
+        changed_statuses = dict()
+        finished_message = None
+        for _ in range(MAX_EVENTS_PER_FRAME):
+            try:
+                event = self.events.get_nowait()
+            except Empty:
+                break
+            if event.kind == "sync_finished":
+                finished_message = event.message
+                break
+            status = self.progress.add_event(event)
+            item = self.file_view_item(event.name) if status is not None else None
+            if item is not None:
+                changed_statuses[item] = status
+
+        if changed_statuses:
+            self.file_statuses.update(changed_statuses)
+            self.render_file_view()
+        self.merge_scan_batches()
+        if self.sync_thread is not None:
+            self.progress.sample(time.monotonic())
+            self.progress_bar.configure(maximum=max(1, self.progress.total_bytes()), value=self.progress.done_bytes())
+            if not self.cancel_btn.instate(["disabled"]):
+                self.status_text.set(self.progress.summary())
+        if finished_message is not None:
+            self.finish_sync(finished_message)
+        self.root.after(FRAME_INTERVAL_MS, self.poll_events)
+
+    def file_view_item(self, file_path_str: str):
+        """
+        :param file_path_str: str path of a transferred file as reported in progress events.
+        :return: str file view item showing the file, or its top level folder if the file is in a sub folder. None if
+        the file is not in the sync folder.
+        """
+        try:
+            rel_path = Path(file_path_str).relative_to(self.sync_handler.dir_path)
+        except ValueError:
+            return None
+        return rel_path.parts[0] if rel_path.parts else None
+
     def on_file_double_click(self):
         selected_file = self.file_view.focus()
         startfile(Path(self.file_view.item(selected_file)["values"][3]))
 
     def refresh_file_view(self):
-        self.file_view.delete(*self.file_view.get_children())
+        """
+        Rescan the sync folder on a background thread. The current rows stay visible while the scan runs: scanned
+        entries are merged in batches by merge_scan_batches and rows of entries that are gone are removed once the scan
+        finished.
+
+        :return: None
+        """
         file_dir_path = Path(self.sync_dir.get())
-        if file_dir_path.exists():
-            for file_path in file_dir_path.iterdir():
-                file_name = file_path.name
-                self.file_view.insert("", "end", file_name,
-                                      tags=("file"),
-                                      text=file_name,
-                                      values=(file_path.suffix[1:],
-                                              ctime(file_path.stat().st_mtime),
-                                              convert_b_to_kb_str(file_path.stat().st_size),
-                                              file_path))
-        else:
+        if not file_dir_path.exists():
             self.change_file_folder_path()
+            return
+        self.scan_generation += 1
+        self.scanned_names = set()
+        threading.Thread(target=self.scan_file_dir, args=(file_dir_path, self.scan_generation), name="scan",
+                         daemon=True).start()
+
+    def scan_file_dir(self, file_dir_path: Path, generation: int):
+        """
+        Body of the scan thread. Formats rows for every entry of the sync folder and queues them in batches. Stops
+        early once a newer scan was started.
+
+        :param file_dir_path: Path of the sync folder.
+        :param generation: int number of this scan.
+        :return: None
+        """
+        try:
+            for batch in scan_dir_entries(file_dir_path, SCAN_BATCH_SIZE):
+                if generation != self.scan_generation:
+                    return
+                self.scan_batches.put((generation, [(entry.name, (Path(entry.name).suffix[1:],
+                                                                  ctime(entry.mtime),
+                                                                  convert_b_to_kb_str(entry.size),
+                                                                  entry.path))
+                                                    for entry in batch]))
+        except OSError:
+            pass
+        self.scan_batches.put((generation, None))
+
+    def merge_scan_batches(self):
+        """
+        Merge scanned rows into the file view for at most SCAN_FRAME_BUDGET seconds. New rows are appended, changed
+        rows are updated and unchanged rows are left alone.
+
+        :return: None
+        """
+        deadline = time.perf_counter() + SCAN_FRAME_BUDGET
+        changed = False
+        while time.perf_counter() < deadline:
+            try:
+                generation, rows = self.scan_batches.get_nowait()
+            except Empty:
+                break
+            if generation != self.scan_generation:
+                continue
+            if rows is None:
+                if len(self.scanned_names) != len(self.file_names):
+                    for file_name in self.file_names:
+                        if file_name not in self.scanned_names:
+                            del self.file_rows[file_name]
+                    self.file_names = [file_name for file_name in self.file_names if file_name in self.scanned_names]
+                    changed = True
+                continue
+            for file_name, row in rows:
+                self.scanned_names.add(file_name)
+                old_row = self.file_rows.get(file_name, None)
+                if old_row == row:
+                    continue
+                if old_row is None:
+                    self.file_names.append(file_name)
+                self.file_rows[file_name] = row
+                changed = True
+        if changed:
+            self.render_file_view()
+
+    def visible_row_count(self) -> int:
+        if not self.file_view.winfo_ismapped():
+            return int(self.file_view.cget("height"))
+        return max(1, self.file_view.winfo_height() // self.row_height)
+
+    def render_file_view(self):
+        """
+        Show the window of rows starting at view_offset. The Treeview only holds the rows that fit on screen, so the
+        cost of a redraw does not depend on the number of files. Items that stay in the window are kept and only
+        updated if their values changed.
+
+        :return: None
+        """
+        visible_count = self.visible_row_count()
+        self.view_offset = max(0, min(self.view_offset, len(self.file_names) - visible_count))
+        file_names = self.file_names[self.view_offset:self.view_offset + visible_count]
+        wanted = set(file_names)
+        stale_items = [item for item in self.file_view.get_children() if item not in wanted]
+        if stale_items:
+            self.file_view.delete(*stale_items)
+            for item in stale_items:
+                del self.rendered_rows[item]
+        for index, file_name in enumerate(file_names):
+            values = self.file_rows[file_name] + (self.file_statuses.get(file_name, ""),)
+            if file_name not in self.rendered_rows:
+                self.file_view.insert("", index, file_name, tags=("file",), text=file_name, values=values)
+            else:
+                if self.rendered_rows[file_name] != values:
+                    self.file_view.item(file_name, values=values)
+                if self.file_view.index(file_name) != index:
+                    self.file_view.move(file_name, "", index)
+            self.rendered_rows[file_name] = values
+
+        if self.file_names:
+            self.vsb.set(self.view_offset / len(self.file_names),
+                         (self.view_offset + len(file_names)) / len(self.file_names))
+        else:
+            self.vsb.set(0, 1)
+
+    def scroll_file_view(self, *args):
+        """
+        Scrollbar command: "moveto fraction" or "scroll count units|pages".
+
+        :return: None
+        """
+        if args[0] == "moveto":
+            self.view_offset = int(float(args[1]) * len(self.file_names))
+        elif args[0] == "scroll":
+            self.view_offset += int(args[1]) * (self.visible_row_count() if args[2] == "pages" else 1)
+        self.render_file_view()
+
+    def on_file_view_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_file_view("scroll", -WHEEL_ROWS, "units")
+        else:
+            self.scroll_file_view("scroll", WHEEL_ROWS, "units")
+        return "break"
 
     def init_gui_elements(self):
         # Root Configuration
         self.root.title("Simply Sync")
         self.root.iconbitmap(IMG_DIR / "simply_sync.ico")
-        self.root.geometry("350x400")
+        self.root.geometry("350x450")
 
         # Main Window Configuration
         self.mainframe.grid(column=0, row=0, sticky=(N, W, E, S))
@@ -105,6 +446,8 @@ class SimplySyncGui:
         self.mainframe.rowconfigure(0, weight=0)
         self.mainframe.rowconfigure(1, weight=2)
         self.mainframe.rowconfigure(2, weight=1)
+        self.mainframe.rowconfigure(3, weight=0)
+        self.mainframe.rowconfigure(4, weight=0)
 
         # Style Section
         self.style.configure("UploadButton.TButton",
@@ -122,23 +465,21 @@ class SimplySyncGui:
         file_view_frame = Frame(self.mainframe)
         file_view_frame.grid(row=1, columnspan=2, sticky=(N, W, E, S), padx=2, pady=2)
 
-        vsb = ttk.Scrollbar(file_view_frame)
-        vsb.pack(side="right", fill="y")
+        self.vsb = ttk.Scrollbar(file_view_frame, command=self.scroll_file_view)
+        self.vsb.pack(side="right", fill="y")
 
         hsb = ttk.Scrollbar(file_view_frame, orient="horizontal")
         hsb.pack(side="bottom", fill="x")
 
-        all_columns = ("Type", "Date modified", "Size", "Path")
-        columns_to_display = all_columns[0:3]
+        all_columns = ("Type", "Date modified", "Size", "Path", "Status")
+        columns_to_display = all_columns[0:3] + all_columns[4:]
         self.file_view = ttk.Treeview(file_view_frame,
-                                      columns=columns_to_display,
+                                      columns=all_columns,
                                       height=10,
                                       displaycolumns=columns_to_display,
                                       padding=[3, 3, 3, 3],
                                       selectmode="extended",
-                                      yscrollcommand=vsb.set,
                                       xscrollcommand=hsb.set)
-        vsb.config(command=self.file_view.yview)
         hsb.config(command=self.file_view.xview)
         for column in columns_to_display:
             self.file_view.column(column=column, anchor="w", stretch=True, width=100)
@@ -148,24 +489,44 @@ class SimplySyncGui:
         self.file_view.pack(side="left", fill="both", expand=True)
         # self.file_view.tag_configure("file", background="#98FB98") # Turned all tags with file to green
         self.file_view.tag_bind("file", "<Double-Button-1>", self.on_file_double_click)
-
-        ttk.Button(self.mainframe,
-                   style="UploadButton.TButton",
-                   text="Upload",
-                   command=self.on_upload_btn_click).grid(column=0, row=2, sticky=(N, W, E, S))
-        ttk.Button(self.mainframe,
-                   style="DownloadButton.TButton",
-                   text="Download",
-                   command=self.on_download_btn_click).grid(column=1, row=2, sticky=(N, W, E, S))
+        self.row_height = int(self.style.lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        self.file_view.bind("<Configure>", lambda event: self.render_file_view())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.file_view.bind(sequence, self.on_file_view_wheel)
+
+        upload_btn = ttk.Button(self.mainframe,
+                                style="UploadButton.TButton",
+                                text="Upload",
+                                command=self.on_upload_btn_click)
+        upload_btn.grid(column=0, row=2, sticky=(N, W, E, S))
+        download_btn = ttk.Button(self.mainframe,
+                                  style="DownloadButton.TButton",
+                                  text="Download",
+                                  command=self.on_download_btn_click)
+        download_btn.grid(column=1, row=2, sticky=(N, W, E, S))
+
+        progress_frame = Frame(self.mainframe)
+        progress_frame.grid(columnspan=2, row=3, sticky=(N, W, E, S), padx=2, pady=2)
+        self.cancel_btn = ttk.Button(progress_frame,
+                                     text="Cancel",
+                                     command=self.on_cancel_btn_click)
+        self.cancel_btn.pack(side="right")
+        self.cancel_btn.state(["disabled"])
+        self.progress_bar = ttk.Progressbar(progress_frame, orient="horizontal", mode="determinate")
+        self.progress_bar.pack(side="left", fill="x", expand=True, padx=2)
+        ttk.Label(self.mainframe, textvariable=self.status_text).grid(columnspan=2, row=4, sticky=(W, E), padx=4)
 
         path_config_frame = Frame(self.mainframe)
         path_config_frame.grid(columnspan=2, row=0, sticky=(N, W, E, S))
         settings_btn_frame = Frame(path_config_frame, height=16, width=28)
         settings_btn_frame.pack(side="right", fill="y")
 
-        ttk.Button(settings_btn_frame,
-                   image=self.img_settings_btn,
-                   command=self.change_file_folder_path).grid(column=0, row=0, sticky=(N, W, E, S))
+        settings_btn = ttk.Button(settings_btn_frame,
+                                  image=self.img_settings_btn,
+                                  command=self.change_file_folder_path)
+        settings_btn.grid(column=0, row=0, sticky=(N, W, E, S))
+        # The sync thread reads the sync folder, so it must not change while a sync runs.
+        self.sync_buttons = [upload_btn, download_btn, settings_btn]
 
         ttk.Button(settings_btn_frame,
                    image=self.img_reload_btn,
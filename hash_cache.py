@@ -0,0 +1,133 @@
+from pathlib import Path
+import json
+import os
+
+from hash_pool import hash_file
+
+
+HASH_CACHE_PATH = Path("hash_cache.json")
+
+
+def compute_md5(file_path: str) -> str:
+    """
+    Compute the md5 checksum of a file, reading it in fixed size blocks or through a memory map if it is large.
+
+    :param file_path: str that represents path to the file to hash.
+    :return: str hex digest in the same format as Google Drive's md5Checksum.
+    """
+    return hash_file(file_path)[2]
+
+
+class HashCache:
+    def __init__(self, cache_path: Path = HASH_CACHE_PATH):
+        """
+        Load the persistent md5 cache. Entries are keyed by file path and are only trusted while the file's size and
+        mtime_ns are unchanged, so unchanged files never have to be read again.
+
+        :param cache_path: Path to the json file the cache is stored in.
+        """
+        self.cache_path = Path(cache_path)
+        self.entries = dict()
+        self.dirty = False
+        self.read_cache()
+
+    def read_cache(self):
+        """
+        Read cache entries from disk. A missing or corrupt cache file results in an empty cache.
+
+        :return: None
+        """
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                self.entries = json.load(cache_file)
+        except (OSError, ValueError):
+            self.entries = dict()
+
+    def save(self):
+        """
+        Write cache entries to disk if anything changed since the last save. Writes to a temporary file first so a
+        crash never leaves a truncated cache behind.
+
+        :return: None
+        """
+        if not self.dirty:
+            return
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        with open(tmp_path, "w") as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(str(tmp_path), str(self.cache_path))
+        self.dirty = False
+
+    def get_md5(self, file_path) -> str:
+        """
+        Return the md5 checksum of a local file, hashing it only if it is new or its size or mtime_ns changed.
+
+        :param file_path: str or Path of the local file.
+        :return: str hex digest of the file contents.
+        """
+        key = str(file_path)
+        md5 = self.lookup(key)
+        if md5 is not None:
+            return md5
+
+        size, mtime_ns, md5 = hash_file(key)
+        self.add_entry(key, size, mtime_ns, md5)
+        return md5
+
+    def lookup(self, file_path, stat: os.stat_result = None) -> str:
+        """
+        :param file_path: str or Path of the local file.
+        :param stat: os.stat_result of the file, None to stat it now.
+        :return: str cached md5 checksum of the file, or None if it is not cached or the file changed since.
+        """
+        if stat is None:
+            stat = os.stat(str(file_path))
+        entry = self.entries.get(str(file_path))
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def add_entry(self, file_path, size: int, mtime_ns: int, md5: str):
+        """
+        Record the md5 checksum of a file hashed elsewhere, e.g. by a HashPool, with the size and mtime_ns the file
+        had before it was read.
+
+        :return: None
+        """
+        self.entries[str(file_path)] = [size, mtime_ns, md5]
+        self.dirty = True
+
+    def set_md5(self, file_path, md5: str):
+        """
+        Record a known md5 checksum for a local file, e.g. after downloading it, so it does not need to be re-read.
+
+        :param file_path: str or Path of the local file.
+        :param md5: str hex digest of the file contents.
+        :return: None
+        """
+        key = str(file_path)
+        stat = os.stat(key)
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, md5]
+        self.dirty = True
+
+    def remove(self, file_path):
+        """
+        Forget the cached checksum of a file, e.g. after it was deleted.
+
+        :param file_path: str or Path of the local file.
+        :return: None
+        """
+        if self.entries.pop(str(file_path), None) is not None:
+            self.dirty = True
+
+    def remove_folder(self, folder_path):
+        """
+        Forget the cached checksums of every file below a folder, e.g. after the folder was deleted.
+
+        :param folder_path: str or Path of the local folder.
+        :return: None
+        """
+        prefix = os.path.join(str(folder_path), "")
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+            self.dirty = True
@@ -0,0 +1,132 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import hashlib
+import mmap
+import os
+
+
+HASH_READ_SIZE = 1024 * 1024
+# Files from this size are hashed through a memory map instead of read() calls.
+MMAP_THRESHOLD = 4 * 1024 * 1024
+# md5 is fed slices of the memory map of this size, so it sees large buffers without copying them.
+MMAP_SLICE_SIZE = 64 * 1024 * 1024
+# Small files are hashed in batches of up to this many bytes or files per task, so they do not cost a round trip to a
+# worker process each.
+BATCH_BYTES = 16 * 1024 * 1024
+BATCH_FILE_COUNT = 256
+# Less work than this is hashed in the calling process; starting worker processes would take longer.
+MIN_POOL_BYTES = 64 * 1024 * 1024
+
+
+def default_hash_worker_count() -> int:
+    return os.cpu_count() or 1
+
+
+def hash_file(file_path: str) -> tuple:
+    """
+    Compute the md5 checksum of a file. Large files are hashed through a read only memory map, so their content is
+    never copied into Python objects.
+
+    :param file_path: str path of the file.
+    :return: (int, int, str) size and mtime_ns of the file taken before it was read, and its md5 hex digest. If the
+    file changes while it is hashed, a later stat no longer matches, so the checksum is never trusted for new content.
+    """
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as hashed_file:
+        stat = os.fstat(hashed_file.fileno())
+        if stat.st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(hashed_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, len(view), MMAP_SLICE_SIZE):
+                    md5.update(view[offset:offset + MMAP_SLICE_SIZE])
+        else:
+            for block in iter(lambda: hashed_file.read(HASH_READ_SIZE), b""):
+                md5.update(block)
+    return stat.st_size, stat.st_mtime_ns, md5.hexdigest()
+
+
+def hash_batch(file_paths: list) -> list:
+    """
+    Hash several files, run in a worker process.
+
+    :param file_paths: list of str file paths.
+    :return: list of (str, int, int, str) path, size, mtime_ns and md5 of every file, or (str, None, None, None) for
+    files that could not be read, e.g. because they were deleted in the meantime.
+    """
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append((file_path,) + hash_file(file_path))
+        except OSError:
+            results.append((file_path, None, None, None))
+    return results
+
+
+def plan_batches(file_sizes: list) -> list:
+    """
+    Group files into hashing tasks, smallest files first so the first results come back early. Files of BATCH_BYTES
+    or more get a task of their own.
+
+    :param file_sizes: list of (str, int) file paths and sizes.
+    :return: list of lists of str file paths, in the order they should be hashed.
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for file_path, size in sorted(file_sizes, key=lambda item: item[1]):
+        if batch and (batch_size + size > BATCH_BYTES or len(batch) >= BATCH_FILE_COUNT):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(file_path)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class HashPool:
+    def __init__(self, worker_count: int = None, min_pool_bytes: int = MIN_POOL_BYTES):
+        """
+        Hashes many files at once in a pool of worker processes, so hashing a large sync folder uses every core
+        instead of one. Results are streamed back as they complete, smallest files first.
+
+        :param worker_count: int number of worker processes, the number of cores if None. 1 hashes in the calling
+        process.
+        :param min_pool_bytes: int total size below which files are hashed in the calling process.
+        """
+        self.worker_count = worker_count if worker_count is not None else default_hash_worker_count()
+        self.min_pool_bytes = min_pool_bytes
+
+    def iter_hashes(self, file_sizes: list, check_cancelled=None):
+        """
+        Generator hashing files and yielding each result as soon as it is known.
+
+        :param file_sizes: list of (str, int) file paths and sizes.
+        :param check_cancelled: callable raising to stop hashing, e.g. RequestExecutor.check_cancelled. Called between
+        results; tasks not started yet are cancelled.
+        :return: generator of (str, int, int, str) path, size, mtime_ns and md5 of every file. size, mtime_ns and md5
+        are None for files that could not be read.
+        """
+        batches = plan_batches(file_sizes)
+        total_size = sum(size for file_path, size in file_sizes)
+        if self.worker_count <= 1 or len(batches) <= 1 or total_size < self.min_pool_bytes:
+            for batch in batches:
+                for result in hash_batch(batch):
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    yield result
+            return
+
+        with ProcessPoolExecutor(max_workers=self.worker_count) as executor:
+            # Tasks are queued in size order, so the pool works through small files first.
+            pending = set(executor.submit(hash_batch, batch) for batch in batches)
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for result in future.result():
+                            if check_cancelled is not None:
+                                check_cancelled()
+                            yield result
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,88 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import os
+
+
+DEFAULT_WALK_WORKER_COUNT = 8
+DEFAULT_SCAN_BATCH_SIZE = 500
+
+DirEntryInfo = namedtuple("DirEntryInfo", ["name", "path", "is_dir", "size", "mtime"])
+
+
+class LocalTree:
+    def __init__(self, file_paths: dict, folder_paths: set):
+        """
+        Result of walking a local sync folder.
+
+        :param file_paths: dict of Path of every file indexed by posix path relative to the sync folder.
+        :param folder_paths: set of posix paths relative to the sync folder of every folder below it.
+        """
+        self.file_paths = file_paths
+        self.folder_paths = folder_paths
+
+
+def _scan_dir(dir_path: str, rel_dir_path: str, ignore):
+    file_paths = dict()
+    sub_dirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            rel_path = entry.name if rel_dir_path == "" else rel_dir_path + "/" + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                sub_dirs.append((entry.path, rel_path))
+            elif entry.is_file() and not ignore(Path(entry.path)):
+                file_paths[rel_path] = Path(entry.path)
+    return file_paths, sub_dirs
+
+
+def walk_local_tree(dir_path: Path, ignore=lambda file_path_obj: False,
+                    worker_count: int = DEFAULT_WALK_WORKER_COUNT) -> LocalTree:
+    """
+    Walk a directory tree with os.scandir, scanning several directories in parallel. Symlinked directories are not
+    followed.
+
+    :param dir_path: Path of the sync folder.
+    :param ignore: callable taking a file Path and returning True if the file should be left out.
+    :param worker_count: int number of directories scanned at the same time.
+    :return: LocalTree with every file and folder below dir_path.
+    """
+    file_paths = dict()
+    folder_paths = set()
+    with ThreadPoolExecutor(max_workers=max(1, worker_count)) as executor:
+        pending = {executor.submit(_scan_dir, str(dir_path), "", ignore)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                scanned_files, sub_dirs = future.result()
+                file_paths.update(scanned_files)
+                for sub_dir_path, rel_path in sub_dirs:
+                    folder_paths.add(rel_path)
+                    pending.add(executor.submit(_scan_dir, sub_dir_path, rel_path, ignore))
+    return LocalTree(file_paths, folder_paths)
+
+
+def scan_dir_entries(dir_path: Path, batch_size: int = DEFAULT_SCAN_BATCH_SIZE):
+    """
+    List the entries directly in a folder with os.scandir, stating each entry once. Entries are yielded in batches so
+    callers can show the first ones before a large folder is fully scanned. Entries that disappear while scanning are
+    left out.
+
+    :param dir_path: Path of the folder.
+    :param batch_size: int maximum number of entries per batch.
+    :return: generator of lists of DirEntryInfo.
+    """
+    batch = []
+    with os.scandir(str(dir_path)) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            batch.append(DirEntryInfo(name=entry.name, path=entry.path, is_dir=is_dir, size=stat.st_size,
+                                      mtime=stat.st_mtime))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,292 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import itertools
+import json
+import threading
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "simple_sync_"
+
+ProgressEvent = namedtuple("ProgressEvent", ["kind", "name", "done", "total", "message"])
+ProgressEvent.__new__.__defaults__ = (None, None, None)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Cumulative latency histogram with fixed upper bounds in seconds, laid out like a Prometheus histogram.
+
+        :param buckets: tuple of float bucket upper bounds in ascending order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        for index, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def to_dict(self) -> dict:
+        return {"buckets": {str(upper_bound): count for upper_bound, count in zip(self.buckets, self.counts)},
+                "count": self.count,
+                "sum": round(self.sum, 6)}
+
+
+class Metrics:
+    def __init__(self, trace: bool = False):
+        """
+        Thread-safe counters for one Synchronizer: api calls, errors and latency by api method, bytes transferred,
+        retries and wall time per sync phase. Also the hub for progress events that the command line and GUI subscribe
+        to instead of reading printed output.
+
+        :param trace: bool True to also record a span for every sync pass, phase and file transfer.
+        """
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.local = threading.local()
+        self.span_ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        """
+        Zero every counter and forget recorded spans. Listeners stay subscribed.
+
+        :return: None
+        """
+        with self.lock:
+            self.api_calls = dict()
+            self.api_errors = dict()
+            self.latency = dict()
+            self.retries = dict()
+            self.throttles = dict()
+            self.gauges = dict()
+            self.bytes_uploaded = 0
+            self.bytes_downloaded = 0
+            self.phase_seconds = dict()
+            self.phase_runs = dict()
+            self.spans = []
+
+    def record_api_call(self, method: str, seconds: float, failed: bool = False):
+        """
+        :param method: str api method id, e.g. "drive.files.list".
+        :param seconds: float wall time of the http request.
+        :param failed: bool True if the request raised.
+        :return: None
+        """
+        with self.lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + 1
+            if failed:
+                self.api_errors[method] = self.api_errors.get(method, 0) + 1
+            if method not in self.latency:
+                self.latency[method] = LatencyHistogram()
+            self.latency[method].observe(seconds)
+
+    def record_retry(self, method: str):
+        with self.lock:
+            self.retries[method] = self.retries.get(method, 0) + 1
+
+    def record_throttle(self, method: str):
+        """
+        :param method: str api method id of a call Google Drive rejected because of rate limiting.
+        :return: None
+        """
+        with self.lock:
+            self.throttles[method] = self.throttles.get(method, 0) + 1
+
+    def set_gauge(self, name: str, value):
+        """
+        :param name: str gauge name, e.g. "request_concurrency_limit".
+        :param value: int or float current value.
+        :return: None
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+    def add_bytes_uploaded(self, byte_count: int):
+        with self.lock:
+            self.bytes_uploaded += byte_count
+
+    def add_bytes_downloaded(self, byte_count: int):
+        with self.lock:
+            self.bytes_downloaded += byte_count
+
+    def add_phase_time(self, phase: str, seconds: float, runs: int = 1):
+        with self.lock:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+            self.phase_runs[phase] = self.phase_runs.get(phase, 0) + runs
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Record a trace span around a block if tracing is enabled. Spans opened on the same thread nest.
+
+        :param name: str span name, e.g. "upload" or "upload.scan".
+        :param attributes: extra values stored with the span.
+        """
+        if not self.trace:
+            yield
+            return
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        span = {"id": next(self.span_ids),
+                "parent": stack[-1]["id"] if stack else None,
+                "name": name,
+                "thread": threading.current_thread().name,
+                "start": time.time(),
+                "attributes": attributes}
+        stack.append(span)
+        start_time = time.perf_counter()
+        try:
+            yield
+        except BaseException as error:
+            span["error"] = repr(error)
+            raise
+        finally:
+            span["seconds"] = round(time.perf_counter() - start_time, 6)
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+
+    @contextmanager
+    def phase(self, phase: str):
+        """
+        Time a phase of a sync pass, e.g. listing or deleting, and trace it as a span.
+
+        :param phase: str phase name.
+        """
+        start_time = time.perf_counter()
+        try:
+            with self.span(phase):
+                yield
+        finally:
+            self.add_phase_time(phase, time.perf_counter() - start_time)
+
+    def subscribe(self, listener):
+        """
+        :param listener: callable taking a ProgressEvent. Called on the thread that emits the event, which may be a
+        transfer worker thread.
+        :return: None
+        """
+        with self.lock:
+            self.listeners = self.listeners + [listener]
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            self.listeners = [subscribed for subscribed in self.listeners if subscribed is not listener]
+
+    def emit(self, kind: str, name: str = None, done=None, total=None, message: str = None):
+        """
+        Send a progress event to every listener.
+
+        :param kind: str event kind, e.g. "transfer_queued", "download_progress", "transfer_finished",
+        "delete_local_file" or "transfer_failed".
+        :param name: str file or folder the event is about.
+        :param done: int bytes transferred so far for progress events.
+        :param total: int total bytes for progress events.
+        :param message: str human readable detail.
+        :return: None
+        """
+        event = ProgressEvent(kind, name, done, total, message)
+        for listener in self.listeners:
+            listener(event)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"api_calls": dict(self.api_calls),
+                    "api_errors": dict(self.api_errors),
+                    "api_latency_seconds": {method: histogram.to_dict()
+                                            for method, histogram in self.latency.items()},
+                    "retries": dict(self.retries),
+                    "throttles": dict(self.throttles),
+                    "gauges": dict(self.gauges),
+                    "bytes_uploaded": self.bytes_uploaded,
+                    "bytes_downloaded": self.bytes_downloaded,
+                    "phase_seconds": {phase: round(seconds, 6) for phase, seconds in self.phase_seconds.items()},
+                    "phase_runs": dict(self.phase_runs),
+                    "spans": list(self.spans)}
+
+    def to_json(self, indent: int = None) -> str:
+        """
+        :return: str every metric and recorded span as json.
+        """
+        return json.dumps(self.to_dict(), indent=indent, sort_keys=True)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: str every metric in the Prometheus text exposition format. Spans are not included.
+        """
+        with self.lock:
+            lines = []
+            _append_family(lines, "api_calls_total", "counter", "Drive api requests by method.",
+                           [({"method": method}, count) for method, count in sorted(self.api_calls.items())])
+            _append_family(lines, "api_errors_total", "counter", "Failed Drive api requests by method.",
+                           [({"method": method}, count) for method, count in sorted(self.api_errors.items())])
+            lines.append("# HELP %sapi_latency_seconds Drive api request latency by method." % METRIC_PREFIX)
+            lines.append("# TYPE %sapi_latency_seconds histogram" % METRIC_PREFIX)
+            for method, histogram in sorted(self.latency.items()):
+                for upper_bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(_sample("api_latency_seconds_bucket", {"method": method, "le": str(upper_bound)},
+                                         count))
+                lines.append(_sample("api_latency_seconds_bucket", {"method": method, "le": "+Inf"},
+                                     histogram.count))
+                lines.append(_sample("api_latency_seconds_sum", {"method": method}, histogram.sum))
+                lines.append(_sample("api_latency_seconds_count", {"method": method}, histogram.count))
+            _append_family(lines, "retries_total", "counter", "Retried Drive api requests by method.",
+                           [({"method": method}, count) for method, count in sorted(self.retries.items())])
+            _append_family(lines, "throttles_total", "counter", "Drive api requests rejected by rate limiting.",
+                           [({"method": method}, count) for method, count in sorted(self.throttles.items())])
+            for name, value in sorted(self.gauges.items()):
+                _append_family(lines, name, "gauge", "Current " + name.replace("_", " ") + ".", [({}, value)])
+            _append_family(lines, "bytes_uploaded_total", "counter", "File content bytes sent to Google Drive.",
+                           [({}, self.bytes_uploaded)])
+            _append_family(lines, "bytes_downloaded_total", "counter", "File content bytes received from Google Drive.",
+                           [({}, self.bytes_downloaded)])
+            _append_family(lines, "phase_seconds_total", "counter", "Wall time spent per sync phase.",
+                           [({"phase": phase}, seconds) for phase, seconds in sorted(self.phase_seconds.items())])
+            _append_family(lines, "phase_runs_total", "counter", "Number of times each sync phase ran.",
+                           [({"phase": phase}, runs) for phase, runs in sorted(self.phase_runs.items())])
+            return "\n".join(lines) + "\n"
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    label_str = ",".join('%s="%s"' % (key, str(label).replace("\\", "\\\\").replace('"', '\\"'))
+                         for key, label in labels.items())
+    return METRIC_PREFIX + name + ("{" + label_str + "}" if label_str else "") + " " + repr(value)
+
+
+def _append_family(lines: list, name: str, metric_type: str, help_text: str, samples: list):
+    lines.append("# HELP %s%s %s" % (METRIC_PREFIX, name, help_text))
+    lines.append("# TYPE %s%s %s" % (METRIC_PREFIX, name, metric_type))
+    for labels, value in samples:
+        lines.append(_sample(name, labels, value))
+
+
+def print_progress_event(event: ProgressEvent):
+    """
+    Progress listener that prints events to the console the way Simple-Sync always reported progress.
+
+    :param event: ProgressEvent
+    :return: None
+    """
+    if event.kind in ("download_progress", "upload_progress"):
+        percent = 100 if not event.total else int(event.done * 100 / event.total)
+        print("%s %d%%." % ("Download" if event.kind == "download_progress" else "Upload", percent))
+    elif event.kind == "delete_local_file":
+        print("Deleting File:" + event.name)
+    elif event.kind == "delete_local_folder":
+        print("Deleting Folder:" + event.name)
+    elif event.kind == "transfer_failed":
+        print("Failed to " + event.message)
+    elif event.kind in ("transfer_queued", "transfer_finished"):
+        # Only needed by listeners that track every file; failures are printed by "transfer_failed".
+        pass
+    elif event.message is not None:
+        print(event.message)
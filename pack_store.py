@@ -0,0 +1,246 @@
+from collections import namedtuple
+from pathlib import Path
+import gzip
+import json
+import os
+import threading
+import uuid
+
+
+PACK_INDEX_PATH = Path("pack_index.json")
+PACK_OBJECT_PREFIX = ".simple-sync-pack"
+PACK_INDEX_NAME = PACK_OBJECT_PREFIX + "-index"
+DEFAULT_PACK_THRESHOLD = 64 * 1024
+PACK_TARGET_SIZE = 4 * 1024 * 1024
+# Packs whose live members take up less than this fraction of the pack are rewritten.
+REPACK_RATIO = 0.5
+# Packs smaller than this are merged into the next pack written, so frequent small updates do not leave many tiny
+# packs behind.
+MIN_PACK_SIZE = PACK_TARGET_SIZE // 4
+
+PackMember = namedtuple("PackMember", ["pack", "offset", "length", "md5"])
+
+
+def is_pack_object_name(file_name: str) -> bool:
+    """
+    Determine if a name in Google Drive is a pack or the pack index rather than a synced file. Pack objects live at the
+    top of the appDataFolder and the name prefix is reserved for them.
+
+    :param file_name: str path relative to the sync folder.
+    :return: True if the name belongs to a pack object.
+    """
+    return "/" not in file_name and file_name.startswith(PACK_OBJECT_PREFIX)
+
+
+def new_pack_name() -> str:
+    return PACK_OBJECT_PREFIX + "-" + uuid.uuid4().hex
+
+
+def plan_packs(file_sizes: list, target_size: int = PACK_TARGET_SIZE) -> list:
+    """
+    Group files into packs of about target_size bytes, keeping the given order so files of the same folder end up next
+    to each other.
+
+    :param file_sizes: list of (str, int) file names and sizes.
+    :param target_size: int size in bytes a pack is closed at.
+    :return: list of lists of file names, one list per pack.
+    """
+    groups = []
+    group = []
+    group_size = 0
+    for file_name, size in file_sizes:
+        if group and group_size + size > target_size:
+            groups.append(group)
+            group = []
+            group_size = 0
+        group.append(file_name)
+        group_size += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+class PackIndex:
+    def __init__(self, state_path: Path = PACK_INDEX_PATH):
+        """
+        Index of the small files that are stored inside pack objects instead of as files of their own, mapping file
+        name to PackMember (pack name, byte offset, length, md5 checksum). The index itself is stored in Google Drive
+        as a gzipped json object named PACK_INDEX_NAME; a copy of the last one applied to the sync folder is kept on
+        disk together with the md5 checksum of the object it came from. Safe to share between transfer worker threads.
+
+        :param state_path: Path to the json file the local copy is stored in.
+        """
+        self.state_path = Path(state_path)
+        self.lock = threading.RLock()
+        self.members = dict()
+        self.pack_sizes = dict()
+        self.remote_md5 = None
+
+    def __contains__(self, file_name: str):
+        with self.lock:
+            return file_name in self.members
+
+    def __len__(self):
+        with self.lock:
+            return len(self.members)
+
+    def read_state(self):
+        """
+        Read the local copy from disk. A missing or corrupt file results in an empty index.
+
+        :return: None
+        """
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            self.load_dict(state["index"])
+            self.remote_md5 = state["remote_md5"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.load_dict({"packs": [], "members": {}})
+            self.remote_md5 = None
+
+    def save(self):
+        """
+        Write the local copy to disk through a temporary file so a crash never leaves a truncated index behind.
+
+        :return: None
+        """
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump({"remote_md5": self.remote_md5, "index": self.to_dict()}, state_file, separators=(",", ":"))
+        os.replace(str(tmp_path), str(self.state_path))
+
+    def copy(self):
+        """
+        :return: PackIndex with the same content, to be changed without touching this one.
+        """
+        pack_index = PackIndex(self.state_path)
+        with self.lock:
+            pack_index.load_dict(self.to_dict())
+            pack_index.remote_md5 = self.remote_md5
+        return pack_index
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict json form: pack names with sizes, and per member the position of its pack in that list, offset,
+        length and md5 checksum, so pack names are not repeated for every member.
+        """
+        with self.lock:
+            pack_names = sorted(self.pack_sizes.keys())
+            pack_numbers = {pack_name: number for number, pack_name in enumerate(pack_names)}
+            return {"packs": [[pack_name, self.pack_sizes[pack_name]] for pack_name in pack_names],
+                    "members": {file_name: [pack_numbers[member.pack], member.offset, member.length, member.md5]
+                                for file_name, member in self.members.items()}}
+
+    def load_dict(self, index: dict):
+        pack_names = [pack_name for pack_name, size in index["packs"]]
+        with self.lock:
+            self.pack_sizes = {pack_name: size for pack_name, size in index["packs"]}
+            self.members = {file_name: PackMember(pack_names[number], offset, length, md5)
+                            for file_name, (number, offset, length, md5) in index["members"].items()}
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: bytes compact gzipped json form stored in Google Drive.
+        """
+        return gzip.compress(json.dumps(self.to_dict(), separators=(",", ":"), sort_keys=True).encode("utf-8"))
+
+    def load_bytes(self, data: bytes, remote_md5: str):
+        """
+        Replace the content with an index downloaded from Google Drive.
+
+        :param data: bytes in the form written by to_bytes.
+        :param remote_md5: str md5 checksum of the object the data was downloaded from.
+        :return: None
+        """
+        self.load_dict(json.loads(gzip.decompress(data).decode("utf-8")))
+        self.remote_md5 = remote_md5
+
+    def get(self, file_name: str) -> PackMember:
+        """
+        :param file_name: str path relative to the sync folder.
+        :return: PackMember or None if the file is not packed.
+        """
+        with self.lock:
+            return self.members.get(file_name, None)
+
+    def names(self):
+        with self.lock:
+            return list(self.members.keys())
+
+    def items(self):
+        """
+        :return: list of (file name, PackMember) tuples.
+        """
+        with self.lock:
+            return list(self.members.items())
+
+    def pack_names(self):
+        with self.lock:
+            return list(self.pack_sizes.keys())
+
+    def pack_size(self, pack_name: str) -> int:
+        with self.lock:
+            return self.pack_sizes.get(pack_name, 0)
+
+    def members_of(self, pack_name: str) -> list:
+        """
+        :return: list of (file name, PackMember) tuples of the live members of a pack, ordered by offset.
+        """
+        with self.lock:
+            return sorted(((file_name, member) for file_name, member in self.members.items()
+                           if member.pack == pack_name), key=lambda item: item[1].offset)
+
+    def live_bytes(self) -> dict:
+        """
+        :return: dict of the number of bytes still referenced by the index, indexed by pack name.
+        """
+        with self.lock:
+            live_bytes = {pack_name: 0 for pack_name in self.pack_sizes}
+            for member in self.members.values():
+                live_bytes[member.pack] = live_bytes.get(member.pack, 0) + member.length
+        return live_bytes
+
+    def add_pack(self, pack_name: str, size: int, members: list):
+        """
+        Record an uploaded pack and point its members at it.
+
+        :param pack_name: str name of the pack object.
+        :param size: int size of the pack in bytes.
+        :param members: list of (str, PackMember) tuples of file names and where they are in the pack.
+        :return: None
+        """
+        with self.lock:
+            self.pack_sizes[pack_name] = size
+            self.members.update(members)
+
+    def remove(self, file_name: str) -> PackMember:
+        """
+        Forget a packed file. Its bytes stay in the pack until the pack is rewritten or deleted.
+
+        :return: PackMember the file had or None if it was not packed.
+        """
+        with self.lock:
+            return self.members.pop(file_name, None)
+
+    def remove_folder(self, folder_name: str) -> list:
+        """
+        Forget every packed file below a folder.
+
+        :return: list of str names of the forgotten files.
+        """
+        prefix = folder_name + "/"
+        with self.lock:
+            file_names = [file_name for file_name in self.members if file_name.startswith(prefix)]
+            for file_name in file_names:
+                del self.members[file_name]
+        return file_names
+
+    def remove_pack(self, pack_name: str):
+        """
+        Forget a pack once none of its members are referenced any more.
+
+        :return: None
+        """
+        with self.lock:
+            self.pack_sizes.pop(pack_name, None)
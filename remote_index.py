@@ -0,0 +1,209 @@
+from collections import namedtuple
+import threading
+
+from chunk_store import is_chunk_object_name
+from pack_store import is_pack_object_name
+
+
+# appProperties of a file whose content in Google Drive is encoded, e.g. a chunk manifest: the codec, and the md5
+# checksum and size of the decoded content, which is what gets compared with local files.
+CODEC_PROPERTY = "simpleSyncCodec"
+CONTENT_MD5_PROPERTY = "simpleSyncMd5"
+CONTENT_SIZE_PROPERTY = "simpleSyncSize"
+CODEC_PROPERTIES = (CODEC_PROPERTY, CONTENT_MD5_PROPERTY, CONTENT_SIZE_PROPERTY)
+
+RemoteFile = namedtuple("RemoteFile", ["id", "md5", "size", "modified_time", "codec"])
+
+
+def remote_file_from_info(file_info: dict) -> RemoteFile:
+    """
+    Convert a Google Drive file resource into a RemoteFile entry.
+
+    :param file_info: dict as returned by the Drive api with id, md5Checksum, size, modifiedTime and appProperties
+    fields.
+    :return: RemoteFile, with md5 and size of the decoded content if the file is encoded.
+    """
+    properties = file_info.get("appProperties", None) or dict()
+    codec = properties.get(CODEC_PROPERTY, None)
+    if codec is None:
+        md5 = file_info.get("md5Checksum", None)
+        size = file_info.get("size", None)
+    else:
+        md5 = properties.get(CONTENT_MD5_PROPERTY, None)
+        size = properties.get(CONTENT_SIZE_PROPERTY, None)
+    return RemoteFile(id=file_info["id"],
+                      md5=md5,
+                      size=int(size) if size is not None else None,
+                      modified_time=file_info.get("modifiedTime", None),
+                      codec=codec)
+
+
+class RemoteIndex:
+    def __init__(self):
+        """
+        In memory index of the files stored in Google Drive, mapping file name to RemoteFile. File names are posix
+        paths relative to the sync folder, e.g. "notes/todo.txt". Built from a single
+        listing at the start of a sync pass and kept up to date as files are created, updated and deleted so no
+        per-file lookup queries are needed. Safe to share between transfer worker threads. Pack objects holding packed
+        small files and chunk objects holding chunks of large files are indexed separately, so they never show up as
+        synced files.
+        """
+        self.lock = threading.RLock()
+        self.files_by_name = dict()
+        self.pack_objects = dict()
+        self.chunk_objects = dict()
+        self.names_by_id = dict()
+
+    def __contains__(self, file_name: str):
+        with self.lock:
+            return file_name in self.files_by_name
+
+    def __len__(self):
+        with self.lock:
+            return len(self.files_by_name)
+
+    def get(self, file_name: str) -> RemoteFile:
+        """
+        Return the indexed entry for a file name.
+
+        :param file_name: str name of the file in Google Drive.
+        :return: RemoteFile or None if no file with that name exists.
+        """
+        with self.lock:
+            return self.files_by_name.get(file_name, None)
+
+    def get_file_id(self, file_name: str) -> str:
+        """
+        Return the Google Drive file id for a file name.
+
+        :param file_name: str name of the file in Google Drive.
+        :return: None if no file exists. str that is the file id if it exists.
+        """
+        remote_file = self.get(file_name)
+        if remote_file is None:
+            return None
+        return remote_file.id
+
+    def get_file_name(self, file_id: str) -> str:
+        """
+        :param file_id: str represents file id of file in Google Drive.
+        :return: str indexed file name of the file id or None if it is not indexed.
+        """
+        with self.lock:
+            return self.names_by_id.get(file_id, None)
+
+    def names(self):
+        """
+        :return: list of all indexed file names.
+        """
+        with self.lock:
+            return list(self.files_by_name.keys())
+
+    def items(self):
+        """
+        :return: list of (file name, RemoteFile) tuples.
+        """
+        with self.lock:
+            return list(self.files_by_name.items())
+
+    def get_pack_object(self, name: str) -> RemoteFile:
+        """
+        :param name: str name of a pack or of the pack index.
+        :return: RemoteFile or None if no such pack object exists.
+        """
+        with self.lock:
+            return self.pack_objects.get(name, None)
+
+    def pack_object_items(self):
+        """
+        :return: list of (name, RemoteFile) tuples of every pack object.
+        """
+        with self.lock:
+            return list(self.pack_objects.items())
+
+    def get_chunk_object(self, name: str) -> RemoteFile:
+        """
+        :param name: str chunk_object_name of a chunk.
+        :return: RemoteFile or None if Google Drive does not have the chunk.
+        """
+        with self.lock:
+            return self.chunk_objects.get(name, None)
+
+    def chunk_object_items(self):
+        """
+        :return: list of (name, RemoteFile) tuples of every chunk object.
+        """
+        with self.lock:
+            return list(self.chunk_objects.items())
+
+    def add_file_info(self, file_info: dict, file_name: str = None):
+        """
+        Add an entry from a Google Drive file resource. If duplicates exist in Google Drive the first one
+        added is kept, matching get_file_id_if_exists which returns an arbitrary match.
+
+        :param file_info: dict with name, id, md5Checksum, size and modifiedTime fields.
+        :param file_name: str relative path to index the file under. Defaults to the name of the file resource.
+        :return: None
+        """
+        if file_name is None:
+            file_name = file_info["name"]
+        with self.lock:
+            if file_name not in self.files_by_name and file_name not in self.pack_objects and \
+                    file_name not in self.chunk_objects:
+                self.set_file_info(file_name, file_info)
+
+    def set_file_info(self, file_name: str, file_info: dict):
+        """
+        Record the result of a create or update call for a file name, replacing any existing entry.
+
+        :param file_name: str name of the file in Google Drive.
+        :param file_info: dict with id, md5Checksum, size and modifiedTime fields.
+        :return: None
+        """
+        remote_file = remote_file_from_info(file_info)
+        with self.lock:
+            self.remove(file_name)
+            if is_pack_object_name(file_name):
+                self.pack_objects[file_name] = remote_file
+            elif is_chunk_object_name(file_name):
+                self.chunk_objects[file_name] = remote_file
+            else:
+                self.files_by_name[file_name] = remote_file
+            self.names_by_id[remote_file.id] = file_name
+
+    def remove(self, file_name: str):
+        """
+        Forget a file name after it was deleted from Google Drive.
+
+        :param file_name: str name of the file in Google Drive.
+        :return: None
+        """
+        with self.lock:
+            remote_file = self.files_by_name.pop(file_name, None) or self.pack_objects.pop(file_name, None) or \
+                self.chunk_objects.pop(file_name, None)
+            if remote_file is not None:
+                self.names_by_id.pop(remote_file.id, None)
+
+    def remove_folder(self, folder_name: str):
+        """
+        Forget every file below a folder after the folder was deleted from Google Drive.
+
+        :param folder_name: str folder path relative to the sync folder.
+        :return: None
+        """
+        prefix = folder_name + "/"
+        with self.lock:
+            for file_name in [file_name for file_name in self.files_by_name if file_name.startswith(prefix)]:
+                self.remove(file_name)
+
+    def remove_file_id(self, file_id: str):
+        """
+        Forget the entry with the given file id after it was deleted from Google Drive.
+
+        :param file_id: str represents file id of file in Google Drive.
+        :return: None
+        """
+        with self.lock:
+            file_name = self.names_by_id.get(file_id, None)
+            if file_name is not None:
+                self.remove(file_name)
@@ -0,0 +1,389 @@
+from collections import OrderedDict
+from pathlib import Path
+import bisect
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from compression import decompress_stream
+
+
+BLOCK_CACHE_PATH = Path("block_cache")
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+DEFAULT_DISK_BUDGET = 1024 * 1024 * 1024
+# Sequential reads double the readahead window up to this many bytes, so a file read from start to end costs one
+# request per window rather than per block, while a random read only fetches the block it needs.
+DEFAULT_MAX_READAHEAD = 16 * 1024 * 1024
+
+
+class BlockCache:
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 disk_budget: int = DEFAULT_DISK_BUDGET, cache_path: Path = BLOCK_CACHE_PATH):
+        """
+        Least recently used cache of fixed size blocks of remote file content. Blocks live in memory up to
+        memory_budget bytes; blocks pushed out of memory are kept as files in cache_path up to disk_budget bytes, so
+        they survive restarts. Blocks are keyed by a key of the version of the content they belong to, which changes
+        whenever the file is replaced, so a stale block is never served. Safe to share between threads.
+
+        :param block_size: int size in bytes of every block but the last one of a file.
+        :param memory_budget: int bytes of block content kept in memory.
+        :param disk_budget: int bytes of block content kept on disk, 0 to keep blocks in memory only.
+        :param cache_path: Path of the folder the disk blocks are stored in. Created on first use.
+        """
+        self.block_size = block_size
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.cache_path = Path(cache_path)
+        self.lock = threading.RLock()
+        self.memory_blocks = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_blocks = None
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def block_key(content_key: str, block_index: int) -> str:
+        """
+        :param content_key: str key of a version of a file's content.
+        :param block_index: int position of the block in the content, in blocks.
+        :return: str key of the block, usable as a file name on every platform.
+        """
+        return hashlib.sha1(("%s-%d" % (content_key, block_index)).encode("utf-8")).hexdigest()
+
+    def _load_disk_blocks(self):
+        """
+        Index the blocks stored on disk by earlier runs, least recently used first. Called on first use.
+
+        :return: None
+        """
+        self.disk_blocks = OrderedDict()
+        self.disk_bytes = 0
+        try:
+            entries = [entry for entry in os.scandir(str(self.cache_path)) if entry.is_file()]
+        except OSError:
+            return
+        stats = [(entry.name, entry.stat()) for entry in entries if not entry.name.endswith(".tmp")]
+        for name, stat in sorted(stats, key=lambda item: item[1].st_mtime_ns):
+            self.disk_blocks[name] = stat.st_size
+            self.disk_bytes += stat.st_size
+        self._trim_disk(self.disk_budget)
+
+    def get(self, key: str) -> bytes:
+        """
+        :param key: str block key.
+        :return: bytes content of the block, or None if it is not cached.
+        """
+        with self.lock:
+            data = self.memory_blocks.get(key, None)
+            if data is not None:
+                self.memory_blocks.move_to_end(key)
+                self.hits += 1
+                return data
+            if self.disk_blocks is None:
+                self._load_disk_blocks()
+            if key not in self.disk_blocks:
+                self.misses += 1
+                return None
+            block_path = self.cache_path / key
+            try:
+                with open(str(block_path), "rb") as block_file:
+                    data = block_file.read()
+                # The modified time orders the disk blocks by use when the index is loaded again.
+                os.utime(str(block_path))
+            except OSError:
+                self.disk_bytes -= self.disk_blocks.pop(key)
+                self.misses += 1
+                return None
+            self.disk_blocks.move_to_end(key)
+            self.hits += 1
+            self._put_memory(key, data)
+            return data
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            if self.disk_blocks is None:
+                self._load_disk_blocks()
+            return key in self.memory_blocks or key in self.disk_blocks
+
+    def put(self, key: str, data: bytes):
+        """
+        Add a block, evicting the least recently used ones if a budget is exceeded.
+
+        :param key: str block key.
+        :param data: bytes content of the block.
+        :return: None
+        """
+        with self.lock:
+            self._put_memory(key, data)
+
+    def _put_memory(self, key: str, data: bytes):
+        old_data = self.memory_blocks.pop(key, None)
+        if old_data is not None:
+            self.memory_bytes -= len(old_data)
+        self.memory_blocks[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_budget and self.memory_blocks:
+            evicted_key, evicted_data = self.memory_blocks.popitem(last=False)
+            self.memory_bytes -= len(evicted_data)
+            self._put_disk(evicted_key, evicted_data)
+
+    def _put_disk(self, key: str, data: bytes):
+        if self.disk_blocks is None:
+            self._load_disk_blocks()
+        if key in self.disk_blocks:
+            self.disk_blocks.move_to_end(key)
+            return
+        if len(data) > self.disk_budget:
+            return
+        block_path = self.cache_path / key
+        tmp_path = self.cache_path / (key + ".tmp")
+        try:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), "wb") as block_file:
+                block_file.write(data)
+            os.replace(str(tmp_path), str(block_path))
+        except OSError:
+            # The disk cache is best effort, a block that cannot be stored is simply fetched again.
+            return
+        self.disk_blocks[key] = len(data)
+        self.disk_bytes += len(data)
+        self._trim_disk(self.disk_budget)
+
+    def _trim_disk(self, budget: int):
+        while self.disk_bytes > budget and self.disk_blocks:
+            evicted_key, size = self.disk_blocks.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(str(self.cache_path / evicted_key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Drop every cached block from memory and disk.
+
+        :return: None
+        """
+        with self.lock:
+            self.memory_blocks = OrderedDict()
+            self.memory_bytes = 0
+            if self.disk_blocks is None:
+                self._load_disk_blocks()
+            self._trim_disk(0)
+
+
+class RangeSource:
+    def __init__(self, drive_api, file_id: str, offset: int = 0):
+        """
+        Content stored as is in a Google Drive file, read with range requests. Also serves packed files, whose content
+        starts at an offset of their pack object.
+
+        :param drive_api: GoogleDriveApiHandler to read with.
+        :param file_id: str Google Drive file id.
+        :param offset: int position of the content in the Google Drive file.
+        """
+        self.drive_api = drive_api
+        self.file_id = file_id
+        self.offset = offset
+
+    def read(self, start: int, length: int) -> bytes:
+        return self.drive_api.download_range(self.file_id, self.offset + start, length)
+
+    def close(self):
+        pass
+
+
+class ChunkedSource:
+    def __init__(self, drive_api, chunks: list, chunk_ids: dict, chunk_index=None):
+        """
+        Content of a chunked file. A range is read from the chunks it overlaps: chunks available in unchanged local
+        files are read from there, the others with a range request on their chunk object.
+
+        :param drive_api: GoogleDriveApiHandler to read with.
+        :param chunks: list of ChunkRef of the file.
+        :param chunk_ids: dict of str Google Drive file ids of the chunk objects by chunk digest.
+        :param chunk_index: ChunkIndex of the chunks available locally, None to always read from Google Drive.
+        """
+        self.drive_api = drive_api
+        self.chunks = chunks
+        self.offsets = [chunk.offset for chunk in chunks]
+        self.chunk_ids = chunk_ids
+        self.chunk_index = chunk_index
+
+    def read(self, start: int, length: int) -> bytes:
+        data = bytearray()
+        end = start + length
+        position = start
+        index = max(0, bisect.bisect_right(self.offsets, start) - 1)
+        while position < end and index < len(self.chunks):
+            chunk = self.chunks[index]
+            chunk_start = position - chunk.offset
+            chunk_length = min(end, chunk.offset + chunk.length) - position
+            local_data = self.chunk_index.read_chunk(chunk.digest) if self.chunk_index is not None else None
+            if local_data is not None:
+                data += local_data[chunk_start:chunk_start + chunk_length]
+            else:
+                chunk_id = self.chunk_ids.get(chunk.digest, None)
+                if chunk_id is None:
+                    raise FileNotFoundError("Chunk " + chunk.digest + " is missing")
+                data += self.drive_api.download_range(chunk_id, chunk_start, chunk_length)
+            position += chunk_length
+            index += 1
+        return bytes(data)
+
+    def close(self):
+        pass
+
+
+class CompressedSource:
+    def __init__(self, drive_api, file_id: str, codec: str, md5: str = None):
+        """
+        Content of a compressed file. Compressed data cannot be read from the middle, so the first read downloads the
+        whole file and decompresses it into an anonymous temporary file that later reads are served from.
+
+        :param drive_api: GoogleDriveApiHandler to read with.
+        :param file_id: str Google Drive file id.
+        :param codec: str codec the file is compressed with.
+        :param md5: str md5 checksum of the content the decompressed data is checked against, None to not check it.
+        """
+        self.drive_api = drive_api
+        self.file_id = file_id
+        self.codec = codec
+        self.md5 = md5
+        self.content_file = None
+
+    def read(self, start: int, length: int) -> bytes:
+        if self.content_file is None:
+            content_file = tempfile.TemporaryFile()
+            try:
+                compressed = io.BytesIO(self.drive_api.download_range(self.file_id))
+                content_md5, size = decompress_stream(self.codec, compressed, content_file)
+                if self.md5 is not None and content_md5 != self.md5:
+                    raise ValueError("Decompressed content does not match its md5 checksum")
+            except BaseException:
+                content_file.close()
+                raise
+            self.content_file = content_file
+        self.content_file.seek(start)
+        return self.content_file.read(length)
+
+    def close(self):
+        if self.content_file is not None:
+            self.content_file.close()
+            self.content_file = None
+
+
+class RemoteFileReader(io.RawIOBase):
+    def __init__(self, name: str, size: int, content_key: str, source, cache: BlockCache,
+                 max_readahead: int = DEFAULT_MAX_READAHEAD):
+        """
+        Read only, seekable file object over the content of a file in Google Drive. Reads go through the block cache;
+        missing blocks are fetched from the source, several at a time while the file is read sequentially. Not safe
+        to use from several threads at once.
+
+        :param name: str path of the file relative to the sync folder.
+        :param size: int size of the content in bytes.
+        :param content_key: str key the content's blocks are cached under. Must change whenever the content does.
+        :param source: RangeSource, ChunkedSource or CompressedSource reading ranges of the content.
+        :param cache: BlockCache shared by every reader.
+        :param max_readahead: int largest number of bytes fetched with a single request.
+        """
+        super().__init__()
+        self.name = name
+        self.size = size
+        self.content_key = content_key
+        self.source = source
+        self.cache = cache
+        self.block_count = -(-size // cache.block_size)
+        self.max_readahead_blocks = max(1, max_readahead // cache.block_size)
+        self.readahead_blocks = 1
+        self.position = 0
+        self.last_block_index = None
+        self.block_index = None
+        self.block = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence: " + str(whence))
+        if position < 0:
+            raise ValueError("Negative seek position " + str(position))
+        self.position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self.position >= self.size or len(buffer) == 0:
+            return 0
+        block_size = self.cache.block_size
+        count = 0
+        # Fill the whole buffer, block after block, so read(n) returns n bytes unless the file ends first.
+        while count < len(buffer) and self.position < self.size:
+            block_index = self.position // block_size
+            block = self._get_block(block_index)
+            block_start = self.position - block_index * block_size
+            block_count = min(len(buffer) - count, len(block) - block_start)
+            buffer[count:count + block_count] = block[block_start:block_start + block_count]
+            self.position += block_count
+            count += block_count
+        return count
+
+    def _get_block(self, block_index: int) -> bytes:
+        if block_index == self.block_index:
+            return self.block
+        if self.last_block_index is not None and block_index == self.last_block_index + 1:
+            self.readahead_blocks = min(self.readahead_blocks * 2, self.max_readahead_blocks)
+        elif block_index != self.last_block_index:
+            self.readahead_blocks = 1
+        self.last_block_index = block_index
+        block = self.cache.get(self.cache.block_key(self.content_key, block_index))
+        if block is None:
+            block = self._fetch_blocks(block_index)
+        self.block_index = block_index
+        self.block = block
+        return block
+
+    def _fetch_blocks(self, block_index: int) -> bytes:
+        """
+        Fetch a block together with the uncached blocks behind it that fall into the readahead window, with a single
+        read from the source.
+
+        :return: bytes content of the block at block_index.
+        """
+        block_size = self.cache.block_size
+        end_index = block_index + 1
+        while end_index < min(block_index + self.readahead_blocks, self.block_count) and \
+                not self.cache.contains(self.cache.block_key(self.content_key, end_index)):
+            end_index += 1
+        start = block_index * block_size
+        data = self.source.read(start, min(self.size, end_index * block_size) - start)
+        if len(data) != min(self.size, end_index * block_size) - start:
+            raise IOError("Short read of " + self.name + " at offset " + str(start))
+        for index in range(block_index, end_index):
+            self.cache.put(self.cache.block_key(self.content_key, index),
+                           data[(index - block_index) * block_size:(index - block_index + 1) * block_size])
+        return data[:block_size]
+
+    def close(self):
+        if not self.closed:
+            self.source.close()
+            self.block = None
+        super().close()
@@ -0,0 +1,154 @@
+from pathlib import Path
+import json
+import os
+
+from remote_index import RemoteIndex
+
+
+REMOTE_STATE_PATH = Path("remote_state.json")
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+class RemoteState:
+    def __init__(self, state_path: Path = REMOTE_STATE_PATH):
+        """
+        Persisted Drive changes cursor together with a local mirror of the metadata of every file and folder in the
+        appDataFolder. Lets download() ask Google Drive only for what changed since the last run and work out the
+        affected local paths without listing everything again.
+
+        :param state_path: Path to the json file the state is stored in.
+        """
+        self.state_path = Path(state_path)
+        self.start_page_token = None
+        self.dir_path = None
+        self.files = dict()
+        self.read_state()
+
+    def read_state(self):
+        """
+        Read the cursor and metadata mirror from disk. A missing or corrupt file results in an empty state.
+
+        :return: None
+        """
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            self.start_page_token = state["start_page_token"]
+            self.dir_path = state["dir_path"]
+            self.files = state["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.reset(None, None)
+
+    def save(self):
+        """
+        Write the cursor and metadata mirror to disk through a temporary file so a crash never leaves a truncated
+        state behind.
+
+        :return: None
+        """
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump({"start_page_token": self.start_page_token,
+                       "dir_path": self.dir_path,
+                       "files": self.files}, state_file)
+        os.replace(str(tmp_path), str(self.state_path))
+
+    def reset(self, dir_path, start_page_token: str):
+        """
+        Start a new mirror, e.g. before a full listing.
+
+        :param dir_path: str or Path of the sync folder the mirror belongs to.
+        :param start_page_token: str Drive changes cursor taken before the full listing started.
+        :return: None
+        """
+        self.start_page_token = start_page_token
+        self.dir_path = str(dir_path) if dir_path is not None else None
+        self.files = dict()
+
+    def can_update(self, dir_path) -> bool:
+        """
+        :param dir_path: str or Path of the sync folder.
+        :return: True if a cursor exists for this sync folder, so only changes need to be fetched.
+        """
+        return self.start_page_token is not None and self.dir_path == str(dir_path)
+
+    def apply_file_info(self, file_info: dict):
+        """
+        Add or update the mirrored metadata of a file or folder.
+
+        :param file_info: dict file resource with id, name, mimeType or md5Checksum, size, modifiedTime, appProperties
+        and parents.
+        :return: None
+        """
+        entry = {"name": file_info["name"], "parents": file_info.get("parents", [])}
+        if file_info.get("mimeType", None) == FOLDER_MIME_TYPE:
+            entry["folder"] = True
+        else:
+            entry.update({"md5Checksum": file_info.get("md5Checksum", None),
+                          "size": file_info.get("size", None),
+                          "modifiedTime": file_info.get("modifiedTime", None)})
+            if file_info.get("appProperties", None):
+                entry["appProperties"] = file_info["appProperties"]
+        self.files[file_info["id"]] = entry
+
+    def apply_folder(self, folder_id: str, folder_name: str, parent_id: str):
+        """
+        Add or update the mirrored metadata of a folder.
+
+        :return: None
+        """
+        self.files[folder_id] = {"name": folder_name, "parents": [parent_id], "folder": True}
+
+    def apply_change(self, change: dict):
+        """
+        Apply an entry of the Drive changes feed to the mirror.
+
+        :param change: dict with fileId, removed and file fields.
+        :return: None
+        """
+        file_info = change.get("file", None)
+        if change.get("removed", False) or file_info is None or file_info.get("trashed", False):
+            self.files.pop(change["fileId"], None)
+        else:
+            self.apply_file_info(file_info)
+
+    def build_indexes(self, root_id: str):
+        """
+        Resolve the relative path of every mirrored file and folder.
+
+        :param root_id: str real id of the appDataFolder.
+        :return: (RemoteIndex, dict) index of files by relative path and folder ids by relative folder path, the sync
+        folder itself included under "".
+        """
+        folder_paths = {root_id: ""}
+
+        def resolve_folder(folder_id):
+            if folder_id in folder_paths:
+                return folder_paths[folder_id]
+            entry = self.files.get(folder_id, None)
+            if entry is None or not entry.get("folder", False) or not entry["parents"]:
+                return None
+            # Mark the folder before resolving its parent so a corrupt cycle ends instead of recursing forever.
+            folder_paths[folder_id] = None
+            parent_folder_path = resolve_folder(entry["parents"][0])
+            if parent_folder_path is not None:
+                folder_paths[folder_id] = entry["name"] if parent_folder_path == "" else \
+                    parent_folder_path + "/" + entry["name"]
+            return folder_paths[folder_id]
+
+        remote_index = RemoteIndex()
+        for file_id, entry in self.files.items():
+            if entry.get("folder", False):
+                resolve_folder(file_id)
+                continue
+            parent_folder_path = resolve_folder(entry["parents"][0]) if entry["parents"] else ""
+            if parent_folder_path is None:
+                continue
+            file_name = entry["name"] if parent_folder_path == "" else parent_folder_path + "/" + entry["name"]
+            remote_index.add_file_info(dict(entry, id=file_id), file_name)
+
+        ids_by_folder_path = dict()
+        for folder_id, folder_path in folder_paths.items():
+            if folder_path is not None and folder_path not in ids_by_folder_path:
+                ids_by_folder_path[folder_path] = folder_id
+        return remote_index, ids_by_folder_path
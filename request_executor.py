@@ -0,0 +1,270 @@
+from collections import deque
+from email.utils import parsedate_to_datetime
+import datetime
+import json
+import random
+import socket
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from transfer_scheduler import DEFAULT_WORKER_COUNT
+
+
+DEFAULT_MAX_RETRIES = 8
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 64.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ("userRateLimitExceeded", "rateLimitExceeded")
+DECREASE_FACTOR = 0.7
+RATE_INCREASE_FRACTION = 0.1
+MIN_RATE = 1.0
+RATE_WINDOW = 2.0
+
+
+class SyncCancelled(Exception):
+    def __init__(self):
+        """
+        Raised by Drive api calls and transfers after the running sync operation was cancelled.
+        """
+        super().__init__("Sync cancelled")
+
+
+def error_reason(error: HttpError) -> str:
+    """
+    :param error: HttpError returned by the Drive api.
+    :return: str reason of the first error detail, e.g. "userRateLimitExceeded", or None if there is none.
+    """
+    try:
+        content = error.content.decode("utf-8") if isinstance(error.content, bytes) else error.content
+        return json.loads(content)["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """
+    :return: True if the error means requests are sent faster than the quota allows.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (status == 403 and error_reason(error) in RATE_LIMIT_REASONS)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    :return: True if the request may succeed when sent again: rate limiting, server errors and dropped connections.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or is_throttle_error(error)
+    return isinstance(error, (ConnectionError, socket.timeout))
+
+
+def retry_after_seconds(error: Exception) -> float:
+    """
+    :param error: error raised by a request.
+    :return: float seconds the Retry-After header asks to wait, or None if there is no such header.
+    """
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get("retry-after", None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class RequestExecutor:
+    def __init__(self, max_concurrency: int = DEFAULT_WORKER_COUNT, max_rate: float = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, metrics=None):
+        """
+        Gate shared by every api handler of a Synchronizer that all Drive api calls go through. Failed calls that can
+        succeed later are retried with jittered exponential backoff, honouring Retry-After. The number of calls in
+        flight and the rate at which calls start adapt to throttling: both are cut by DECREASE_FACTOR when Google
+        Drive reports rate limiting and grow back additively while calls succeed, so a sync runs at the fastest pace
+        the quota allows.
+
+        :param max_concurrency: int upper bound for the number of calls in flight.
+        :param max_rate: float upper bound for calls started per second, None for no bound. The rate is unlimited
+        until the first throttling error.
+        :param max_retries: int number of times a call is retried before its error is raised.
+        :param base_delay: float seconds of backoff before the first retry, doubled for every further retry.
+        :param max_delay: float maximum seconds of backoff before a retry.
+        :param metrics: Metrics to record retries, throttling and the current limits in.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.random = random.Random()
+        self.condition = threading.Condition()
+        self.concurrency_limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.rate_limit = max_rate
+        self.rate_step = MIN_RATE
+        self.next_start_time = 0.0
+        self.start_times = deque()
+        self.last_decrease_time = 0.0
+        self.cancel_event = threading.Event()
+        self.record_limits()
+
+    def cancel(self):
+        """
+        Make every call that has not been sent yet raise SyncCancelled, including retries that are waiting for their
+        backoff to end. Requests already in flight finish, so transfers stop at a chunk boundary and can be resumed.
+
+        :return: None
+        """
+        self.cancel_event.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def clear_cancel(self):
+        """
+        Allow calls again after cancel().
+
+        :return: None
+        """
+        self.cancel_event.clear()
+
+    def check_cancelled(self):
+        """
+        :return: None
+        :raises SyncCancelled: if cancel() was called.
+        """
+        if self.cancel_event.is_set():
+            raise SyncCancelled()
+
+    def call(self, method: str, function, *args):
+        """
+        Run a Drive api call within the current limits, retrying it while it fails with a retryable error.
+
+        :param method: str api method id used for metrics, e.g. "drive.files.list".
+        :param function: callable making the call.
+        :return: whatever function returns.
+        """
+        attempt = 0
+        while True:
+            start_time = self.acquire()
+            try:
+                self.check_cancelled()
+                result = function(*args)
+            except Exception as error:
+                self.release()
+                if is_throttle_error(error):
+                    self.on_throttle(method, start_time)
+                if attempt >= self.max_retries or not is_retryable_error(error):
+                    raise
+                delay = self.backoff_delay(attempt, error)
+                attempt += 1
+                if self.metrics is not None:
+                    self.metrics.record_retry(method)
+                if self.cancel_event.wait(delay):
+                    raise SyncCancelled() from error
+                continue
+            self.release()
+            self.on_success()
+            return result
+
+    def backoff_delay(self, attempt: int, error: Exception) -> float:
+        """
+        :param attempt: int number of retries made so far.
+        :param error: error of the failed call.
+        :return: float seconds to wait before the next retry: full jitter exponential backoff, but at least as long as
+        Retry-After asks for.
+        """
+        delay = self.random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def acquire(self):
+        """
+        Wait until a call may start: fewer calls than the concurrency limit are in flight and the rate limit allows
+        another call.
+
+        :return: float monotonic time the call may start at.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.concurrency_limit) and not self.cancel_event.is_set():
+                self.condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start_time = now
+            if self.rate_limit is not None:
+                start_time = max(now, self.next_start_time)
+                self.next_start_time = start_time + 1.0 / self.rate_limit
+            self.start_times.append(start_time)
+            while self.start_times and self.start_times[0] < now - RATE_WINDOW:
+                self.start_times.popleft()
+        if start_time > now:
+            time.sleep(start_time - now)
+        return start_time
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def on_success(self):
+        """
+        Additive increase: the concurrency limit grows by about one per window of successful calls, the rate limit by
+        rate_step calls per second for every second of calls at that rate.
+
+        :return: None
+        """
+        with self.condition:
+            if self.concurrency_limit < self.max_concurrency:
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+                self.condition.notify_all()
+            if self.rate_limit is not None:
+                self.rate_limit += self.rate_step / self.rate_limit
+                if self.max_rate is not None:
+                    self.rate_limit = min(self.rate_limit, self.max_rate)
+        self.record_limits()
+
+    def on_throttle(self, method: str, start_time: float):
+        """
+        Multiplicative decrease of both limits after Google Drive reported rate limiting. The first time, the rate
+        limit starts from the rate observed over the last RATE_WINDOW seconds. The additive increase step is a fixed
+        fraction of the decreased rate, so recovering takes about as long at any quota. Calls that started before the
+        last decrease were sent under the old limits, so their throttling errors do not decrease the limits again.
+
+        :param method: str api method id of the throttled call.
+        :param start_time: float monotonic time the throttled call started at.
+        :return: None
+        """
+        if self.metrics is not None:
+            self.metrics.record_throttle(method)
+        with self.condition:
+            if start_time < self.last_decrease_time:
+                return
+            self.last_decrease_time = time.monotonic()
+            self.concurrency_limit = max(1.0, self.concurrency_limit * DECREASE_FACTOR)
+            if self.rate_limit is None:
+                observed_seconds = self.last_decrease_time - self.start_times[0] if self.start_times else RATE_WINDOW
+                observed_rate = len(self.start_times) / max(observed_seconds, 1.0 / self.max_concurrency)
+                self.rate_limit = max(MIN_RATE, observed_rate * DECREASE_FACTOR)
+            else:
+                self.rate_limit = max(MIN_RATE, self.rate_limit * DECREASE_FACTOR)
+            self.rate_step = max(MIN_RATE, self.rate_limit * RATE_INCREASE_FRACTION)
+        self.record_limits()
+
+    def record_limits(self):
+        if self.metrics is not None:
+            self.metrics.set_gauge("request_concurrency_limit", int(self.concurrency_limit))
+            self.metrics.set_gauge("request_rate_limit", self.rate_limit if self.rate_limit is not None else 0)
@@ -0,0 +1,117 @@
+from pathlib import Path
+import fnmatch
+import json
+import os
+import threading
+
+
+SELECTIVE_SYNC_PATH = Path("selective_sync.json")
+
+
+class SelectiveSync:
+    def __init__(self, patterns=None, state_path: Path = SELECTIVE_SYNC_PATH):
+        """
+        Selective sync configuration and state. With selective sync, download() only brings files into the sync folder
+        that match one of the patterns, were opened with Synchronizer.open_remote, or already have a local copy; every
+        other file stays in Google Drive only. Which files have a local copy is remembered, so upload() can tell a
+        file deleted locally, which is deleted in Google Drive too, from one that was never downloaded, which is
+        left alone. Safe to share between threads.
+
+        :param patterns: iterable of str fnmatch patterns of paths relative to the sync folder, e.g. "docs/*". None to
+        keep the patterns stored in the state file.
+        :param state_path: Path to the json file the configuration and state are stored in.
+        """
+        self.state_path = Path(state_path)
+        self.lock = threading.RLock()
+        self.patterns = []
+        self.accessed = set()
+        self.held = set()
+        self.read_state()
+        if patterns is not None:
+            self.patterns = list(patterns)
+
+    def read_state(self):
+        """
+        Read the configuration and state from disk. A missing or corrupt file results in no patterns and no files.
+
+        :return: None
+        """
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            patterns = list(state["patterns"])
+            accessed = set(state["accessed"])
+            held = set(state["held"])
+        except (OSError, ValueError, KeyError, TypeError):
+            patterns = []
+            accessed = set()
+            held = set()
+        with self.lock:
+            self.patterns = patterns
+            self.accessed = accessed
+            self.held = held
+
+    def save(self):
+        """
+        Write the configuration and state to disk through a temporary file so a crash never leaves a truncated file
+        behind.
+
+        :return: None
+        """
+        with self.lock:
+            state = {"patterns": self.patterns, "accessed": sorted(self.accessed), "held": sorted(self.held)}
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(str(tmp_path), str(self.state_path))
+
+    def wants(self, file_name: str) -> bool:
+        """
+        :param file_name: str path relative to the sync folder.
+        :return: True if the file is brought into the sync folder even without a local copy.
+        """
+        with self.lock:
+            return file_name in self.accessed or any(fnmatch.fnmatchcase(file_name, pattern)
+                                                     for pattern in self.patterns)
+
+    def record_access(self, file_name: str):
+        with self.lock:
+            self.accessed.add(file_name)
+
+    def forget(self, file_name: str):
+        """
+        Stop keeping a local copy of a file that does not match the patterns.
+
+        :return: None
+        """
+        with self.lock:
+            self.accessed.discard(file_name)
+            self.held.discard(file_name)
+
+    def is_held(self, file_name: str) -> bool:
+        """
+        :param file_name: str path relative to the sync folder.
+        :return: True if the file had a local copy after the last sync.
+        """
+        with self.lock:
+            return file_name in self.held
+
+    def set_held(self, file_names):
+        with self.lock:
+            self.held = set(file_names)
+
+    def hold(self, file_names):
+        with self.lock:
+            self.held.update(file_names)
+
+    def release(self, file_names):
+        with self.lock:
+            self.held.difference_update(file_names)
+
+    def release_folder(self, folder_name: str):
+        with self.lock:
+            self.held = set(file_name for file_name in self.held if not file_name.startswith(folder_name + "/"))
+
+    def held_names(self) -> list:
+        with self.lock:
+            return list(self.held)
@@ -0,0 +1,218 @@
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+
+SYNC_JOURNAL_PATH = Path("sync_journal.db")
+# Completed operations are written in one transaction once this many have piled up or FLUSH_SECONDS have passed, so
+# a pass of 100k operations costs a few hundred commits rather than 100k. Operations completed since the last flush
+# are replayed after a crash, which is why every journaled operation must be safe to repeat.
+FLUSH_COUNT = 500
+FLUSH_SECONDS = 1.0
+# The write-ahead log is folded back into the database and truncated after this many completed operations, and the
+# pages freed by completed operations are returned to the file system, so the journal never grows beyond the
+# operations still pending.
+COMPACT_COUNT = 20000
+
+SCHEMA = ("CREATE TABLE IF NOT EXISTS passes (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, dir_path TEXT NOT NULL, "
+          "detail TEXT)",
+          "CREATE TABLE IF NOT EXISTS operations (pass_id INTEGER NOT NULL, action TEXT NOT NULL, name TEXT NOT NULL, "
+          "argument TEXT, PRIMARY KEY (pass_id, action, name)) WITHOUT ROWID")
+
+
+class SyncJournal:
+    def __init__(self, journal_path: Path = SYNC_JOURNAL_PATH):
+        """
+        Write-ahead journal of sync passes, stored in SQLite in WAL mode. A pass records every operation it plans in
+        a single transaction before the first one runs and deletes each operation once it completed. If the process
+        dies halfway, the next pass of the same kind finds the operations that did not finish and replays only those
+        instead of planning the whole pass again from a listing that is stale by then. Safe to share between transfer
+        worker threads. The database is only opened when it is first used.
+
+        :param journal_path: Path to the SQLite database the journal is stored in.
+        """
+        self.journal_path = Path(journal_path)
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pass_id = None
+        self.completed = []
+        self.last_flush = time.monotonic()
+        self.completed_since_compact = 0
+
+    def connect(self) -> sqlite3.Connection:
+        with self.lock:
+            if self.connection is None:
+                connection = sqlite3.connect(str(self.journal_path), isolation_level=None, check_same_thread=False)
+                # auto_vacuum only takes effect before the first table is created.
+                connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                connection.execute("PRAGMA journal_mode=WAL")
+                # In WAL mode NORMAL never corrupts the database; a power cut may lose the last commits, which are
+                # replayed like any other unflushed completion.
+                connection.execute("PRAGMA synchronous=NORMAL")
+                for statement in SCHEMA:
+                    connection.execute(statement)
+                self.connection = connection
+            return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.flush()
+                self.connection.close()
+                self.connection = None
+
+    def begin(self, kind: str, dir_path, operations, detail: str = None):
+        """
+        Record a new pass and every operation it plans in one transaction, replacing any unfinished pass of the same
+        kind and folder.
+
+        :param kind: str kind of pass, e.g. "sync" or "upload".
+        :param dir_path: str or Path of the sync folder.
+        :param operations: iterable of (str, str, str) action, file name and argument of every planned operation. The
+        argument may be None.
+        :param detail: str anything the pass needs to be finished after a crash, e.g. the snapshot it ends with.
+        :return: None
+        """
+        with self.lock:
+            connection = self.connect()
+            self.completed = []
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_passes(connection, kind, dir_path)
+                self.pass_id = connection.execute("INSERT INTO passes (kind, dir_path, detail) VALUES (?, ?, ?)",
+                                                  (kind, str(dir_path), detail)).lastrowid
+                connection.executemany("INSERT OR REPLACE INTO operations (pass_id, action, name, argument) "
+                                       "VALUES (?, ?, ?, ?)",
+                                       ((self.pass_id, action, name, argument)
+                                        for action, name, argument in operations))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                self.pass_id = None
+                raise
+
+    def resume(self, kind: str, dir_path):
+        """
+        Pick up the unfinished pass of a kind and folder, if there is one.
+
+        :param kind: str kind of pass, e.g. "sync" or "upload".
+        :param dir_path: str or Path of the sync folder.
+        :return: (str, list) detail of the pass and list of (str, str, str) action, file name and argument of every
+        operation that did not complete, or None if there is no unfinished pass.
+        """
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT id, detail FROM passes WHERE kind = ? AND dir_path = ? "
+                                     "ORDER BY id DESC LIMIT 1", (kind, str(dir_path))).fetchone()
+            if row is None:
+                return None
+            self.pass_id = row[0]
+            self.completed = []
+            operations = connection.execute("SELECT action, name, argument FROM operations WHERE pass_id = ?",
+                                            (self.pass_id,)).fetchall()
+            return row[1], operations
+
+    def complete(self, action: str, name: str):
+        """
+        Mark an operation of the current pass as completed. Does nothing if no pass is running.
+
+        :param action: str action of the operation.
+        :param name: str file name of the operation.
+        :return: None
+        """
+        with self.lock:
+            if self.pass_id is None:
+                return
+            self.completed.append((self.pass_id, action, name))
+            if len(self.completed) >= FLUSH_COUNT or time.monotonic() - self.last_flush >= FLUSH_SECONDS:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the completed operations to the journal in one transaction and compact it once enough accumulated.
+
+        :return: None
+        """
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.completed:
+                return
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany("DELETE FROM operations WHERE pass_id = ? AND action = ? AND name = ?",
+                                       self.completed)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self.completed_since_compact += len(self.completed)
+            self.completed = []
+            if self.completed_since_compact >= COMPACT_COUNT:
+                self.compact()
+
+    def compact(self):
+        """
+        Fold the write-ahead log into the database, truncate it and release the pages of completed operations.
+
+        :return: None
+        """
+        with self.lock:
+            connection = self.connect()
+            # The pragma frees one page per step; executescript steps it to the end.
+            connection.executescript("PRAGMA incremental_vacuum;")
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.completed_since_compact = 0
+
+    def finish(self):
+        """
+        Drop the current pass once everything it planned is done.
+
+        :return: None
+        """
+        with self.lock:
+            if self.pass_id is None:
+                return
+            connection = self.connect()
+            self.completed = []
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM operations WHERE pass_id = ?", (self.pass_id,))
+                connection.execute("DELETE FROM passes WHERE id = ?", (self.pass_id,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self.pass_id = None
+            self.compact()
+
+    def suspend(self):
+        """
+        Stop recording completions without dropping the current pass, e.g. because it failed. The operations left are
+        replayed by the next pass of its kind.
+
+        :return: None
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.flush()
+            self.pass_id = None
+
+    def pending_count(self) -> int:
+        """
+        :return: int number of operations of the current pass that are not completed yet, 0 if no pass is running.
+        """
+        with self.lock:
+            if self.pass_id is None:
+                return 0
+            self.flush()
+            return self.connect().execute("SELECT COUNT(*) FROM operations WHERE pass_id = ?",
+                                          (self.pass_id,)).fetchone()[0]
+
+    @staticmethod
+    def _delete_passes(connection: sqlite3.Connection, kind: str, dir_path):
+        pass_ids = [(row[0],) for row in connection.execute("SELECT id FROM passes WHERE kind = ? AND dir_path = ?",
+                                                            (kind, str(dir_path)))]
+        connection.executemany("DELETE FROM operations WHERE pass_id = ?", pass_ids)
+        connection.executemany("DELETE FROM passes WHERE id = ?", pass_ids)
@@ -0,0 +1,293 @@
+from pathlib import Path, PurePosixPath
+import json
+import os
+
+from folder_cache import parent_path
+
+
+SYNC_SNAPSHOT_PATH = Path("sync_snapshot.json")
+
+
+class SyncSnapshot:
+    def __init__(self, state_path: Path = SYNC_SNAPSHOT_PATH):
+        """
+        The state local folder and Google Drive last agreed on: md5 checksum of every file and every folder, by path
+        relative to the sync folder. Comparing both sides against it tells which side changed a file, so sync() can
+        apply changes in both directions without mistaking a file the other side never had for one that was deleted.
+
+        :param state_path: Path to the json file the snapshot is stored in.
+        """
+        self.state_path = Path(state_path)
+        self.dir_path = None
+        self.files = dict()
+        self.folders = set()
+        self.read_state()
+
+    def read_state(self):
+        """
+        Read the snapshot from disk. A missing or corrupt file results in an empty snapshot, so the next sync merges
+        both sides without deleting anything.
+
+        :return: None
+        """
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            self.dir_path = state["dir_path"]
+            self.files = dict(state["files"])
+            self.folders = set(state["folders"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.reset(None)
+
+    def save(self):
+        """
+        Write the snapshot to disk through a temporary file so a crash never leaves a truncated snapshot behind.
+
+        :return: None
+        """
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump({"dir_path": self.dir_path, "files": self.files, "folders": sorted(self.folders)}, state_file,
+                      separators=(",", ":"))
+        os.replace(str(tmp_path), str(self.state_path))
+
+    def reset(self, dir_path):
+        self.dir_path = str(dir_path) if dir_path is not None else None
+        self.files = dict()
+        self.folders = set()
+
+    def belongs_to(self, dir_path) -> bool:
+        """
+        :param dir_path: str or Path of the sync folder.
+        :return: True if the snapshot was taken of that sync folder.
+        """
+        return self.dir_path == str(dir_path)
+
+
+def conflict_name(file_name: str, stamp: str, taken) -> str:
+    """
+    :param file_name: str path of a file changed on both sides.
+    :param stamp: str time of the sync, e.g. "2020-01-31 120000".
+    :param taken: container of str paths already in use.
+    :return: str path next to the file that the local version is kept under, e.g. "a/b (conflict 2020-01-31
+    120000).txt".
+    """
+    path = PurePosixPath(file_name)
+    number = 1
+    while True:
+        suffix = "" if number == 1 else " %d" % number
+        candidate = str(path.with_name("%s (conflict %s%s)%s" % (path.stem, stamp, suffix, path.suffix)))
+        if candidate not in taken:
+            return candidate
+        number += 1
+
+
+def _ancestors(file_name: str):
+    folder_path = parent_path(file_name)
+    while folder_path != "":
+        yield folder_path
+        folder_path = parent_path(folder_path)
+
+
+# Journal action of every list of a SyncPlan. Conflicts are journaled as "rename" operations.
+JOURNAL_ACTIONS = (("create_local_folder", "local_folder_creates"),
+                   ("download", "downloads"),
+                   ("delete_local", "local_deletes"),
+                   ("delete_local_folder", "local_folder_deletes"),
+                   ("create_remote_folder", "remote_folder_creates"),
+                   ("upload", "uploads"),
+                   ("delete_remote", "remote_deletes"),
+                   ("delete_remote_folder", "remote_folder_deletes"))
+
+
+class SyncPlan:
+    def __init__(self):
+        """
+        What a two-way sync does. Every list holds paths relative to the sync folder. Folder deletions only list the
+        topmost folders, deleting a folder deletes everything in it.
+        """
+        self.uploads = []
+        self.downloads = []
+        self.local_deletes = []
+        self.remote_deletes = []
+        # (str, str) tuples of a file changed on both sides and the path its local version is moved to.
+        self.conflicts = []
+        self.local_folder_creates = []
+        self.remote_folder_creates = []
+        self.local_folder_deletes = []
+        self.remote_folder_deletes = []
+        # The snapshot to store once the plan was carried out.
+        self.snapshot_files = dict()
+        self.snapshot_folders = set()
+
+    def is_empty(self) -> bool:
+        return not (self.uploads or self.downloads or self.local_deletes or self.remote_deletes or self.conflicts or
+                    self.local_folder_creates or self.remote_folder_creates or self.local_folder_deletes or
+                    self.remote_folder_deletes)
+
+    def to_journal(self) -> tuple:
+        """
+        :return: (list, str) (action, file name, argument) of every operation of the plan and the snapshot it ends
+        with as json, the way SyncJournal.begin takes them.
+        """
+        operations = [("rename", file_name, copy_name) for file_name, copy_name in self.conflicts]
+        for action, names in JOURNAL_ACTIONS:
+            operations += [(action, name, None) for name in getattr(self, names)]
+        return operations, json.dumps({"files": self.snapshot_files, "folders": sorted(self.snapshot_folders)},
+                                      separators=(",", ":"))
+
+    @classmethod
+    def from_journal(cls, detail: str, operations: list):
+        """
+        :param detail: str snapshot json of a plan's to_journal.
+        :param operations: list of (str, str, str) operations of the plan that did not complete yet.
+        :return: SyncPlan with the operations that are left.
+        """
+        plan = cls()
+        names_by_action = {action: getattr(plan, names) for action, names in JOURNAL_ACTIONS}
+        for action, name, argument in operations:
+            if action == "rename":
+                plan.conflicts.append((name, argument))
+            else:
+                names_by_action[action].append(name)
+        for action, names in JOURNAL_ACTIONS:
+            getattr(plan, names).sort(key=lambda name: (name.count("/"), name) if "folder" in action else name)
+        plan.conflicts.sort()
+        snapshot = json.loads(detail)
+        plan.snapshot_files = dict(snapshot["files"])
+        plan.snapshot_folders = set(snapshot["folders"])
+        return plan
+
+    def describe(self) -> str:
+        """
+        :return: str human readable plan, one line per action after a summary line.
+        """
+        lines = ["Sync plan: %d upload(s), %d download(s), %d local delete(s), %d remote delete(s), %d conflict(s)"
+                 % (len(self.uploads), len(self.downloads), len(self.local_deletes) + len(self.local_folder_deletes),
+                    len(self.remote_deletes) + len(self.remote_folder_deletes), len(self.conflicts))]
+        for label, names in (("create remote folder", self.remote_folder_creates),
+                             ("create local folder", self.local_folder_creates),
+                             ("upload", self.uploads),
+                             ("download", self.downloads),
+                             ("delete local", self.local_deletes),
+                             ("delete local folder", self.local_folder_deletes),
+                             ("delete remote", self.remote_deletes),
+                             ("delete remote folder", self.remote_folder_deletes)):
+            lines += ["  %-21s %s" % (label, name) for name in names]
+        lines += ["  %-21s %s, local version kept as %s" % ("conflict", file_name, copy_name)
+                  for file_name, copy_name in self.conflicts]
+        return "\n".join(lines)
+
+
+def plan_sync(local_files: dict, local_folders: set, remote_files: dict, remote_folders: set, snapshot: SyncSnapshot,
+              stamp: str, skipped_names=()) -> SyncPlan:
+    """
+    Three-way merge of the local folder and Google Drive against the last agreed snapshot, in a single pass over the
+    paths of the three. A file that differs from the snapshot on one side only is copied to the other side, or
+    deleted there if it was deleted. A file changed on both sides is a conflict: the Google Drive version wins the
+    path and the local version is kept next to it under a conflict name and uploaded. A change always wins over a
+    deletion, and files both sides changed the same way need no transfer.
+
+    :param local_files: dict of str md5 checksum of every local file by path.
+    :param local_folders: set of str paths of every local folder.
+    :param remote_files: dict of str md5 checksum of every file in Google Drive by path.
+    :param remote_folders: set of str paths of every folder in Google Drive.
+    :param snapshot: SyncSnapshot of the last sync of the same folder.
+    :param stamp: str time of the sync used in conflict names.
+    :param skipped_names: container of str paths of files that are left alone, e.g. files selective sync keeps in
+    Google Drive only or local files that could not be read. The folders holding them are kept on both sides.
+    :return: SyncPlan
+    """
+    plan = SyncPlan()
+    snapshot_files = snapshot.files
+    final_local_files = set(skipped_names)
+    final_remote_files = set(skipped_names)
+    taken_names = set(local_files) | set(remote_files) | set(skipped_names)
+    for file_name in taken_names | set(snapshot_files):
+        if file_name in skipped_names:
+            if file_name in snapshot_files:
+                plan.snapshot_files[file_name] = snapshot_files[file_name]
+            continue
+        local_md5 = local_files.get(file_name, None)
+        remote_md5 = remote_files.get(file_name, None)
+        snapshot_md5 = snapshot_files.get(file_name, None)
+        if local_md5 == remote_md5:
+            if local_md5 is not None:
+                plan.snapshot_files[file_name] = local_md5
+                final_local_files.add(file_name)
+                final_remote_files.add(file_name)
+        elif remote_md5 == snapshot_md5 or (local_md5 != snapshot_md5 and remote_md5 is None):
+            # Only the local folder changed, or it changed a file that was deleted in Google Drive.
+            if local_md5 is None:
+                plan.remote_deletes.append(file_name)
+            else:
+                plan.uploads.append(file_name)
+                plan.snapshot_files[file_name] = local_md5
+                final_local_files.add(file_name)
+                final_remote_files.add(file_name)
+        elif local_md5 == snapshot_md5 or local_md5 is None:
+            # Only Google Drive changed, or it changed a file that was deleted locally.
+            if remote_md5 is None:
+                plan.local_deletes.append(file_name)
+            else:
+                plan.downloads.append(file_name)
+                plan.snapshot_files[file_name] = remote_md5
+                final_local_files.add(file_name)
+                final_remote_files.add(file_name)
+        else:
+            copy_name = conflict_name(file_name, stamp, taken_names)
+            taken_names.add(copy_name)
+            plan.conflicts.append((file_name, copy_name))
+            plan.downloads.append(file_name)
+            plan.uploads.append(copy_name)
+            plan.snapshot_files[file_name] = remote_md5
+            plan.snapshot_files[copy_name] = local_md5
+            final_local_files.update((file_name, copy_name))
+            final_remote_files.update((file_name, copy_name))
+
+    # A folder deleted on one side is only deleted on the other if nothing that stays there is inside it; otherwise it
+    # is recreated. Children are decided before their parents.
+    local_needed = set(folder_path for file_name in final_local_files for folder_path in _ancestors(file_name))
+    remote_needed = set(folder_path for file_name in final_remote_files for folder_path in _ancestors(file_name))
+    local_deleted = set()
+    remote_deleted = set()
+    for folder_path in sorted(local_folders | remote_folders | snapshot.folders,
+                              key=lambda folder_path: folder_path.count("/"), reverse=True):
+        in_local = folder_path in local_folders
+        in_remote = folder_path in remote_folders
+        if in_local and in_remote:
+            keep = True
+        elif in_local:
+            keep = folder_path not in snapshot.folders or folder_path in remote_needed
+            if keep:
+                plan.remote_folder_creates.append(folder_path)
+            else:
+                local_deleted.add(folder_path)
+        elif in_remote:
+            keep = folder_path not in snapshot.folders or folder_path in local_needed
+            if keep:
+                plan.local_folder_creates.append(folder_path)
+            else:
+                remote_deleted.add(folder_path)
+        else:
+            keep = False
+        if keep:
+            plan.snapshot_folders.add(folder_path)
+            for ancestor in _ancestors(folder_path):
+                local_needed.add(ancestor)
+                remote_needed.add(ancestor)
+    plan.remote_folder_creates.reverse()
+    plan.local_folder_creates.reverse()
+    plan.local_folder_deletes = sorted(folder_path for folder_path in local_deleted
+                                       if parent_path(folder_path) not in local_deleted)
+    plan.remote_folder_deletes = sorted(folder_path for folder_path in remote_deleted
+                                        if parent_path(folder_path) not in remote_deleted)
+    # Files inside a deleted folder go with it.
+    plan.local_deletes = [file_name for file_name in plan.local_deletes
+                          if not any(folder_path in local_deleted for folder_path in _ancestors(file_name))]
+    plan.remote_deletes = [file_name for file_name in plan.remote_deletes
+                           if not any(folder_path in remote_deleted for folder_path in _ancestors(file_name))]
+    for action_names in (plan.uploads, plan.downloads, plan.local_deletes, plan.remote_deletes):
+        action_names.sort()
+    plan.conflicts.sort()
+    return plan
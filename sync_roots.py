@@ -0,0 +1,192 @@
+from pathlib import Path
+import threading
+
+from bandwidth import BandwidthLimiter
+from drive_client import DriveClient
+from metrics import Metrics
+from synchronizer import Synchronizer
+from transfer_scheduler import TransferPriority, DEFAULT_WORKER_COUNT
+
+
+ROOTS_STATE_DIR = Path("roots")
+# Name of the single root described by a configuration from before sync roots existed.
+LEGACY_ROOT_NAME = "files"
+
+
+def paths_overlap(first_path: str, second_path: str) -> bool:
+    """
+    :param first_path: str posix folder path inside the appDataFolder, "" for the appDataFolder itself.
+    :param second_path: str posix folder path inside the appDataFolder.
+    :return: True if one folder is the other or contains it.
+    """
+    return first_path == "" or second_path == "" or first_path == second_path or \
+        first_path.startswith(second_path + "/") or second_path.startswith(first_path + "/")
+
+
+def check_roots(roots: list):
+    """
+    Make sure sync roots can run side by side: a root mirrored to the appDataFolder itself would see the folders of
+    every other root as its own and delete them.
+
+    :param roots: list of SyncRoot.
+    :return: None
+    :raises ValueError: if there are no roots, two roots have the same name or their remote folders overlap.
+    """
+    if not roots:
+        raise ValueError("No sync roots are configured")
+    for index, root in enumerate(roots):
+        for other_root in roots[:index]:
+            if root.name == other_root.name:
+                raise ValueError("Two sync roots are named " + root.name)
+            if paths_overlap(root.remote_path, other_root.remote_path):
+                raise ValueError("Sync roots " + other_root.name + " and " + root.name + " have overlapping remote "
+                                 "folders")
+
+
+class SyncRoot:
+    def __init__(self, name: str, file_dir_path: str, remote_path: str = None, exclude=(), priority: int = 0,
+                 state_dir: Path = None, weight: float = 1.0, prioritize=(), small_files_first: bool = True,
+                 selective_sync=None):
+        """
+        A named local folder synced with its own folder in Google Drive.
+
+        :param name: str unique name of the root, e.g. "photos".
+        :param file_dir_path: str path of the local folder.
+        :param remote_path: str posix path of the folder inside the appDataFolder the local folder is mirrored to, the
+        name of the root if None, "" for the appDataFolder itself.
+        :param exclude: iterable of str fnmatch patterns of paths relative to the local folder that are never synced.
+        :param priority: int roots with a higher priority get their transfers queued first when roots run together.
+        :param state_dir: Path of the folder the caches, indexes and journals of the root are kept in,
+        roots/<name> if None.
+        :param weight: float weight of the transfers of the root against those of the other roots, see
+        TransferPriority.
+        :param prioritize: iterable of str fnmatch patterns of paths relative to the local folder whose transfers
+        come before any other.
+        :param small_files_first: bool True to transfer smaller files of the root first, False for queue order.
+        :param selective_sync: iterable of str fnmatch patterns of the files download brings into the local folder,
+        see SelectiveSync. None to mirror every file.
+        """
+        self.name = name
+        self.file_dir_path = str(file_dir_path)
+        self.remote_path = (remote_path if remote_path is not None else name).strip("/")
+        self.exclude = list(exclude)
+        self.priority = priority
+        self.state_dir = Path(state_dir) if state_dir is not None else ROOTS_STATE_DIR / name
+        self.weight = weight
+        self.prioritize = list(prioritize)
+        self.small_files_first = small_files_first
+        self.selective_sync = list(selective_sync) if selective_sync is not None else None
+
+    def transfer_priority(self) -> TransferPriority:
+        """
+        :return: TransferPriority ranking the transfers of the root.
+        """
+        return TransferPriority(self.small_files_first, self.prioritize, self.weight)
+
+    def new_synchronizer(self, worker_count: int = DEFAULT_WORKER_COUNT, **synchronizer_options) -> Synchronizer:
+        """
+        :param worker_count: int number of transfers that run in parallel.
+        :param synchronizer_options: keyword arguments passed on to the Synchronizer, e.g. client or bandwidth.
+        :return: Synchronizer of the root, keeping its state, selective sync included, in the root's state folder.
+        """
+        return Synchronizer(self.file_dir_path, worker_count, state_dir=self.state_dir, remote_path=self.remote_path,
+                            exclude=self.exclude, transfer_priority=self.transfer_priority(),
+                            selective_patterns=self.selective_sync, **synchronizer_options)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name,
+                "file_dir_path": self.file_dir_path,
+                "remote_path": self.remote_path,
+                "exclude": self.exclude,
+                "priority": self.priority,
+                "state_dir": str(self.state_dir),
+                "weight": self.weight,
+                "prioritize": self.prioritize,
+                "small_files_first": self.small_files_first,
+                "selective_sync": self.selective_sync}
+
+    @classmethod
+    def from_dict(cls, root_conf: dict):
+        """
+        :param root_conf: dict as stored in the configuration file. Only name and file_dir_path are required.
+        :return: SyncRoot
+        """
+        return cls(root_conf["name"], root_conf["file_dir_path"], root_conf.get("remote_path", None),
+                   root_conf.get("exclude", ()), root_conf.get("priority", 0), root_conf.get("state_dir", None),
+                   root_conf.get("weight", 1.0), root_conf.get("prioritize", ()),
+                   root_conf.get("small_files_first", True), root_conf.get("selective_sync", None))
+
+
+class MultiRootSync:
+    def __init__(self, roots: list, client: DriveClient = None, backend=None, metrics: Metrics = None,
+                 worker_count: int = DEFAULT_WORKER_COUNT, bandwidth: BandwidthLimiter = None, **synchronizer_options):
+        """
+        Runs several sync roots in one process. Every root has its own Synchronizer and state, but they all share a
+        single DriveClient: one credential load, one service object per thread, one queue of transfers ranked by the
+        priority rules of their roots, one bandwidth limiter and one rate limiter for every api call. Running roots
+        together then uses the quota of the account as a whole instead of each root competing for it from its own
+        process.
+
+        :param roots: list of SyncRoot. Names must be unique and no remote folder may contain another.
+        :param client: DriveClient to share between the roots, a new one from backend, metrics and worker_count if
+        None.
+        :param backend: Drive backend of a new client, the real Google Drive api if None.
+        :param metrics: Metrics of a new client, recording the api calls and transfers of every root.
+        :param worker_count: int number of transfers of all roots together that run in parallel.
+        :param bandwidth: BandwidthLimiter of a new client, capping the transfers of all roots together.
+        :param synchronizer_options: keyword arguments passed on to every Synchronizer, e.g. pack_threshold.
+        :raises ValueError: if there are no roots, two roots have the same name or overlapping remote folders.
+        """
+        check_roots(roots)
+        self.client = client if client is not None else DriveClient(backend, metrics, worker_count=worker_count,
+                                                                    bandwidth=bandwidth)
+        self.metrics = self.client.metrics
+        self.roots = sorted(roots, key=lambda root: -root.priority)
+        self.synchronizers = {root.name: root.new_synchronizer(worker_count, client=self.client,
+                                                               **synchronizer_options)
+                              for root in self.roots}
+
+    def run(self, operation: str = "sync") -> dict:
+        """
+        Run a sync operation on every root at once, each on a thread of its own. Roots are started in priority order,
+        so the transfers of higher priority roots are queued first. A root that fails does not stop the others.
+
+        :param operation: str Synchronizer method to run, e.g. "sync", "upload" or "download".
+        :return: dict of the exception each root failed with, None for roots that succeeded, indexed by root name.
+        """
+        errors = dict()
+
+        def run_root(root_name):
+            try:
+                getattr(self.synchronizers[root_name], operation)()
+                errors[root_name] = None
+            except Exception as error:
+                errors[root_name] = error
+                self.metrics.emit("root_failed", root_name, message="Sync root " + root_name + " failed: " + str(error))
+
+        threads = [threading.Thread(target=run_root, args=(root.name,), name="simple-sync-root-" + root.name)
+                   for root in self.roots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def cancel(self):
+        """
+        Stop the operations running on every root. Can be called from any thread.
+
+        :return: None
+        """
+        self.client.executor.cancel()
+
+    def clear_cancel(self):
+        self.client.executor.clear_cancel()
+
+    def close(self):
+        """
+        Stop the shared transfer threads.
+
+        :return: None
+        """
+        self.client.close()
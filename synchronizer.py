@@ -1,77 +1,1362 @@
-import pickle
-import os.path
+import fnmatch
+import hashlib
 import io
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.http import MediaFileUpload
+import os.path
+import tempfile
+import time
+from googleapiclient.errors import HttpError
 from pathlib import Path
+from bandwidth import BandwidthLimiter
+from chunk_store import ChunkIndex, ChunkRef, CHUNKED_CODEC, CHUNK_INDEX_PATH, chunk_file, chunk_object_name, \
+    is_chunk_object_name, manifest_from_bytes, manifest_key, manifest_to_bytes
+from compression import CompressionPolicy, compress_stream, decompress_stream, is_compression_codec
+from drive_backend import shared_backend
+from drive_client import DriveClient
+from folder_cache import FolderCache, FOLDER_CACHE_PATH, ROOT_FOLDER_ID, parent_path, base_name
+from hash_cache import HashCache, HASH_CACHE_PATH
+from hash_pool import HashPool
+from local_tree import LocalTree, walk_local_tree
+from metrics import Metrics
+from pack_store import PackIndex, PackMember, PACK_INDEX_NAME, PACK_INDEX_PATH, MIN_PACK_SIZE, REPACK_RATIO, \
+    is_pack_object_name, new_pack_name, plan_packs
+from remote_reader import BlockCache, RemoteFileReader, RangeSource, ChunkedSource, CompressedSource, \
+    BLOCK_CACHE_PATH, DEFAULT_MAX_READAHEAD
+from remote_index import RemoteIndex, CODEC_PROPERTY, CONTENT_MD5_PROPERTY, CONTENT_SIZE_PROPERTY, CODEC_PROPERTIES
+from remote_state import RemoteState, FOLDER_MIME_TYPE, REMOTE_STATE_PATH
+from request_executor import RequestExecutor, SyncCancelled
+from selective_sync import SelectiveSync, SELECTIVE_SYNC_PATH
+from sync_journal import SyncJournal, SYNC_JOURNAL_PATH
+from sync_planner import SyncPlan, SyncSnapshot, SYNC_SNAPSHOT_PATH, plan_sync
+from transfer_journal import TransferJournal, TRANSFER_JOURNAL_PATH
+from transfer_scheduler import TransferScheduler, TransferPriority, TransferResult, TransferError, DEFAULT_WORKER_COUNT
+
+FILE_INFO_FIELDS = "id, name, md5Checksum, size, modifiedTime, parents, appProperties"
+LIST_PAGE_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
+EXPIRED_SESSION_STATUSES = (404, 410)
+INVALID_CURSOR_STATUSES = (400, 404, 410)
+BATCH_SIZE = 100
+# Journal action of the operations that transfers of these kinds complete.
+JOURNALED_TRANSFERS = {"download_file": "download", "download_chunked_file": "download", "upload_file": "upload"}
+
+
+def is_partial_download(file_path_obj: Path) -> bool:
+    """
+    Determine if a path is the temporary file of a download in progress.
+
+    :param file_path_obj: Path of the local file.
+    :return: True if the path is a partial download.
+    """
+    return file_path_obj.name.startswith(".") and file_path_obj.name.endswith(PARTIAL_DOWNLOAD_SUFFIX)
+
 
-SCOPES = ["https://www.googleapis.com/auth/drive.appdata", "https://www.googleapis.com/auth/drive.file"]
+def is_excluded_file(file_path_obj: Path) -> bool:
+    """
+    Determine if a local file is never synced: partial downloads and files named like pack or chunk objects.
+
+    :param file_path_obj: Path of the local file.
+    :return: True if the file is left out of uploads.
+    """
+    return is_partial_download(file_path_obj) or is_pack_object_name(file_path_obj.name) or \
+        is_chunk_object_name(file_path_obj.name)
 
 
 class Synchronizer:
-    def __init__(self, file_dir_path_str: str):
+    def __init__(self, file_dir_path_str: str, worker_count: int = DEFAULT_WORKER_COUNT,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, metrics: Metrics = None,
+                 pack_threshold: int = None, dedup_threshold: int = None, compression: CompressionPolicy = None,
+                 block_cache: BlockCache = None, selective_sync: SelectiveSync = None, hash_worker_count: int = None,
+                 state_dir: Path = None, client: DriveClient = None, remote_path: str = "", exclude=(),
+                 transfer_priority: TransferPriority = None, bandwidth: BandwidthLimiter = None,
+                 selective_patterns=None):
         """
         Initialize Google Drive API handler. Determine folder to be used for file syncing features.
 
         :param folder_path: str representing path to the directory containing files to be synced.
+        :param worker_count: int number of transfers that run in parallel during upload and download.
+        :param chunk_size: int number of bytes transferred per request when streaming file contents.
+        :param backend: Drive backend passed to GoogleDriveApiHandler, the real Google Drive api if None.
+        :param metrics: Metrics collecting api calls, timings and progress events of this synchronizer.
+        :param pack_threshold: int size in bytes up to which files are uploaded inside pack objects rather than as files
+        of their own, e.g. DEFAULT_PACK_THRESHOLD. None to turn packing off; files packed before are then uploaded as
+        files of their own again. Packed files are always downloaded.
+        :param dedup_threshold: int size in bytes from which changed files are uploaded as content defined chunks, e.g.
+        DEFAULT_DEDUP_THRESHOLD. Only chunks Google Drive does not have yet are sent, so an edit costs about the size of
+        the chunks it touched and identical content is stored once. None to upload changed files whole. Chunked files
+        are always downloaded, reusing chunks already found in local files.
+        :param compression: CompressionPolicy deciding which files are compressed before they are uploaded, None to
+        upload files as they are. Compressed files are always decompressed on download.
+        :param block_cache: BlockCache holding the content read with open_remote, a BlockCache with the default
+        budgets if None.
+        :param selective_sync: SelectiveSync deciding which files download brings into the sync folder, None to
+        mirror every file, or to use selective_patterns.
+        :param hash_worker_count: int number of processes hashing local files whose md5 checksum is not cached, the
+        number of cores if None.
+        :param state_dir: Path of the folder the caches, indexes and journals of this synchronizer are kept in, the
+        working directory if None. Synchronizers running side by side need one each.
+        :param client: DriveClient shared with other synchronizers, e.g. one per sync root, so they use one set of
+        credentials, one rate limiter and one pool of transfer threads. Its backend and metrics are used instead of
+        the backend and metrics parameters. None to connect on its own.
+        :param remote_path: str posix path of the folder inside the appDataFolder the sync folder is mirrored to, ""
+        for the appDataFolder itself.
+        :param exclude: iterable of str fnmatch patterns of paths relative to the sync folder that are never synced,
+        e.g. "*.tmp". Matching files are neither uploaded, downloaded nor deleted on either side.
+        :param transfer_priority: TransferPriority deciding which queued transfer runs next, small files first if
+        None.
+        :param bandwidth: BandwidthLimiter capping the upload and download rate, None for no limit. A shared
+        DriveClient brings its own.
+        :param selective_patterns: iterable of str fnmatch patterns turning on selective sync without a selective_sync,
+        with its state kept in the state folder. None for no selective sync.
         """
-        self.drive_api = GoogleDriveApiHandler()
+        if client is not None:
+            metrics = client.metrics
+        self.state_dir = Path(state_dir) if state_dir is not None else Path(".")
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.client = client
+        self.metrics = metrics if metrics is not None else Metrics()
+        executor = client.executor if client is not None else RequestExecutor(worker_count, metrics=self.metrics)
+        self.drive_api = GoogleDriveApiHandler(chunk_size=chunk_size, backend=backend, metrics=self.metrics,
+                                               executor=executor, compression=compression,
+                                               journal=TransferJournal(self.state_path(TRANSFER_JOURNAL_PATH)),
+                                               folder_cache=FolderCache(self.state_path(FOLDER_CACHE_PATH),
+                                                                        remote_path),
+                                               client=client, bandwidth=bandwidth)
         self.dir_path = Path(file_dir_path_str)
+        self.exclude = list(exclude)
+        self.transfer_priority = transfer_priority if transfer_priority is not None else TransferPriority()
+        self.hash_cache = HashCache(self.state_path(HASH_CACHE_PATH))
+        self.hash_pool = HashPool(hash_worker_count)
+        self.remote_state = RemoteState(self.state_path(REMOTE_STATE_PATH))
+        self.remote_index = None
+        self.pack_threshold = pack_threshold
+        self.pack_index = PackIndex(self.state_path(PACK_INDEX_PATH))
+        self.pack_index.read_state()
+        self.dedup_threshold = dedup_threshold
+        self.chunk_index = ChunkIndex(self.state_path(CHUNK_INDEX_PATH))
+        self.chunk_index.read_state()
+        self.block_cache = block_cache if block_cache is not None else \
+            BlockCache(cache_path=self.state_path(BLOCK_CACHE_PATH))
+        if selective_sync is None and selective_patterns is not None:
+            selective_sync = SelectiveSync(selective_patterns, self.state_path(SELECTIVE_SYNC_PATH))
+        self.selective_sync = selective_sync
+        self.journal = SyncJournal(self.state_path(SYNC_JOURNAL_PATH))
+        self.worker_count = worker_count
+        self.transfer_results = []
 
     def set_file_dir_path(self, file_dir_path_str: str):
         self.dir_path = Path(file_dir_path_str)
 
+    def state_path(self, default_path: Path) -> Path:
+        """
+        :param default_path: Path a state file is kept at by default, e.g. HASH_CACHE_PATH.
+        :return: Path of the state file in this synchronizer's state folder.
+        """
+        return self.state_dir / Path(default_path).name
+
+    def is_excluded(self, file_name: str) -> bool:
+        """
+        :param file_name: str path relative to the sync folder.
+        :return: True if the path matches one of the exclude patterns and is never synced.
+        """
+        return any(fnmatch.fnmatchcase(file_name, pattern) for pattern in self.exclude)
+
+    def is_ignored_file(self, file_path_obj: Path) -> bool:
+        """
+        :param file_path_obj: Path of a local file in the sync folder.
+        :return: True if the file is left out of the sync: partial downloads, files named like pack or chunk objects
+        and files matching an exclude pattern.
+        """
+        if is_excluded_file(file_path_obj):
+            return True
+        if not self.exclude:
+            return False
+        try:
+            return self.is_excluded(file_path_obj.relative_to(self.dir_path).as_posix())
+        except ValueError:
+            return False
+
+    def prioritize(self, file_names):
+        """
+        Transfer files ahead of everything else queued, e.g. because a user is waiting for them. Can be called from
+        any thread, also while a sync operation is running; it affects transfers queued from then on.
+
+        :param file_names: iterable of str paths relative to the sync folder.
+        :return: None
+        """
+        self.transfer_priority.request(file_names)
+
+    def refresh_remote_index(self) -> RemoteIndex:
+        """
+        Rebuild the remote index from a single listing of Google Drive. Called at the start of every sync pass.
+
+        :return: RemoteIndex of the files currently in Google Drive.
+        """
+        self.remote_index = self.drive_api.build_remote_index()
+        return self.remote_index
+
+    def new_transfer_scheduler(self) -> TransferScheduler:
+        """
+        :return: TransferScheduler whose workers each get their own api client sharing this synchronizer's credentials.
+        Transfers are ranked by the transfer priority. With a shared DriveClient they run on its worker threads,
+        ranked together with those of the other synchronizers using it.
+        """
+        queue = self.client.transfer_queue() if self.client is not None else None
+        return TransferScheduler(self.drive_api.new_worker_handler, self.worker_count, self.on_transfer_result,
+                                 queue, self.transfer_priority)
+
+    def queue_transfer(self, scheduler: TransferScheduler, file_name: str, action: str, size: int, *args):
+        """
+        Submit a transfer and announce it with a "transfer_queued" event, so listeners know the total amount of work
+        before progress events arrive.
+
+        :param scheduler: TransferScheduler of the current sync pass.
+        :param file_name: str path of the file relative to the file folder.
+        :param action: str GoogleDriveApiHandler method to run, e.g. "upload_file".
+        :param size: int size of the file in bytes, None if unknown.
+        :return: None
+        """
+        self.metrics.emit("transfer_queued", str(self.dir_path / file_name), 0, size)
+        scheduler.submit(file_name, action, *args, size=size)
+
+    def on_transfer_result(self, result: TransferResult):
+        """
+        Report a finished transfer with a "transfer_finished" event and mark it completed in the journal of the running
+        pass. Called on the worker thread that ran it.
+
+        :param result: TransferResult
+        :return: None
+        """
+        self.metrics.emit("transfer_finished", str(self.dir_path / result.name),
+                          message=None if result.success else str(result.error))
+        if result.success and result.action in JOURNALED_TRANSFERS:
+            self.journal.complete(JOURNALED_TRANSFERS[result.action], result.name)
+
+    def cancel(self):
+        """
+        Stop the running sync operation. It raises SyncCancelled once requests in flight have finished; interrupted
+        uploads and downloads resume where they stopped on the next sync. Can be called from any thread.
+
+        :return: None
+        """
+        self.drive_api.executor.cancel()
+
+    def clear_cancel(self):
+        """
+        Allow sync operations to run again after cancel(). Call it before starting the next operation.
+
+        :return: None
+        """
+        self.drive_api.executor.clear_cancel()
+
+    def check_transfer_results(self, results: list):
+        """
+        Record per-file results of a sync pass and raise if any transfer failed.
+
+        :param results: list of TransferResult.
+        :return: None
+        """
+        self.transfer_results = results
+        if any(isinstance(result.error, SyncCancelled) for result in results):
+            raise SyncCancelled()
+        failed_results = [result for result in results if not result.success]
+        for result in failed_results:
+            self.metrics.emit("transfer_failed", result.name,
+                              message=result.action + ": " + result.name + " (" + str(result.error) + ")")
+        if len(failed_results) > 0:
+            raise TransferError(failed_results)
+
+    def get_remote_index(self) -> RemoteIndex:
+        """
+        Return the remote index, building it first if no sync pass has run yet.
+
+        :return: RemoteIndex of the files in Google Drive.
+        """
+        if self.remote_index is None:
+            self.refresh_remote_index()
+        return self.remote_index
+
+    def walk_local_tree(self) -> LocalTree:
+        """
+        :return: LocalTree of every file and folder in the sync folder, leaving out partial downloads, files named like
+        pack or chunk objects and files matching an exclude pattern.
+        """
+        return walk_local_tree(self.dir_path, ignore=self.is_ignored_file, worker_count=self.worker_count)
+
+    def local_md5(self, file_path_obj: Path) -> str:
+        """
+        :param file_path_obj: Path of a local file.
+        :return: str md5 checksum of the file from the hash cache, timed as the "hash" phase.
+        :raises SyncCancelled: if the sync operation was cancelled, so long hashing passes stop too.
+        """
+        self.drive_api.executor.check_cancelled()
+        start_time = time.perf_counter()
+        try:
+            return self.hash_cache.get_md5(file_path_obj)
+        finally:
+            self.metrics.add_phase_time("hash", time.perf_counter() - start_time)
+
+    def iter_local_md5s(self, file_paths: dict):
+        """
+        Generator of the md5 checksums of local files. Cached checksums come first; the other files are hashed by the
+        hash pool, smallest first, and each is yielded as soon as it is done, so transfers can start while large
+        files are still being hashed. The new checksums are added to the hash cache. Hashing is timed as the "hash"
+        phase.
+
+        :param file_paths: dict of local Path of the files indexed by path relative to the sync folder.
+        :return: generator of (str, Path, str) file name, local Path and md5 checksum, None for files that could not
+        be read.
+        :raises SyncCancelled: if the sync operation was cancelled, so long hashing passes stop too.
+        """
+        check_cancelled = self.drive_api.executor.check_cancelled
+        uncached_files = dict()
+        file_sizes = []
+        for file_name, file_path_obj in file_paths.items():
+            check_cancelled()
+            try:
+                stat = file_path_obj.stat()
+            except OSError:
+                yield file_name, file_path_obj, None
+                continue
+            md5 = self.hash_cache.lookup(file_path_obj, stat)
+            if md5 is not None:
+                yield file_name, file_path_obj, md5
+                continue
+            uncached_files[str(file_path_obj)] = (file_name, file_path_obj)
+            file_sizes.append((str(file_path_obj), stat.st_size))
+        if not file_sizes:
+            return
+
+        hashes = self.hash_pool.iter_hashes(file_sizes, check_cancelled)
+        hash_seconds = 0.0
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    file_path, size, mtime_ns, md5 = next(hashes)
+                except StopIteration:
+                    return
+                finally:
+                    hash_seconds += time.perf_counter() - start_time
+                if md5 is not None:
+                    self.hash_cache.add_entry(file_path, size, mtime_ns, md5)
+                file_name, file_path_obj = uncached_files[file_path]
+                yield file_name, file_path_obj, md5
+        finally:
+            hashes.close()
+            self.metrics.add_phase_time("hash", hash_seconds)
+
+    def queue_upload(self, scheduler: TransferScheduler, remote_index: RemoteIndex, file_name: str,
+                     file_path_obj: Path, size: int, chunked_file_paths: dict):
+        """
+        Upload a changed file: queue it on the scheduler, or set it aside in chunked_file_paths if it is uploaded as
+        chunks.
+
+        :return: None
+        """
+        if self.is_chunkable(size):
+            chunked_file_paths[file_name] = file_path_obj
+            return
+        self.queue_transfer(scheduler, file_name, "upload_file", size, str(file_path_obj), remote_index, file_name)
+
+    def queue_download(self, scheduler: TransferScheduler, file_name: str, remote_file, chunked_file_names: list):
+        """
+        Download a changed file: queue it on the scheduler, or set it aside in chunked_file_names if it is
+        reassembled from chunks, which may be listed after the file.
+
+        :return: None
+        """
+        if remote_file.codec == CHUNKED_CODEC:
+            chunked_file_names.append(file_name)
+            return
+        self.queue_transfer(scheduler, file_name, "download_file", remote_file.size, remote_file.id,
+                            str(self.dir_path / file_name), remote_file.md5, remote_file.codec)
+
+    def is_packable(self, size: int) -> bool:
+        """
+        :param size: int size of a local file in bytes.
+        :return: True if the file is uploaded inside a pack object.
+        """
+        return self.pack_threshold is not None and size <= self.pack_threshold
+
+    def load_pack_index(self, remote_index: RemoteIndex) -> PackIndex:
+        """
+        Return the pack index stored in Google Drive. It is only downloaded if it differs from the local copy.
+
+        :param remote_index: RemoteIndex of the current sync pass.
+        :return: PackIndex that can be changed without affecting self.pack_index. Empty if Google Drive has none.
+        """
+        index_file = remote_index.get_pack_object(PACK_INDEX_NAME)
+        if index_file is None:
+            return PackIndex(self.state_path(PACK_INDEX_PATH))
+        if index_file.md5 == self.pack_index.remote_md5:
+            return self.pack_index.copy()
+        pack_index = PackIndex(self.state_path(PACK_INDEX_PATH))
+        pack_index.load_bytes(self.drive_api.download_range(index_file.id), index_file.md5)
+        return pack_index
+
+    def pack_small_files(self, remote_index: RemoteIndex, add_paths: dict, remove_names=None):
+        """
+        Bring the packed files in Google Drive up to date. New and changed files are written into new packs, then the
+        pack index is replaced with a single request. Packs and files that are no longer needed are only deleted
+        after that, so a reader always finds every pack the index it read refers to. Packs that are mostly dead space,
+        and small packs once there are several, are rewritten from the local copies of their members instead of
+        being downloaded.
+
+        :param remote_index: RemoteIndex of the current sync pass. Updated with the pack objects written.
+        :param add_paths: dict of local Path of the files to keep packed, indexed by path relative to the sync folder.
+        Unchanged files cost no requests. Files also stored as files of their own are deleted once they are packed.
+        :param remove_names: iterable of str file names to remove from the packs. None to remove every packed file
+        that is not in add_paths.
+        :return: (list, list) TransferResult of every pack written, and ids of the pack objects and files to delete.
+        """
+        pack_index = self.load_pack_index(remote_index)
+        if remove_names is None:
+            remove_names = [file_name for file_name in pack_index.names() if file_name not in add_paths]
+        file_ids_to_delete = []
+        pack_paths = dict()
+        packed_md5s = {file_name: md5 for file_name, file_path_obj, md5 in self.iter_local_md5s(
+            {file_name: file_path_obj for file_name, file_path_obj in add_paths.items() if file_name in pack_index})}
+        for file_name, file_path_obj in add_paths.items():
+            remote_file = remote_index.get(file_name)
+            if remote_file is not None:
+                file_ids_to_delete.append(remote_file.id)
+            member = pack_index.get(file_name)
+            if member is None or member.md5 != packed_md5s[file_name]:
+                pack_paths[file_name] = file_path_obj
+        changed = bool(pack_paths)
+        for file_name in list(pack_paths) + list(remove_names):
+            changed = pack_index.remove(file_name) is not None or changed
+
+        live_bytes = pack_index.live_bytes()
+        # A pack is only dead once it has no members left; one holding nothing but empty files has no live bytes.
+        used_pack_names = set(member.pack for file_name, member in pack_index.items())
+        dead_pack_names = [pack_name for pack_name in live_bytes if pack_name not in used_pack_names]
+        rewrite_pack_names = [pack_name for pack_name, size in live_bytes.items()
+                              if pack_name in used_pack_names and size < pack_index.pack_size(pack_name) * REPACK_RATIO]
+        small_pack_names = [pack_name for pack_name, size in live_bytes.items()
+                            if pack_name in used_pack_names and pack_index.pack_size(pack_name) < MIN_PACK_SIZE and
+                            pack_name not in rewrite_pack_names]
+        if len(small_pack_names) + (1 if pack_paths else 0) >= 2:
+            rewrite_pack_names += small_pack_names
+        for pack_name in rewrite_pack_names:
+            members = pack_index.members_of(pack_name)
+            # A member that changed locally without being part of this pass cannot be rewritten from its local copy.
+            if any(not (self.dir_path / file_name).is_file() or self.local_md5(self.dir_path / file_name) != member.md5
+                   for file_name, member in members):
+                continue
+            for file_name, member in members:
+                pack_index.remove(file_name)
+                pack_paths[file_name] = self.dir_path / file_name
+            dead_pack_names.append(pack_name)
+            changed = True
+
+        results = []
+        if pack_paths:
+            file_names = sorted(pack_paths)
+            sizes = {file_name: pack_paths[file_name].stat().st_size for file_name in file_names}
+            with self.new_transfer_scheduler() as scheduler:
+                for group in plan_packs([(file_name, sizes[file_name]) for file_name in file_names]):
+                    for file_name in group:
+                        self.metrics.emit("transfer_queued", str(pack_paths[file_name]), 0, sizes[file_name])
+                    pack_name = new_pack_name()
+                    scheduler.submit(pack_name, "upload_pack", pack_name,
+                                     [(file_name, str(pack_paths[file_name])) for file_name in group],
+                                     pack_index, remote_index)
+                results = scheduler.wait()
+            self.check_transfer_results(results)
+
+        for pack_name in dead_pack_names:
+            pack_index.remove_pack(pack_name)
+        live_pack_names = set(pack_index.pack_names())
+        # Also collects packs written by a pass that failed before it could store its index.
+        file_ids_to_delete += [pack_file.id for pack_name, pack_file in remote_index.pack_object_items()
+                               if pack_name != PACK_INDEX_NAME and pack_name not in live_pack_names]
+        index_file = remote_index.get_pack_object(PACK_INDEX_NAME)
+        if changed or dead_pack_names:
+            if len(pack_index) == 0:
+                if index_file is not None:
+                    file_ids_to_delete.append(index_file.id)
+                pack_index.remote_md5 = None
+            else:
+                index_info = self.drive_api.upload_bytes(PACK_INDEX_NAME, pack_index.to_bytes(),
+                                                         index_file.id if index_file is not None else None,
+                                                         remote_index)
+                pack_index.remote_md5 = index_info.get("md5Checksum", None)
+        self.pack_index = pack_index
+        self.pack_index.save()
+        return results, file_ids_to_delete
+
+    def unpack_small_files(self, remote_index: RemoteIndex, full: bool):
+        """
+        Bring the packed files in the sync folder up to date with the pack index in Google Drive. A file stored on its
+        own in Google Drive takes precedence over a packed file of the same name.
+
+        :param remote_index: RemoteIndex of the current sync pass.
+        :param full: bool True to check every packed file against its local copy. False to only extract files whose
+        pack entry changed since the last download and to delete local files that were removed from the packs.
+        :return: None
+        """
+        old_pack_index = self.pack_index
+        pack_index = self.load_pack_index(remote_index)
+        members_by_pack = dict()
+        for file_name, member in pack_index.items():
+            if file_name in remote_index or (not full and old_pack_index.get(file_name) == member and
+                                             not self.needs_local_copy(file_name)):
+                continue
+            if not self.is_wanted(file_name):
+                continue
+            file_path_obj = self.dir_path / file_name
+            if file_path_obj.is_file() and self.local_md5(file_path_obj) == member.md5:
+                continue
+            members_by_pack.setdefault(member.pack, []).append((file_name, member))
+
+        results = self.extract_packed_files(remote_index, members_by_pack)
+        if not full:
+            for file_name in old_pack_index.names():
+                if file_name not in pack_index and file_name not in remote_index and \
+                        not self.is_excluded(file_name) and (self.dir_path / file_name).is_file():
+                    self.delete_file_computer(file_name)
+        self.check_transfer_results(results)
+        self.pack_index = pack_index
+        self.pack_index.save()
+
+    def extract_packed_files(self, remote_index: RemoteIndex, members_by_pack: dict) -> list:
+        """
+        Extract packed files into the sync folder, the members of each pack with a single range request and several
+        packs at a time.
+
+        :param remote_index: RemoteIndex of the current sync pass.
+        :param members_by_pack: dict of lists of (str, PackMember) file names and pack entries, indexed by pack name.
+        :return: list of TransferResult, one per pack.
+        """
+        results = []
+        with self.new_transfer_scheduler() as scheduler:
+            for pack_name, members in members_by_pack.items():
+                pack_file = remote_index.get_pack_object(pack_name)
+                if pack_file is None:
+                    results.append(TransferResult(name=pack_name, action="download_pack_members", success=False,
+                                                  error=FileNotFoundError("Pack " + pack_name + " is missing")))
+                    continue
+                for file_name, member in members:
+                    self.metrics.emit("transfer_queued", str(self.dir_path / file_name), 0, member.length)
+                scheduler.submit(pack_name, "download_pack_members", pack_file.id,
+                                 [(str(self.dir_path / file_name), member) for file_name, member in members],
+                                 size=sum(member.length for file_name, member in members))
+            results += scheduler.wait()
+
+        for result in results:
+            if result.success:
+                for file_name, member in members_by_pack[result.name]:
+                    self.hash_cache.set_md5(self.dir_path / file_name, member.md5)
+                self.hold_files(file_name for file_name, member in members_by_pack[result.name])
+        return results
+
+    def is_chunkable(self, size: int) -> bool:
+        """
+        :param size: int size of a local file in bytes.
+        :return: True if the file is uploaded as content defined chunks.
+        """
+        return self.dedup_threshold is not None and size >= self.dedup_threshold
+
+    def chunk_local_file(self, file_path_obj: Path) -> list:
+        """
+        :param file_path_obj: Path of a local file.
+        :return: list of ChunkRef of the file from the chunk index, timed as the "hash" phase. The file is only split
+        again if it changed since it was last chunked.
+        """
+        self.drive_api.executor.check_cancelled()
+        start_time = time.perf_counter()
+        try:
+            chunks = self.chunk_index.get_file_chunks(file_path_obj)
+            if chunks is None:
+                stat = file_path_obj.stat()
+                chunks = chunk_file(file_path_obj)
+                self.chunk_index.record_file(file_path_obj, chunks, stat)
+            return chunks
+        finally:
+            self.metrics.add_phase_time("hash", time.perf_counter() - start_time)
+
+    def load_manifest(self, remote_file) -> list:
+        """
+        :param remote_file: RemoteFile of a chunked file.
+        :return: list of ChunkRef of the file, downloaded only if it is not in the chunk index.
+        """
+        return self.drive_api.download_manifest(remote_file, self.chunk_index)
+
+    def upload_chunked_files(self, remote_index: RemoteIndex, file_paths: dict) -> list:
+        """
+        Upload files as content defined chunks. Every file is split into chunks identified by their sha256 digest, the
+        chunks Google Drive does not have yet are uploaded, several at a time and each only once however many files
+        contain it, and then each file's manifest replaces its content in Google Drive. Chunks no longer referenced
+        are deleted by upload().
+
+        :param remote_index: RemoteIndex of the current sync pass. Updated with the chunks and manifests written.
+        :param file_paths: dict of local Path of the files to upload, indexed by path relative to the sync folder.
+        :return: list of TransferResult of every chunk and manifest written.
+        """
+        chunks_by_name = dict()
+        missing_chunks = dict()
+        for file_name, file_path_obj in file_paths.items():
+            chunks = self.chunk_local_file(file_path_obj)
+            chunks_by_name[file_name] = chunks
+            self.metrics.emit("transfer_queued", str(file_path_obj), 0, sum(chunk.length for chunk in chunks))
+            for chunk in chunks:
+                if chunk.digest not in missing_chunks and \
+                        remote_index.get_chunk_object(chunk_object_name(chunk.digest)) is None:
+                    missing_chunks[chunk.digest] = (str(file_path_obj), chunk)
+        self.chunk_index.save()
+
+        results = []
+        if missing_chunks:
+            with self.new_transfer_scheduler() as scheduler:
+                for digest, (file_path, chunk) in missing_chunks.items():
+                    scheduler.submit(chunk_object_name(digest), "upload_chunk", file_path, chunk, remote_index)
+                results = scheduler.wait()
+            self.check_transfer_results(results)
+
+        with self.new_transfer_scheduler() as scheduler:
+            for file_name, chunks in chunks_by_name.items():
+                file_path_obj = file_paths[file_name]
+                scheduler.submit(file_name, "upload_manifest", str(file_path_obj), file_name, chunks,
+                                 self.local_md5(file_path_obj), remote_index, self.chunk_index)
+            results += scheduler.wait()
+        self.chunk_index.save()
+        return results
+
+    def unreferenced_chunk_ids(self, remote_index: RemoteIndex, kept_file_names) -> list:
+        """
+        :param remote_index: RemoteIndex of the current sync pass.
+        :param kept_file_names: container of str names of the files that stay in Google Drive.
+        :return: list of str ids of the chunk objects no manifest of a kept file refers to. Costs one request per
+        manifest that is not in the chunk index and none at all if Google Drive has no chunks.
+        """
+        chunk_objects = remote_index.chunk_object_items()
+        if not chunk_objects:
+            return []
+        referenced_names = set()
+        for file_name, remote_file in remote_index.items():
+            if remote_file.codec == CHUNKED_CODEC and file_name in kept_file_names:
+                referenced_names.update(chunk_object_name(chunk.digest) for chunk in self.load_manifest(remote_file))
+        return [chunk_file_info.id for name, chunk_file_info in chunk_objects if name not in referenced_names]
+
+    def retain_chunk_manifests(self, remote_index: RemoteIndex):
+        """
+        Drop the cached manifests of chunked files that were replaced or deleted in Google Drive.
+
+        :param remote_index: RemoteIndex of the current sync pass.
+        :return: None
+        """
+        self.chunk_index.retain_manifests(manifest_key(remote_file) for file_name, remote_file in remote_index.items()
+                                          if remote_file.codec == CHUNKED_CODEC)
+
+    def download_chunked_files(self, remote_index: RemoteIndex, file_names: list) -> list:
+        """
+        Download chunked files, several at a time. Their manifests are read first, and a file sharing chunks with
+        another file of the same round waits for a later round, so each chunk is downloaded once and then copied from
+        the local file that got it.
+
+        :param remote_index: RemoteIndex of the current sync pass, including the chunk objects.
+        :param file_names: list of str names of chunked files.
+        :return: list of TransferResult, one per file and per manifest that could not be read.
+        """
+        remote_files = {file_name: remote_index.get(file_name) for file_name in file_names}
+        with self.new_transfer_scheduler() as scheduler:
+            for file_name, remote_file in remote_files.items():
+                if self.chunk_index.get_manifest(manifest_key(remote_file)) is None:
+                    scheduler.submit(file_name, "download_manifest", remote_file, self.chunk_index)
+            results = [result for result in scheduler.wait() if not result.success]
+
+        failed_file_names = set(result.name for result in results)
+        pending_file_names = [file_name for file_name in file_names if file_name not in failed_file_names]
+        while pending_file_names:
+            round_file_names = []
+            deferred_file_names = []
+            claimed_digests = set()
+            for file_name in pending_file_names:
+                digests = set(chunk.digest for chunk in
+                              self.chunk_index.get_manifest(manifest_key(remote_files[file_name])))
+                if digests & claimed_digests:
+                    deferred_file_names.append(file_name)
+                else:
+                    round_file_names.append(file_name)
+                    claimed_digests |= digests
+            with self.new_transfer_scheduler() as scheduler:
+                for file_name in round_file_names:
+                    remote_file = remote_files[file_name]
+                    self.queue_transfer(scheduler, file_name, "download_chunked_file", remote_file.size,
+                                        remote_file, str(self.dir_path / file_name), remote_index, self.chunk_index)
+                results += scheduler.wait()
+            pending_file_names = deferred_file_names
+        return results
+
+    def is_wanted(self, file_name: str) -> bool:
+        """
+        :param file_name: str path relative to the sync folder of a file in Google Drive.
+        :return: True if download brings the file into the sync folder: never if it matches an exclude pattern,
+        always without selective sync, otherwise if selective sync wants it or it has a local copy that is kept up to
+        date.
+        """
+        if self.is_excluded(file_name):
+            return False
+        return self.selective_sync is None or self.selective_sync.wants(file_name) or \
+            (self.dir_path / file_name).is_file()
+
+    def needs_local_copy(self, file_name: str) -> bool:
+        """
+        :param file_name: str path relative to the sync folder of a file in Google Drive.
+        :return: True if selective sync wants a file that never had a local copy, e.g. because it was just opened with
+        open_remote, so it is downloaded even though it did not change in Google Drive.
+        """
+        selective_sync = self.selective_sync
+        return selective_sync is not None and not self.is_excluded(file_name) and \
+            not selective_sync.is_held(file_name) and \
+            selective_sync.wants(file_name) and not (self.dir_path / file_name).is_file()
+
+    def unheld_file_names(self, remote_index: RemoteIndex, local_file_names) -> set:
+        """
+        :param remote_index: RemoteIndex of the current sync pass.
+        :param local_file_names: container of str names of the files in the sync folder.
+        :return: set of str names of the files in Google Drive that selective sync never brought into the sync folder,
+        and of those matching an exclude pattern. They have no local copy but are not deleted by upload.
+        """
+        if self.selective_sync is None and not self.exclude:
+            return set()
+        file_names = set(remote_index.names()) | set(self.load_pack_index(remote_index).names())
+        return set(file_name for file_name in file_names
+                   if self.is_excluded(file_name) or (self.selective_sync is not None and
+                                                      file_name not in local_file_names and
+                                                      not self.selective_sync.is_held(file_name)))
+
+    def hold_files(self, file_names):
+        """
+        Remember that files got a local copy, so deleting it later deletes them in Google Drive too.
+
+        :param file_names: iterable of str paths relative to the sync folder.
+        :return: None
+        """
+        if self.selective_sync is not None:
+            self.selective_sync.hold(file_names)
+
+    def release_deleted_files(self, remote_index: RemoteIndex):
+        """
+        Forget the local copies of files that are gone from Google Drive and store the selective sync state.
+
+        :param remote_index: RemoteIndex of the current sync pass, with the packed files in self.pack_index.
+        :return: None
+        """
+        if self.selective_sync is None:
+            return
+        self.selective_sync.release([file_name for file_name in self.selective_sync.held_names()
+                                     if file_name not in remote_index and file_name not in self.pack_index])
+        self.selective_sync.save()
+
     def upload(self):
         """
-        Upload a single folder with files. Cannot be larger than remaining Google Drive space. Cannot go through
-        more folders. Deletes all files in Google Drive that don't have file names in file folder.
+        Upload the sync folder including every folder below it. Cannot be larger than remaining Google Drive space.
+        Missing folders are created in Google Drive and only files that are new or whose content differs from Google
+        Drive's md5 checksum are uploaded, several at a time. Deletes all files and folders in Google Drive that
+        don't exist in the sync folder once every upload succeeded. With selective sync, files that never had a local
+        copy and the folders holding them are kept.
+
+        The deletions are journaled before the first one is sent. If an upload is interrupted while deleting, the next
+        one first finishes the deletions that did not complete, checking each path against the sync folder again, and
+        then uploads the sync folder as usual.
+
+        :return: None
+        """
+        metrics = self.metrics
+        with metrics.phase("upload"):
+            resumed = self.journal.resume("upload", self.dir_path)
+            if resumed is not None:
+                self.resume_upload(resumed[1])
+            with metrics.phase("upload.scan"):
+                local_tree = self.walk_local_tree()
+            with metrics.phase("upload.list"):
+                remote_index = self.refresh_remote_index()
+            with metrics.phase("upload.folders"):
+                self.check_transfer_results(self.drive_api.ensure_folders(local_tree.folder_paths))
+
+            small_file_paths = dict()
+            chunked_file_paths = dict()
+            with metrics.phase("upload.transfer"), self.new_transfer_scheduler() as scheduler:
+                try:
+                    sizes = dict()
+                    compared_paths = dict()
+                    for file_name, file_path_obj in local_tree.file_paths.items():
+                        size = file_path_obj.stat().st_size
+                        if self.is_packable(size):
+                            small_file_paths[file_name] = file_path_obj
+                            continue
+                        sizes[file_name] = size
+                        if file_name in remote_index:
+                            compared_paths[file_name] = file_path_obj
+                            continue
+                        self.queue_upload(scheduler, remote_index, file_name, file_path_obj, size, chunked_file_paths)
+                    for file_name, file_path_obj, md5 in self.iter_local_md5s(compared_paths):
+                        if md5 is not None and md5 != remote_index.get(file_name).md5:
+                            self.queue_upload(scheduler, remote_index, file_name, file_path_obj, sizes[file_name],
+                                              chunked_file_paths)
+                finally:
+                    self.hash_cache.save()
+                upload_results = scheduler.wait()
+                self.check_transfer_results(upload_results)
+
+            with metrics.phase("upload.chunks"):
+                try:
+                    chunk_results = self.upload_chunked_files(remote_index, chunked_file_paths)
+                finally:
+                    self.hash_cache.save()
+
+            unheld_names = self.unheld_file_names(remote_index, local_tree.file_paths)
+            with metrics.phase("upload.pack"):
+                remove_names = None
+                if unheld_names:
+                    remove_names = [file_name for file_name in self.load_pack_index(remote_index).names()
+                                    if file_name not in small_file_paths and file_name not in unheld_names]
+                try:
+                    pack_results, packed_ids_to_delete = self.pack_small_files(remote_index, small_file_paths,
+                                                                               remove_names)
+                finally:
+                    self.hash_cache.save()
+
+            with metrics.phase("upload.delete"):
+                # Deleting a folder in Google Drive deletes everything in it, so only the topmost missing folders are
+                # deleted, and none that hold files selective sync left in Google Drive only.
+                folder_cache = self.drive_api.folder_cache
+                unheld_folder_paths = set()
+                for file_name in unheld_names:
+                    folder_path = parent_path(file_name)
+                    while folder_path != "" and folder_path not in unheld_folder_paths:
+                        unheld_folder_paths.add(folder_path)
+                        folder_path = parent_path(folder_path)
+                missing_folder_paths = set(folder_path for folder_path in folder_cache.folder_paths()
+                                           if folder_path not in local_tree.folder_paths and
+                                           folder_path not in unheld_folder_paths)
+                top_missing_folder_paths = [folder_path for folder_path in missing_folder_paths
+                                            if parent_path(folder_path) not in missing_folder_paths]
+                deleted_names = {remote_file.id: file_name for file_name, remote_file in remote_index.items()
+                                 if file_name not in local_tree.file_paths and file_name not in unheld_names and
+                                 parent_path(file_name) not in missing_folder_paths}
+                deleted_names.update((folder_cache.get_id(folder_path), folder_path)
+                                     for folder_path in top_missing_folder_paths)
+                kept_file_names = set(local_tree.file_paths) | unheld_names
+                file_ids_to_delete = list(deleted_names) + packed_ids_to_delete
+                file_ids_to_delete += self.unreferenced_chunk_ids(remote_index, kept_file_names)
+                if deleted_names:
+                    self.journal.begin("upload", self.dir_path,
+                                       [("delete", file_name, file_id) for file_id, file_name in deleted_names.items()])
+                try:
+                    delete_results = self.drive_api.delete_files(file_ids_to_delete, remote_index)
+                    for result in delete_results:
+                        if result.success and result.name in deleted_names:
+                            self.journal.complete("delete", deleted_names[result.name])
+                    for folder_path in top_missing_folder_paths:
+                        folder_cache.remove(folder_path)
+                    folder_cache.save()
+                    self.retain_chunk_manifests(remote_index)
+                    self.chunk_index.save()
+                    self.check_transfer_results(upload_results + chunk_results + pack_results + delete_results)
+                    self.journal.finish()
+                finally:
+                    self.journal.suspend()
+            if self.selective_sync is not None:
+                self.selective_sync.set_held(local_tree.file_paths)
+                self.selective_sync.save()
+
+    def resume_upload(self, operations: list):
+        """
+        Finish the deletions of an interrupted upload. Each path is checked against the sync folder again, so a file
+        that came back in the meantime is uploaded rather than deleted.
+
+        :param operations: list of (str, str, str) journaled operations that did not complete.
+        :return: None
+        """
+        self.metrics.emit("upload_resumed", str(self.dir_path),
+                          message="Resuming interrupted upload, %d deletion(s) left." % len(operations))
+        try:
+            with self.metrics.phase("upload.list"):
+                self.refresh_remote_index()
+            with self.metrics.phase("upload.delete"):
+                self._upload_changes(file_name for action, file_name, file_id in operations)
+            self.journal.finish()
+        finally:
+            self.journal.suspend()
+
+    def download(self, full: bool = False):
+        """
+        Bring the files folder up to date with Google Drive. After the first run only the changes Google Drive reports
+        since the previous download are applied. Falls back to a full download if there is no valid changes cursor for
+        this files folder.
 
+        :param full: bool True to force a full download.
         :return: None
         """
+        with self.metrics.phase("download"):
+            if not full and self.remote_state.can_update(self.dir_path) and self.drive_api.folder_cache.has_root_id():
+                try:
+                    self.download_changes()
+                    return
+                except HttpError as error:
+                    if error.resp.status not in INVALID_CURSOR_STATUSES:
+                        raise
+                    self.metrics.emit("full_download", message="Changes cursor is no longer valid, downloading "
+                                                               "everything.")
+            self.download_full()
 
-        paths_of_files = [str(file_path_obj) for file_path_obj in self.dir_path.iterdir()]
-        names_of_files = [file_path_obj.name for file_path_obj in self.dir_path.iterdir()]
+    def download_changes(self):
+        """
+        Fetch the Drive changes since the last download and apply just those creates, updates, moves and deletes to
+        the files folder. Files that did not change in Google Drive are not touched, so local files that were never
+        uploaded are left alone.
+
+        :return: None
+        """
+        remote_state = self.remote_state
+        folder_cache = self.drive_api.folder_cache
+        root_id = folder_cache.get_id("")
+        with self.metrics.phase("download.changes"):
+            old_index, old_folder_ids = remote_state.build_indexes(root_id)
+            changes, new_start_page_token = self.drive_api.list_changes(remote_state.start_page_token)
+            for change in changes:
+                remote_state.apply_change(change)
+            remote_index, folder_ids = remote_state.build_indexes(root_id)
+            folder_cache.replace_all(folder_ids)
+            folder_cache.save()
 
-        for file_path in paths_of_files:
-            self.drive_api.upload_file(file_path)
+        try:
+            with self.metrics.phase("download.delete"):
+                removed_folder_paths = set(folder_path for folder_path in old_folder_ids
+                                           if folder_path not in folder_ids)
+                for folder_path in removed_folder_paths:
+                    if parent_path(folder_path) not in removed_folder_paths and (self.dir_path / folder_path).is_dir():
+                        self.delete_folder_computer(folder_path)
+                for folder_path in folder_ids:
+                    (self.dir_path / folder_path).mkdir(parents=True, exist_ok=True)
+                for file_name in old_index.names():
+                    if file_name not in remote_index and not self.is_excluded(file_name) and \
+                            (self.dir_path / file_name).is_file():
+                        self.delete_file_computer(file_name)
 
-        files_dict = self.drive_api.get_info_on_files()
+            chunked_file_names = []
+            compared_paths = dict()
+            with self.metrics.phase("download.transfer"), self.new_transfer_scheduler() as scheduler:
+                for file_name, remote_file in remote_index.items():
+                    if old_index.get(file_name) == remote_file and not self.needs_local_copy(file_name):
+                        continue
+                    if not self.is_wanted(file_name):
+                        continue
+                    file_path_obj = self.dir_path / file_name
+                    if remote_file.md5 is not None and file_path_obj.is_file():
+                        compared_paths[file_name] = file_path_obj
+                        continue
+                    self.queue_download(scheduler, file_name, remote_file, chunked_file_names)
+                for file_name, file_path_obj, md5 in self.iter_local_md5s(compared_paths):
+                    if md5 != remote_index.get(file_name).md5:
+                        self.queue_download(scheduler, file_name, remote_index.get(file_name), chunked_file_names)
+                results = scheduler.wait()
 
-        for file_id, file_info in files_dict.items():
-            if file_info["name"] not in names_of_files:
-                self.drive_api.delete_file(file_id)
+            with self.metrics.phase("download.chunks"):
+                results += self.download_chunked_files(remote_index, chunked_file_names)
 
-    def download(self):
+            for result in results:
+                remote_file = remote_index.get(result.name)
+                if result.success and remote_file.md5 is not None:
+                    self.hash_cache.set_md5(self.dir_path / result.name, remote_file.md5)
+            self.hold_files(result.name for result in results if result.success)
+            self.retain_chunk_manifests(remote_index)
+            self.remote_index = remote_index
+            self.check_transfer_results(results)
+
+            with self.metrics.phase("download.packs"):
+                self.unpack_small_files(remote_index, full=False)
+            self.release_deleted_files(remote_index)
+
+            remote_state.start_page_token = new_start_page_token
+            remote_state.save()
+        except BaseException:
+            # Forget the changes applied in memory, the next download fetches them again from the saved cursor.
+            remote_state.read_state()
+            raise
+        finally:
+            self.hash_cache.save()
+            self.chunk_index.save()
+
+    def download_full(self):
         """
-        Download files from Google Drive into files folder. Delete all files not found in Google Drive folder.
+        Download files from Google Drive into files folder, recreating Google Drive's folders. Only files that are
+        missing locally or whose content differs from Google Drive's md5 checksum are downloaded, several at a time.
+        Delete all files and folders not found in Google Drive folder once every download succeeded. Records a changes
+        cursor and a mirror of Google Drive's metadata so later downloads only need to fetch changes.
 
         :return: None
         """
-        names_of_files_local = [file_path_obj.name for file_path_obj in self.dir_path.iterdir()]
+        metrics = self.metrics
+        remote_state = self.remote_state
+        remote_state.reset(None, None)
+        with metrics.phase("download.scan"):
+            local_tree = self.walk_local_tree()
+        with metrics.phase("download.list"):
+            start_page_token = self.drive_api.get_start_page_token()
+            folder_cache = self.drive_api.refresh_folder_cache()
+        remote_folder_paths = set(folder_cache.folder_paths())
+        for folder_path in remote_folder_paths:
+            (self.dir_path / folder_path).mkdir(parents=True, exist_ok=True)
+            remote_state.apply_folder(folder_cache.get_id(folder_path), base_name(folder_path),
+                                      folder_cache.get_id(parent_path(folder_path)))
+
+        remote_index = RemoteIndex()
+        chunked_file_names = []
+        compared_paths = dict()
+
+        try:
+            # The file listing is consumed page by page while the first downloads already run, so it is timed as part
+            # of the transfer phase.
+            with metrics.phase("download.transfer"), self.new_transfer_scheduler() as scheduler:
+                for file_info in self.drive_api.iter_files():
+                    file_name = folder_cache.resolve_path(file_info)
+                    if file_name is None:
+                        # Outside the sync folder's folder, e.g. in the folder of another sync root.
+                        continue
+                    remote_state.apply_file_info(file_info)
+                    if file_name in remote_index:
+                        continue
+                    remote_index.add_file_info(file_info, file_name)
+                    remote_file = remote_index.get(file_name)
+                    if remote_file is None:
+                        # Pack objects are indexed separately and extracted below.
+                        continue
+                    if not self.is_wanted(file_name):
+                        continue
+                    file_path_obj = self.dir_path / file_name
+                    if remote_file.md5 is not None and file_path_obj.is_file():
+                        # Local copies are compared once the listing is complete, hashed in parallel.
+                        compared_paths[file_name] = file_path_obj
+                        continue
+                    self.queue_download(scheduler, file_name, remote_file, chunked_file_names)
+                for file_name, file_path_obj, md5 in self.iter_local_md5s(compared_paths):
+                    if md5 != remote_index.get(file_name).md5:
+                        self.queue_download(scheduler, file_name, remote_index.get(file_name), chunked_file_names)
+                self.remote_index = remote_index
+                results = scheduler.wait()
+
+            with metrics.phase("download.chunks"):
+                results += self.download_chunked_files(remote_index, chunked_file_names)
 
-        files_dict = self.drive_api.get_info_on_files()
+            for result in results:
+                remote_file = remote_index.get(result.name)
+                if result.success and remote_file.md5 is not None:
+                    self.hash_cache.set_md5(self.dir_path / result.name, remote_file.md5)
+            self.hold_files(result.name for result in results if result.success)
+            self.retain_chunk_manifests(remote_index)
+            self.check_transfer_results(results)
 
-        names_of_files_drive = []
-        for file_id, file_info in files_dict.items():
-            names_of_files_drive.append(file_info["name"])
-            file_path = str(self.dir_path / file_info["name"])
-            self.drive_api.download_file(file_id, file_path)
+            with metrics.phase("download.packs"):
+                self.unpack_small_files(remote_index, full=True)
 
-        for file_name_local in names_of_files_local:
-            if file_name_local not in names_of_files_drive:
-                self.delete_file_computer(file_name_local)
+            with metrics.phase("download.delete"):
+                missing_folder_paths = set(folder_path for folder_path in local_tree.folder_paths
+                                           if folder_path not in remote_folder_paths)
+                for folder_path in missing_folder_paths:
+                    if parent_path(folder_path) not in missing_folder_paths:
+                        self.delete_folder_computer(folder_path)
+                for file_name_local in local_tree.file_paths:
+                    if file_name_local not in remote_index and file_name_local not in self.pack_index and \
+                            parent_path(file_name_local) not in missing_folder_paths:
+                        self.delete_file_computer(file_name_local)
+            self.release_deleted_files(remote_index)
+
+            remote_state.dir_path = str(self.dir_path)
+            remote_state.start_page_token = start_page_token
+            remote_state.save()
+        finally:
+            self.hash_cache.save()
+            self.chunk_index.save()
+
+    def sync(self, dry_run: bool = False) -> SyncPlan:
+        """
+        Two-way sync of the sync folder and Google Drive. Both sides are compared against the snapshot of the last
+        sync, so changes made on either side are applied to the other, deletions included, and files changed on both
+        sides are kept in both versions. The plan is reported with a "sync_plan" event before anything is changed.
+        The first sync of a folder has no snapshot; it merges both sides without deleting anything.
+
+        The plan is journaled before it is carried out. If a sync is interrupted, the next one finishes the operations
+        of its plan that did not complete instead of making a new plan.
+
+        :param dry_run: bool True to only work out and report the plan.
+        :return: SyncPlan that was carried out, or would have been with dry_run.
+        """
+        metrics = self.metrics
+        snapshot = SyncSnapshot(self.state_path(SYNC_SNAPSHOT_PATH))
+        if not snapshot.belongs_to(self.dir_path):
+            snapshot.reset(self.dir_path)
+        with metrics.phase("sync"):
+            try:
+                resumed = self.journal.resume("sync", self.dir_path)
+                if resumed is not None:
+                    plan = SyncPlan.from_journal(*resumed)
+                    metrics.emit("sync_plan", str(self.dir_path),
+                                 message="Resuming interrupted sync.\n" + plan.describe())
+                    if dry_run:
+                        return plan
+                    with metrics.phase("sync.list"):
+                        remote_index = self.refresh_remote_index()
+                        pack_index = self.load_pack_index(remote_index)
+                else:
+                    plan, remote_index, pack_index = self.make_sync_plan(snapshot)
+                    metrics.emit("sync_plan", str(self.dir_path), message=plan.describe())
+                    if dry_run:
+                        return plan
+                    if not plan.is_empty():
+                        self.journal.begin("sync", self.dir_path, *plan.to_journal())
+
+                with metrics.phase("sync.local"):
+                    self.apply_plan_locally(plan, remote_index, pack_index)
+                with metrics.phase("sync.remote"):
+                    self.apply_plan_remotely(plan)
+                snapshot.files = plan.snapshot_files
+                snapshot.folders = plan.snapshot_folders
+                snapshot.save()
+                self.journal.finish()
+            finally:
+                self.journal.suspend()
+        return plan
+
+    def make_sync_plan(self, snapshot: SyncSnapshot) -> tuple:
+        """
+        Scan both sides and merge them against the snapshot.
+
+        :param snapshot: SyncSnapshot of the last sync of the sync folder.
+        :return: (SyncPlan, RemoteIndex, PackIndex) plan and the remote index and pack index it was made from.
+        """
+        metrics = self.metrics
+        with metrics.phase("sync.scan"):
+            local_tree = self.walk_local_tree()
+            local_files = dict()
+            skipped_names = set()
+            try:
+                for file_name, file_path_obj, md5 in self.iter_local_md5s(local_tree.file_paths):
+                    if md5 is None:
+                        skipped_names.add(file_name)
+                    else:
+                        local_files[file_name] = md5
+            finally:
+                self.hash_cache.save()
+        with metrics.phase("sync.list"):
+            remote_index = self.refresh_remote_index()
+            pack_index = self.load_pack_index(remote_index)
+        remote_files = {file_name: member.md5 for file_name, member in pack_index.items()}
+        remote_files.update((file_name, remote_file.md5) for file_name, remote_file in remote_index.items())
+        if self.selective_sync is not None or self.exclude:
+            skipped_names.update(file_name for file_name in self.unheld_file_names(remote_index, local_files)
+                                 if not self.is_wanted(file_name))
+        plan = plan_sync(local_files, set(local_tree.folder_paths), remote_files,
+                         set(self.drive_api.folder_cache.folder_paths()), snapshot, time.strftime("%Y-%m-%d %H%M%S"),
+                         skipped_names)
+        return plan, remote_index, pack_index
+
+    def apply_plan_locally(self, plan: SyncPlan, remote_index: RemoteIndex, pack_index: PackIndex):
+        """
+        Carry out the local half of a sync plan: move the local versions of conflicting files aside, create folders,
+        download files and delete what was deleted in Google Drive. Runs before anything is changed in Google Drive,
+        so every pack and chunk the plan refers to still exists. Every operation is safe to repeat after a crash.
+
+        :param plan: SyncPlan
+        :param remote_index: RemoteIndex the plan was made from.
+        :param pack_index: PackIndex the plan was made from.
+        :return: None
+        """
+        journal = self.journal
+        for file_name, copy_name in plan.conflicts:
+            file_path_obj = self.dir_path / file_name
+            copy_path_obj = self.dir_path / copy_name
+            # If the copy exists the file was moved aside before an interruption and may hold the download by now.
+            if file_path_obj.is_file() and not copy_path_obj.exists():
+                md5 = self.local_md5(file_path_obj)
+                os.replace(str(file_path_obj), str(copy_path_obj))
+                self.hash_cache.remove(file_path_obj)
+                self.hash_cache.set_md5(copy_path_obj, md5)
+            journal.complete("rename", file_name)
+        for folder_path in plan.local_folder_creates:
+            (self.dir_path / folder_path).mkdir(parents=True, exist_ok=True)
+            journal.complete("create_local_folder", folder_path)
+
+        chunked_file_names = []
+        members_by_pack = dict()
+        try:
+            with self.new_transfer_scheduler() as scheduler:
+                for file_name in plan.downloads:
+                    (self.dir_path / file_name).parent.mkdir(parents=True, exist_ok=True)
+                    remote_file = remote_index.get(file_name)
+                    member = pack_index.get(file_name)
+                    if remote_file is not None:
+                        self.queue_download(scheduler, file_name, remote_file, chunked_file_names)
+                    elif member is not None:
+                        members_by_pack.setdefault(member.pack, []).append((file_name, member))
+                    else:
+                        # Deleted in Google Drive since the plan was made; the next sync deals with it.
+                        journal.complete("download", file_name)
+                results = scheduler.wait()
+            results += self.download_chunked_files(remote_index, chunked_file_names)
+            for result in results:
+                remote_file = remote_index.get(result.name)
+                if result.success and remote_file.md5 is not None:
+                    self.hash_cache.set_md5(self.dir_path / result.name, remote_file.md5)
+            self.hold_files(result.name for result in results if result.success)
+            pack_results = self.extract_packed_files(remote_index, members_by_pack)
+            for result in pack_results:
+                if result.success:
+                    for file_name, member in members_by_pack[result.name]:
+                        journal.complete("download", file_name)
+            results += pack_results
+        finally:
+            self.hash_cache.save()
+            self.chunk_index.save()
+        self.check_transfer_results(results)
+
+        for file_name in plan.local_deletes:
+            if (self.dir_path / file_name).is_file():
+                self.delete_file_computer(file_name)
+            journal.complete("delete_local", file_name)
+        for folder_path in plan.local_folder_deletes:
+            if (self.dir_path / folder_path).is_dir():
+                self.delete_folder_computer(folder_path)
+            journal.complete("delete_local_folder", folder_path)
+        self.hash_cache.save()
+        self.pack_index = pack_index
+        self.pack_index.save()
+        if self.selective_sync is not None:
+            self.selective_sync.release(plan.local_deletes)
+            for folder_path in plan.local_folder_deletes:
+                self.selective_sync.release_folder(folder_path)
+            self.selective_sync.save()
+
+    def apply_plan_remotely(self, plan: SyncPlan):
+        """
+        Carry out the Google Drive half of a sync plan: create folders, upload files and delete what was deleted
+        locally. Uploads compare with Google Drive's md5 checksum first, so repeating them after a crash is free.
+
+        :param plan: SyncPlan
+        :return: None
+        """
+        journal = self.journal
+        self.check_transfer_results(self.drive_api.ensure_folders(plan.remote_folder_creates))
+        for folder_path in plan.remote_folder_creates:
+            journal.complete("create_remote_folder", folder_path)
+        self._upload_changes(plan.uploads + plan.remote_deletes + plan.remote_folder_deletes)
+        for action, names in (("upload", plan.uploads), ("delete_remote", plan.remote_deletes),
+                              ("delete_remote_folder", plan.remote_folder_deletes)):
+            for name in names:
+                journal.complete(action, name)
+
+    def upload_changes(self, file_names):
+        """
+        Push only the given local paths to Google Drive, e.g. the paths reported by a file system watcher. Files that
+        exist are uploaded if their content differs from Google Drive, new folders are uploaded with everything in
+        them, and paths that no longer exist locally are deleted from Google Drive.
+
+        :param file_names: iterable of str file or folder paths relative to the file folder.
+        :return: None
+        """
+        with self.metrics.phase("upload_changes"):
+            self._upload_changes(file_names)
+
+    def _upload_changes(self, file_names):
+        remote_index = self.get_remote_index()
+        folder_cache = self.drive_api.folder_cache
+        pack_index = self.load_pack_index(remote_index)
+        deleted_folder_names = []
+        deleted_file_names = []
+        file_ids_to_delete = []
+        upload_paths = dict()
+        small_file_paths = dict()
+        chunked_file_paths = dict()
+        unpacked_file_names = []
+        for file_name in sorted(set(file_names)):
+            if any(file_name.startswith(folder_name + "/") for folder_name in deleted_folder_names):
+                continue
+            file_path_obj = self.dir_path / file_name
+            if file_path_obj.is_dir():
+                local_tree = walk_local_tree(file_path_obj, ignore=self.is_ignored_file, worker_count=self.worker_count)
+                self.check_transfer_results(self.drive_api.ensure_folders(
+                    [file_name] + [file_name + "/" + folder_name for folder_name in local_tree.folder_paths]))
+                for sub_file_name, sub_file_path_obj in local_tree.file_paths.items():
+                    upload_paths[file_name + "/" + sub_file_name] = sub_file_path_obj
+            elif file_path_obj.is_file():
+                if not self.is_ignored_file(file_path_obj):
+                    upload_paths[file_name] = file_path_obj
+            elif file_name in remote_index:
+                file_ids_to_delete.append(remote_index.get_file_id(file_name))
+                deleted_file_names.append(file_name)
+            elif folder_cache.get_id(file_name) is not None:
+                file_ids_to_delete.append(folder_cache.get_id(file_name))
+                deleted_folder_names.append(file_name)
+            if not file_path_obj.exists():
+                unpacked_file_names += [packed_name for packed_name in pack_index.names()
+                                        if packed_name == file_name or packed_name.startswith(file_name + "/")]
+
+        with self.new_transfer_scheduler() as scheduler:
+            try:
+                sizes = dict()
+                compared_paths = dict()
+                for file_name, file_path_obj in upload_paths.items():
+                    size = file_path_obj.stat().st_size
+                    if self.is_packable(size):
+                        small_file_paths[file_name] = file_path_obj
+                        continue
+                    if file_name in pack_index:
+                        unpacked_file_names.append(file_name)
+                    sizes[file_name] = size
+                    if file_name in remote_index:
+                        compared_paths[file_name] = file_path_obj
+                        continue
+                    self.queue_upload(scheduler, remote_index, file_name, file_path_obj, size, chunked_file_paths)
+                for file_name, file_path_obj, md5 in self.iter_local_md5s(compared_paths):
+                    if md5 is not None and md5 != remote_index.get(file_name).md5:
+                        self.queue_upload(scheduler, remote_index, file_name, file_path_obj, sizes[file_name],
+                                          chunked_file_paths)
+            finally:
+                self.hash_cache.save()
+            upload_results = scheduler.wait()
+
+        chunk_results = []
+        if chunked_file_paths:
+            try:
+                chunk_results = self.upload_chunked_files(remote_index, chunked_file_paths)
+            finally:
+                self.hash_cache.save()
+
+        pack_results = []
+        if small_file_paths or unpacked_file_names:
+            try:
+                pack_results, packed_ids_to_delete = self.pack_small_files(remote_index, small_file_paths,
+                                                                           unpacked_file_names)
+            finally:
+                self.hash_cache.save()
+            file_ids_to_delete += packed_ids_to_delete
+
+        delete_results = self.drive_api.delete_files(file_ids_to_delete, remote_index)
+        for folder_name in deleted_folder_names:
+            folder_cache.remove(folder_name)
+            remote_index.remove_folder(folder_name)
+        folder_cache.save()
+        self.check_transfer_results(upload_results + chunk_results + pack_results + delete_results)
+        if self.selective_sync is not None:
+            self.selective_sync.hold(upload_paths)
+            self.selective_sync.release(deleted_file_names)
+            for folder_name in deleted_folder_names:
+                self.selective_sync.release_folder(folder_name)
+            self.selective_sync.save()
 
     def get_drive_file_names(self):
         """
         List all files in Google Drive.
 
-        :return: None
+        :return: list of str file paths relative to the sync folder, including packed files.
         """
-        file_dict = self.drive_api.get_info_on_files()
-        return [file_info["name"] for file_info in file_dict.values()]
+        remote_index = self.refresh_remote_index()
+        return remote_index.names() + [file_name for file_name in self.load_pack_index(remote_index).names()
+                                       if file_name not in remote_index]
 
     def does_drive_file_exist(self, file_name: str):
         """
@@ -80,9 +1365,8 @@ class Synchronizer:
         :param file_name: str represents file name in Google Drive to search for.
         :return: None
         """
-        if self.drive_api.get_file_id_if_exists(file_name) is None:
-            return False
-        return True
+        remote_index = self.get_remote_index()
+        return file_name in remote_index or file_name in self.load_pack_index(remote_index)
 
     def delete_file_drive(self, file_name):
         pass
@@ -94,11 +1378,40 @@ class Synchronizer:
         :param file_name: str represents file name to search for and delete in local file storage.
         :return: True if file is deleted
         """
-        print("Deleting File:" + file_name)
+        self.metrics.emit("delete_local_file", file_name)
         file_path = self.dir_path / file_name
         file_path.unlink()
+        self.hash_cache.remove(file_path)
         return True
 
+    def delete_folder_computer(self, folder_name: str):
+        """
+        Delete folder and every synced file in it from local machine in the designated file folder on the local
+        machine. Files that are never synced, e.g. files matching an exclude pattern and partial downloads, are kept,
+        and so are the folders holding them.
+
+        :param folder_name: str represents folder path relative to the file folder.
+        :return: True if folder is deleted, False if it was kept because it still holds files that are never synced.
+        """
+        self.metrics.emit("delete_local_folder", folder_name)
+        folder_path = self.dir_path / folder_name
+        for dir_path_str, dir_names, file_names in os.walk(str(folder_path), topdown=False):
+            for dir_name in dir_names:
+                # os.walk does not descend into linked folders; the link itself goes like a file.
+                if os.path.islink(os.path.join(dir_path_str, dir_name)):
+                    os.unlink(os.path.join(dir_path_str, dir_name))
+            for file_name in file_names:
+                file_path_obj = Path(dir_path_str, file_name)
+                if not self.is_ignored_file(file_path_obj):
+                    file_path_obj.unlink()
+                    self.hash_cache.remove(file_path_obj)
+            try:
+                os.rmdir(dir_path_str)
+            except OSError:
+                # Still holds files that are never synced.
+                pass
+        return not folder_path.exists()
+
     def delete_file_both(self, file_name):
         pass
 
@@ -108,28 +1421,118 @@ class Synchronizer:
 
         :return: None
         """
-        self.drive_api.reset_all_files()
+        self.remote_index = None
+        with self.metrics.phase("reset"):
+            self.check_transfer_results(self.drive_api.reset_all_files())
+        self.pack_index = PackIndex(self.state_path(PACK_INDEX_PATH))
+        self.pack_index.save()
+        self.chunk_index.retain_manifests(())
+        self.chunk_index.save()
 
     def upload_file(self, file_name: str):
         """
-        Download file from Google Drive based on file name.
+        Upload file to Google Drive based on file name.
 
-        :param file_name: str represents file to download from Google Drive.
+        :param file_name: str represents file path relative to the file folder to upload to Google Drive.
         :return: None
         """
         file_path = str(self.dir_path / file_name)
-        self.drive_api.upload_file(file_path)
+        self.drive_api.upload_file(file_path, self.get_remote_index(), file_name)
 
     def download_file(self, file_name: str):
         """
-        Download file one file from Google Drive specified by file name.
+        Download file one file from Google Drive specified by file name. A packed file is read out of its pack with a
+        single range request, a chunked file is reassembled from its chunks.
 
         :param file_name: str represents file to download from Google Drive.
         :return: None
+        :raises FileNotFoundError: if Google Drive has no file of that name in the remote index or the pack index.
         """
-        file_id = self.drive_api.get_file_id_if_exists(file_name)
+        remote_index = self.get_remote_index()
+        remote_file = remote_index.get(file_name)
+        member = None
+        pack_file = None
+        if remote_file is None:
+            member = self.load_pack_index(remote_index).get(file_name)
+            pack_file = remote_index.get_pack_object(member.pack) if member is not None else None
+            if pack_file is None:
+                raise FileNotFoundError("No file named " + file_name + " in Google Drive")
         file_path = str(self.dir_path / file_name)
-        self.drive_api.download_file(file_id, file_path)
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        if member is not None:
+            # Only the member's bytes are read from its pack.
+            self.drive_api.download_pack_members(pack_file.id, [(file_path, member)])
+            self.hash_cache.set_md5(Path(file_path), member.md5)
+            return
+        if remote_file.codec == CHUNKED_CODEC:
+            self.drive_api.download_chunked_file(remote_file, file_path, remote_index, self.chunk_index)
+            self.chunk_index.save()
+        else:
+            self.drive_api.download_file(remote_file.id, file_path, remote_file.md5, remote_file.codec)
+
+    def open_remote(self, file_name: str, max_readahead: int = DEFAULT_MAX_READAHEAD) -> RemoteFileReader:
+        """
+        Open a file in Google Drive for reading without downloading it. The returned file object fetches only the
+        byte ranges that are read, through the block cache, reading ahead while it is read sequentially; reading the
+        head of a large file costs a single request. Packed files are read out of their pack and chunked files out of
+        their chunks, or local files holding the same chunks. Compressed files cannot be read from the middle and are
+        downloaded whole on the first read. With selective sync the file is remembered as accessed, so the next
+        download brings it into the sync folder ahead of other transfers.
+
+        :param file_name: str path relative to the sync folder.
+        :param max_readahead: int largest number of bytes fetched with a single request.
+        :return: RemoteFileReader, a seekable binary file object to be closed after use.
+        :raises FileNotFoundError: if Google Drive has no file of that name in the remote index.
+        """
+        remote_index = self.get_remote_index()
+        remote_file = remote_index.get(file_name)
+        if remote_file is None:
+            member = self.load_pack_index(remote_index).get(file_name)
+            pack_file = remote_index.get_pack_object(member.pack) if member is not None else None
+            if pack_file is None:
+                raise FileNotFoundError("No file named " + file_name + " in Google Drive")
+            # Pack objects are never changed, only replaced by packs of a new name.
+            size = member.length
+            content_key = "%s@%d@%s" % (member.pack, member.offset, member.md5)
+            source = RangeSource(self.drive_api, pack_file.id, member.offset)
+        else:
+            size = remote_file.size if remote_file.size is not None else 0
+            content_key = manifest_key(remote_file)
+            if remote_file.codec == CHUNKED_CODEC:
+                chunks = self.load_manifest(remote_file)
+                chunk_ids = dict()
+                for chunk in chunks:
+                    chunk_file_info = remote_index.get_chunk_object(chunk_object_name(chunk.digest))
+                    if chunk_file_info is not None:
+                        chunk_ids[chunk.digest] = chunk_file_info.id
+                source = ChunkedSource(self.drive_api, chunks, chunk_ids, self.chunk_index)
+            elif is_compression_codec(remote_file.codec):
+                source = CompressedSource(self.drive_api, remote_file.id, remote_file.codec, remote_file.md5)
+            elif remote_file.codec is None:
+                source = RangeSource(self.drive_api, remote_file.id)
+            else:
+                raise ValueError("Cannot read " + file_name + " stored with unknown codec " + remote_file.codec)
+        if self.selective_sync is not None:
+            self.selective_sync.record_access(file_name)
+            self.selective_sync.save()
+            self.prioritize([file_name])
+        return RemoteFileReader(file_name, size, content_key, source, self.block_cache, max_readahead)
+
+    def evict_file(self, file_name: str):
+        """
+        Remove the local copy of a file with selective sync, leaving the file in Google Drive. Unless it matches a
+        selective sync pattern, download does not bring it back until it is opened with open_remote again.
+
+        :param file_name: str path relative to the sync folder.
+        :return: None
+        """
+        if self.selective_sync is None:
+            raise ValueError("Files can only be evicted with selective sync")
+        if (self.dir_path / file_name).is_file():
+            self.delete_file_computer(file_name)
+            self.hash_cache.save()
+        self.selective_sync.forget(file_name)
+        self.selective_sync.save()
 
     def upload_clipboard(self):
         pass
@@ -139,13 +1542,66 @@ class Synchronizer:
 
 
 class GoogleDriveApiHandler:
-    def __init__(self):
+    def __init__(self, creds=None, chunk_size: int = DEFAULT_CHUNK_SIZE, journal: TransferJournal = None,
+                 folder_cache: FolderCache = None, backend=None, metrics: Metrics = None,
+                 executor: RequestExecutor = None, compression: CompressionPolicy = None, client: DriveClient = None,
+                 bandwidth: BandwidthLimiter = None):
         """
         Initialize Google Drive API by retrieving credentials and building service api.
+
+        :param creds: Credentials to reuse instead of loading or prompting for them, e.g. from another handler.
+        :param chunk_size: int number of bytes transferred per request when streaming file contents.
+        :param journal: TransferJournal recording in-flight transfers so they can be resumed after a restart.
+        :param folder_cache: FolderCache of Google Drive folder ids by relative path.
+        :param backend: object providing get_credentials() and build_service(creds), the GoogleDriveBackend shared by
+        the whole process if None. FakeDriveBackend serves the api from memory for tests and benchmarks.
+        :param metrics: Metrics recording every api call and transfer of this handler and its worker handlers.
+        :param executor: RequestExecutor retrying and rate limiting the api calls of this handler and its worker
+        handlers.
+        :param compression: CompressionPolicy deciding which files upload_file compresses, None to upload files as
+        they are.
+        :param client: DriveClient shared with other handlers, e.g. of other sync roots. Its backend, metrics,
+        executor, bandwidth limiter and per-thread service objects are used instead of the parameters above.
+        :param bandwidth: BandwidthLimiter every chunk transferred by this handler and its worker handlers is counted
+        against, None for no limit.
         """
-        self.creds = None
-        self.get_credentials()
-        self.service = build('drive', 'v3', credentials=self.creds)
+        if client is not None:
+            backend, metrics, executor, bandwidth = client.backend, client.metrics, client.executor, client.bandwidth
+        self.client = client
+        self.backend = backend if backend is not None else shared_backend()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.executor = executor if executor is not None else RequestExecutor(metrics=self.metrics)
+        self.creds = creds
+        self.chunk_size = chunk_size
+        self.journal = journal if journal is not None else TransferJournal()
+        self.folder_cache = folder_cache if folder_cache is not None else FolderCache()
+        self.compression = compression
+        self.bandwidth = bandwidth
+        self._service = None
+
+    @property
+    def service(self):
+        """
+        Drive service object, built on first use so that creating a handler neither loads credentials nor imports the
+        Google api client. Handlers sharing a DriveClient use its service object of the calling thread.
+        """
+        if self.client is not None:
+            return self.client.service()
+        if self._service is None:
+            if self.creds is None:
+                self.get_credentials()
+            self._service = self.backend.build_service(self.creds)
+        return self._service
+
+    def new_worker_handler(self):
+        """
+        Create another handler sharing these credentials but with its own service object and http connection. The
+        service object is not thread-safe, so every transfer worker thread needs its own.
+
+        :return: GoogleDriveApiHandler
+        """
+        return GoogleDriveApiHandler(self.creds, self.chunk_size, self.journal, self.folder_cache, self.backend,
+                                     self.metrics, self.executor, self.compression, self.client, self.bandwidth)
 
     def get_credentials(self):
         """
@@ -153,84 +1609,419 @@ class GoogleDriveApiHandler:
 
         :return: None
         """
-        self.creds = None
-        # The file token.pickle stores the user's access and refresh tokens, and is
-        # created automatically when the authorization flow completes for the first
-        # time.
-        if os.path.exists('token.pickle') and os.path.getsize('token.pickle') > 0:
-            with open('token.pickle', 'rb') as token:
-                self.creds = pickle.load(token)
-        # If there are no (valid) credentials available, let the user log in.
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                self.creds = flow.run_local_server()
-            # Save the credentials for the next run
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(self.creds, token)
+        self.creds = self.backend.get_credentials()
+
+    def call_api(self, method: str, function, *args):
+        """
+        Run a call to the Drive api through the shared request executor, which retries it on rate limiting and
+        server errors. Every attempt is recorded under the given method. A call is usually a single http round trip;
+        the first chunk of a resumable upload also opens the upload session.
+
+        :param method: str api method id the call is recorded under, e.g. "drive.files.list".
+        :param function: callable sending the request, e.g. HttpRequest.execute or a chunk of a media transfer.
+        :return: whatever function returns.
+        """
+        return self.executor.call(method, self._timed_call, method, function, *args)
+
+    def _timed_call(self, method: str, function, *args):
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            result = function(*args)
+            failed = False
+            return result
+        finally:
+            self.metrics.record_api_call(method, time.perf_counter() - start_time, failed)
+
+    def throttle(self, direction: str, byte_count: int):
+        """
+        Count transferred bytes against the bandwidth limits and wait until more may be transferred. Called after every
+        chunk; waiting is timed as the "throttle" phase.
+
+        :param direction: str "upload" or "download".
+        :param byte_count: int number of bytes just transferred.
+        :return: None
+        :raises SyncCancelled: if the sync operation was cancelled while waiting.
+        """
+        if self.bandwidth is None or byte_count <= 0:
+            return
+        waited = self.bandwidth.acquire(direction, byte_count, self.executor.check_cancelled)
+        if waited > 0:
+            self.metrics.add_phase_time("throttle", waited)
+
+    def execute(self, request):
+        """
+        Execute an api request. Every metadata request of this handler goes through here.
+
+        :param request: HttpRequest built from the service object.
+        :return: dict response of the request.
+        """
+        return self.call_api(request.methodId, request.execute)
+
+    def _iter_list(self, query: str, fields: str, page_size: int):
+        page_token = None
+        while True:
+            response = self.execute(self.service.files().list(spaces='appDataFolder',
+                                                              orderBy="name",
+                                                              pageSize=page_size,
+                                                              pageToken=page_token,
+                                                              fields='nextPageToken, files(' + fields + ')',
+                                                              q=query))
+            for file_info in response.get("files", []):
+                yield file_info
+
+            page_token = response.get("nextPageToken", None)
+            if page_token is None:
+                return
+
+    def iter_files(self, page_size: int = LIST_PAGE_SIZE):
+        """
+        Generator over all files stored in Google Drive. Requests pages of the given size, follows page tokens and
+        yields file records as each page arrives so callers can start working before the listing completes.
+
+        :param page_size: int number of files requested per page. The Drive api allows at most 1000.
+        :return: generator of dicts with id, name, md5Checksum, size, modifiedTime, parents and trashed fields.
+        """
+        return self._iter_list("mimeType != '" + FOLDER_MIME_TYPE + "'", FILE_INFO_FIELDS + ', trashed', page_size)
+
+    def iter_folders(self, page_size: int = LIST_PAGE_SIZE):
+        """
+        Generator over all folders stored in Google Drive, paginated like iter_files.
+
+        :param page_size: int number of folders requested per page. The Drive api allows at most 1000.
+        :return: generator of dicts with id, name and parents fields.
+        """
+        return self._iter_list("mimeType = '" + FOLDER_MIME_TYPE + "'", "id, name, parents", page_size)
+
+    def resolve_root_folder(self) -> str:
+        """
+        Look up the real id of the folder the sync folder is mirrored to: the appDataFolder, or the folder at the
+        folder cache's root_path inside it, which is created if it does not exist yet. Costs one request for the
+        appDataFolder and one or two per component of root_path.
+
+        :return: str folder id, also cached under the empty path.
+        """
+        with self.folder_cache.lock:
+            folder_id = self.execute(self.service.files().get(fileId=ROOT_FOLDER_ID, fields="id"))["id"]
+            root_path = self.folder_cache.root_path
+            for folder_name in root_path.split("/") if root_path else []:
+                query = "name = '" + folder_name.replace("'", "\\'") + "' and '" + folder_id + \
+                        "' in parents and mimeType = '" + FOLDER_MIME_TYPE + "' and trashed = false"
+                folder_infos = list(self._iter_list(query, "id", LIST_PAGE_SIZE))
+                if folder_infos:
+                    folder_id = folder_infos[0]["id"]
+                    continue
+                folder_id = self.execute(self.service.files().create(body={"name": folder_name,
+                                                                           "mimeType": FOLDER_MIME_TYPE,
+                                                                           "parents": [folder_id]},
+                                                                     fields="id"))["id"]
+            self.folder_cache.set_id("", folder_id)
+            return folder_id
+
+    def refresh_folder_cache(self) -> FolderCache:
+        """
+        Rebuild the folder cache from a single paginated listing of all folders in Google Drive. The real id of the
+        sync folder's folder is looked up once and kept in the on disk cache.
+
+        :return: FolderCache of every folder reachable from the sync folder's folder.
+        """
+        root_id = self.folder_cache.get_id("")
+        if not self.folder_cache.has_root_id():
+            root_id = self.resolve_root_folder()
+
+        folders_by_parent = dict()
+        for folder_info in self.iter_folders():
+            for parent_id in folder_info.get("parents", []):
+                folders_by_parent.setdefault(parent_id, []).append(folder_info)
+
+        ids_by_path = {"": root_id}
+        pending = [("", root_id)]
+        while pending:
+            folder_path, folder_id = pending.pop()
+            for folder_info in folders_by_parent.get(folder_id, []):
+                child_path = folder_info["name"] if folder_path == "" else folder_path + "/" + folder_info["name"]
+                if child_path not in ids_by_path:
+                    ids_by_path[child_path] = folder_info["id"]
+                    pending.append((child_path, folder_info["id"]))
+
+        self.folder_cache.replace_all(ids_by_path)
+        self.folder_cache.save()
+        return self.folder_cache
+
+    def get_start_page_token(self) -> str:
+        """
+        :return: str Drive changes cursor pointing at the current state of Google Drive.
+        """
+        return self.execute(self.service.changes().getStartPageToken())["startPageToken"]
+
+    def list_changes(self, page_token: str, page_size: int = LIST_PAGE_SIZE):
+        """
+        Fetch every change to the appDataFolder since the given cursor, following page tokens.
+
+        :param page_token: str Drive changes cursor from get_start_page_token or a previous call.
+        :param page_size: int number of changes requested per page. The Drive api allows at most 1000.
+        :return: (list, str) change dicts with fileId, removed and file fields, and the cursor for the next call.
+        """
+        changes = []
+        while True:
+            response = self.execute(self.service.changes().list(spaces='appDataFolder',
+                                                                pageToken=page_token,
+                                                                pageSize=page_size,
+                                                                fields='nextPageToken, newStartPageToken, changes('
+                                                                       'fileId, removed, file(' + FILE_INFO_FIELDS +
+                                                                       ', mimeType, trashed))'))
+            changes += response.get("changes", [])
+            if "newStartPageToken" in response:
+                return changes, response["newStartPageToken"]
+            page_token = response["nextPageToken"]
 
     def get_info_on_files(self):
         """
-        Retrieve current Google Drive info on stored files. List file id, file name, md5Checksum, and deletion status.
+        Retrieve current Google Drive info on stored files. List file id, file name, md5Checksum, size, modified time
+        and deletion status.
 
         :return: dict indexed by unique google drive file id. Element is a dict that lists file information.
         """
-        response = self.service.files().list(spaces='appDataFolder',
-                                             orderBy="name",
-                                             fields='files(id, name, md5Checksum, trashed)',
-                                             q="mimeType != 'application/vnd.google-apps.folder'"
-                                             ).execute()
-
         result = {}
-        for file_info in response["files"]:
+        for file_info in self.iter_files():
             result[file_info["id"]] = {"md5": file_info.get("md5Checksum", None),
                                          "name": file_info["name"],
+                                         "size": file_info.get("size", None),
+                                         "modified_time": file_info.get("modifiedTime", None),
                                          "trashed": file_info["trashed"]}
 
         return result
 
+    def build_remote_index(self) -> RemoteIndex:
+        """
+        Build a path to file info index of all files in Google Drive from a single paginated listing of folders and
+        one of files.
+
+        :return: RemoteIndex mapping relative file path to id, md5 checksum, size and modified time.
+        """
+        self.refresh_folder_cache()
+        remote_index = RemoteIndex()
+        for file_info in self.iter_files():
+            file_name = self.folder_cache.resolve_path(file_info)
+            if file_name is not None:
+                remote_index.add_file_info(file_info, file_name)
+        return remote_index
+
     def get_file_id_if_exists(self, file_name: str) -> str:
         """
         Return a file id if it currently exists in Google Drive or None otherwise. If duplicates exist then return
         arbitrary file id with file name.
 
-        :param file_name: Name of the file to look for.
+        :param file_name: Path of the file relative to the sync folder to look for.
         :return: None if no file exists. str that is the file id if it exists.
         """
-        query = "name='" + file_name + "'"
-        response = self.service.files().list(spaces='appDataFolder',
-                                             fields="files(id)",
-                                             q=query).execute()
+        folder_id = self.folder_cache.get_id(parent_path(file_name))
+        if folder_id is None:
+            return None
+        query = "name='" + base_name(file_name).replace("'", "\\'") + "' and '" + folder_id + "' in parents"
+        response = self.execute(self.service.files().list(spaces='appDataFolder',
+                                                          fields="files(id)",
+                                                          q=query))
         result = response.get("files", None)
         if len(result) == 0:
             return None
         return result[0]["id"]
 
-    def download_file(self, file_id: str, file_path: str):
+    def ensure_folder(self, folder_path: str) -> str:
+        """
+        Return the id of a folder in Google Drive, creating it and any missing parent folders first. Cached folders
+        cost no requests.
+
+        :param folder_path: str folder path relative to the sync folder, "" for the sync folder itself.
+        :return: str folder id.
+        """
+        with self.folder_cache.lock:
+            folder_id = self.folder_cache.get_id(folder_path)
+            if folder_id is not None:
+                return folder_id
+            if folder_path == "":
+                folder_id = self.resolve_root_folder()
+                self.folder_cache.save()
+                return folder_id
+            parent_id = self.ensure_folder(parent_path(folder_path))
+            folder_info = self.execute(self.service.files().create(body={"name": base_name(folder_path),
+                                                                         "mimeType": FOLDER_MIME_TYPE,
+                                                                         "parents": [parent_id]},
+                                                                   fields="id"))
+            self.folder_cache.set_id(folder_path, folder_info["id"])
+            self.folder_cache.save()
+            return folder_info["id"]
+
+    def ensure_folders(self, folder_paths) -> list:
+        """
+        Create every folder that is not yet in Google Drive. Folders are created one depth level at a time with batch
+        requests, so a new tree costs one batch per level rather than one request per folder.
+
+        :param folder_paths: iterable of str folder paths relative to the sync folder.
+        :return: list of TransferResult, one per created folder.
+        """
+        missing_by_depth = dict()
+        for folder_path in folder_paths:
+            if self.folder_cache.get_id(folder_path) is None:
+                missing_by_depth.setdefault(folder_path.count("/"), []).append(folder_path)
+        if missing_by_depth:
+            self.ensure_folder("")
+
+        results = []
+        for depth in sorted(missing_by_depth.keys()):
+            requests = []
+            for folder_path in missing_by_depth[depth]:
+                parent_id = self.folder_cache.get_id(parent_path(folder_path))
+                if parent_id is None:
+                    continue
+                requests.append((folder_path, self.service.files().create(body={"name": base_name(folder_path),
+                                                                                "mimeType": FOLDER_MIME_TYPE,
+                                                                                "parents": [parent_id]},
+                                                                          fields="id")))
+            responses, errors = self.execute_batch(requests)
+            for folder_path, request in requests:
+                if folder_path in responses:
+                    self.folder_cache.set_id(folder_path, responses[folder_path]["id"])
+                results.append(TransferResult(name=folder_path, action="create_folder",
+                                              success=folder_path in responses, error=errors.get(folder_path, None)))
+        self.folder_cache.save()
+        return results
+
+    def download_file(self, file_id: str, file_path: str, md5: str = None, codec: str = None):
         """
         Download file with file id and save it to given file path. File path must be a proper file path, else undefined
-        behavior occurs.
+        behavior occurs. The file is streamed in chunks into a temporary file next to the target, which is fsynced and
+        atomically renamed into place, so memory use is bounded by the chunk size and an interrupted download never
+        leaves a half-written file under the real name. If the md5 checksum is given, progress is journaled and an
+        interrupted download of the same content resumes where it stopped. Compressed files are decompressed on the
+        way, again through a temporary file.
 
         :param file_id: str represents the Google Drive file id.
         :param file_path: str that represents the file path to save the downloaded file to.
+        :param md5: str md5 checksum of the Google Drive file's content, required to resume an interrupted download.
+        :param codec: str codec app property of the file, e.g. "gzip" if it is stored compressed. None for plain files.
         :return: True if it succeeds or throw error if not.
         """
-        file_name = Path(file_path).name
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print("Download %d%%." % int(status.progress() * 100))
-        with open(file_path, "wb") as out:
-            out.write(fh.getvalue())
+        if codec is not None and not is_compression_codec(codec):
+            raise ValueError("Cannot download " + file_path + " stored with unknown codec " + codec)
+        with self.metrics.span("download_file", file=file_path):
+            tmp_path, offset = self._open_download(file_id, file_path, md5)
+            try:
+                with open(tmp_path, "r+b") as out:
+                    out.truncate(offset)
+                    out.seek(offset)
+                    total_size = None
+                    while total_size is None or out.tell() < total_size:
+                        chunk_start = out.tell()
+                        total_size = self.call_api("drive.files.get_media", self._download_chunk, file_id, out)
+                        self.metrics.add_bytes_downloaded(out.tell() - chunk_start)
+                        self.metrics.emit("download_progress", file_path, out.tell(), total_size)
+                        self.throttle("download", out.tell() - chunk_start)
+                        if out.tell() < total_size and md5 is not None:
+                            self.journal.record_download(file_path, file_id, md5, tmp_path, out.tell())
+                    out.flush()
+                    os.fsync(out.fileno())
+                if codec is None:
+                    os.replace(tmp_path, file_path)
+                else:
+                    self._decompress_download(codec, tmp_path, file_path, md5)
+                self.journal.remove_download(file_path)
+            except HttpError as error:
+                if md5 is None or error.resp.status == 404:
+                    self._discard_download(file_path, tmp_path)
+                raise
+            except BaseException:
+                if md5 is None:
+                    self._discard_download(file_path, tmp_path)
+                raise
 
         return True
 
+    def _download_chunk(self, file_id: str, out) -> int:
+        """
+        Download the next chunk of a file with an explicit Range header starting at the position of out, and write it
+        there. A fresh request is sent per chunk, so a download can start, or be retried, at any offset.
+
+        :param file_id: str represents the Google Drive file id.
+        :param out: binary file object positioned at the offset to continue downloading from.
+        :return: int total size of the file in Google Drive.
+        """
+        request = self.service.files().get_media(fileId=file_id)
+        offset = out.tell()
+        # Accept-Encoding is left out, so the byte range applies to the stored content rather than a compressed form.
+        headers = {key: value for key, value in request.headers.items()
+                   if key.lower() not in ("accept", "accept-encoding", "user-agent")}
+        headers["range"] = "bytes=%d-%d" % (offset, offset + self.chunk_size - 1)
+        response, content = request.http.request(request.uri, method="GET", headers=headers)
+        if response.status == 416 and "content-range" in response:
+            # Nothing left from offset on, e.g. the file is empty.
+            total_size = int(response["content-range"].rsplit("/", 1)[1])
+            if total_size == offset:
+                return total_size
+        if response.status not in (200, 206):
+            raise HttpError(response, content, uri=request.uri)
+        if response.status == 200 and offset > 0:
+            # The range was ignored and the whole content sent, keep only the part after offset.
+            content = content[offset:]
+        out.write(content)
+        if "content-range" in response:
+            return int(response["content-range"].rsplit("/", 1)[1])
+        return offset + len(content)
+
+    def _decompress_download(self, codec: str, tmp_path: str, file_path: str, md5: str):
+        """
+        Decompress a downloaded file into place and check it against the md5 checksum of its content. The compressed
+        download is removed either way, a corrupt one cannot be resumed.
+
+        :return: None
+        """
+        start_time = time.perf_counter()
+        file_path_obj = Path(file_path)
+        plain_fd, plain_path = tempfile.mkstemp(dir=str(file_path_obj.parent), prefix="." + file_path_obj.name + ".",
+                                                suffix=PARTIAL_DOWNLOAD_SUFFIX)
+        try:
+            with open(tmp_path, "rb") as source, os.fdopen(plain_fd, "wb") as out:
+                content_md5, size = decompress_stream(codec, source, out)
+                if md5 is not None and content_md5 != md5:
+                    raise ValueError("Decompressed content of " + file_path + " does not match its md5 checksum")
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(plain_path, file_path)
+        except BaseException:
+            if os.path.exists(plain_path):
+                os.remove(plain_path)
+            raise
+        finally:
+            self._discard_download(file_path, tmp_path)
+            self.metrics.add_phase_time("decompress", time.perf_counter() - start_time)
+
+    def _open_download(self, file_id: str, file_path: str, md5: str):
+        """
+        Find the temporary file of an interrupted download of the same content or create a new one.
+
+        :return: (str, int) path of the temporary file and the byte offset to continue downloading from.
+        """
+        entry = self.journal.get_download(file_path)
+        if entry is not None:
+            if md5 is not None and entry["file_id"] == file_id and entry["md5"] == md5 and \
+                    os.path.exists(entry["tmp_path"]):
+                return entry["tmp_path"], min(entry["offset"], os.path.getsize(entry["tmp_path"]))
+            self._discard_download(file_path, entry["tmp_path"])
+
+        file_path_obj = Path(file_path)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=str(file_path_obj.parent),
+                                            prefix="." + file_path_obj.name + ".",
+                                            suffix=PARTIAL_DOWNLOAD_SUFFIX)
+        os.close(tmp_fd)
+        if md5 is not None:
+            self.journal.record_download(file_path, file_id, md5, tmp_path, 0)
+        return tmp_path, 0
+
+    def _discard_download(self, file_path: str, tmp_path: str):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        self.journal.remove_download(file_path)
+
     def download_all_files(self):
         """
         Download all files within Google Drive folder. Give each file name found in Google Drive. Duplicates are not
@@ -238,54 +2029,541 @@ class GoogleDriveApiHandler:
 
         :return: None
         """
-        file_dict = self.get_info_on_files()
-        for file_id, file_info in file_dict.items():
-            self.download_file(file_id, file_info["name"])
+        remote_index = self.build_remote_index()
+        for file_name, remote_file in remote_index.items():
+            Path(file_name).parent.mkdir(parents=True, exist_ok=True)
+            if remote_file.codec == CHUNKED_CODEC:
+                self.download_chunked_file(remote_file, file_name, remote_index)
+            else:
+                self.download_file(remote_file.id, file_name, remote_file.md5, remote_file.codec)
 
-    def upload_file(self, file_path: str):
+    def upload_file(self, file_path: str, remote_index: RemoteIndex = None, file_name: str = None):
         """
         Upload file located at the given file path to Google Drive. Replace file with name if exists in Google Drive.
+        The resumable session of an upload is journaled after every chunk, so an upload interrupted by a crash resumes
+        from the last confirmed byte as long as the local file is unchanged and the session has not expired. If the
+        compression policy picks a codec for the file, a compressed copy is uploaded instead, together with the codec
+        and the md5 checksum and size of the content in appProperties; such uploads start over after a crash.
 
         :param file_path: str that represents path to the file to upload.
+        :param remote_index: RemoteIndex used to look up an existing file id instead of querying Google Drive. It is
+        updated with the uploaded file's info.
+        :param file_name: str path relative to the sync folder to store the file under. Missing folders are created.
+        Defaults to the name of the local file.
         :return: None
         """
-        file_name = Path(file_path).name
-        file_id = self.get_file_id_if_exists(file_name)
+        with self.metrics.span("upload_file", file=file_path):
+            if file_name is None:
+                file_name = Path(file_path).name
+            if remote_index is None:
+                file_id = self.get_file_id_if_exists(file_name)
+            else:
+                file_id = remote_index.get_file_id(file_name)
 
-        file_metadata = {
-            "name": file_name,
-            "parents": ["appDataFolder"]
-        }
+            file_metadata = {
+                "name": base_name(file_name),
+                "parents": [self.ensure_folder(parent_path(file_name))]
+            }
+            remote_file = remote_index.get(file_name) if remote_index is not None else None
+            codec = None
+            if self.compression is not None:
+                codec = self.compression.choose_codec(file_path, os.path.getsize(file_path))
+            upload_path = file_path
+            if codec is not None:
+                upload_path, file_metadata["appProperties"] = self._compress_file(file_path, codec)
+            elif remote_file is not None and remote_file.codec is not None:
+                # The plain content replaces an encoded one, so the properties describing the encoding have to go.
+                file_metadata["appProperties"] = {key: None for key in CODEC_PROPERTIES}
 
-        media = MediaFileUpload(file_path,
-                                resumable=True)
-        if file_id is None:
-            file = self.service.files().create(body=file_metadata,
+            try:
+                try:
+                    file = self._upload_media(upload_path, file_id, file_metadata, file_path)
+                except HttpError as error:
+                    if file_id is not None or error.resp.status != 404 or parent_path(file_name) == "":
+                        raise
+                    # The cached parent folder no longer exists in Google Drive, so recreate it and try once more.
+                    self.metrics.record_retry("drive.files.create")
+                    self.folder_cache.remove(parent_path(file_name))
+                    file_metadata["parents"] = [self.ensure_folder(parent_path(file_name))]
+                    file = self._upload_media(upload_path, file_id, file_metadata, file_path)
+            finally:
+                if upload_path != file_path:
+                    os.remove(upload_path)
+
+            if remote_index is not None:
+                remote_index.set_file_info(file_name, file)
+
+    def _compress_file(self, file_path: str, codec: str):
+        """
+        Compress a file into a temporary file outside the sync folder, timed as the "compress" phase.
+
+        :return: (str, dict) path of the compressed copy, which the caller removes, and the appProperties describing
+        it.
+        """
+        start_time = time.perf_counter()
+        compressed_fd, compressed_path = tempfile.mkstemp(prefix="simple-sync-", suffix="." + codec)
+        try:
+            with open(file_path, "rb") as source, os.fdopen(compressed_fd, "wb") as out:
+                md5, size = compress_stream(codec, self.compression.level, source, out)
+        except BaseException:
+            os.remove(compressed_path)
+            raise
+        finally:
+            self.metrics.add_phase_time("compress", time.perf_counter() - start_time)
+        return compressed_path, {CODEC_PROPERTY: codec, CONTENT_MD5_PROPERTY: md5, CONTENT_SIZE_PROPERTY: str(size)}
+
+    def _upload_media(self, file_path: str, file_id: str, file_metadata: dict, progress_path: str = None) -> dict:
+        """
+        Run the resumable upload of a file, resuming a journaled session if there is one.
+
+        :param progress_path: str path progress events are reported under if file_path is a temporary copy, e.g. a
+        compressed one. Sessions of temporary copies are not journaled, there is nothing to resume them from.
+        :return: dict file resource of the uploaded file.
+        """
+        from googleapiclient.http import MediaFileUpload
+
+        journaled = progress_path is None or progress_path == file_path
+        progress_path = progress_path if progress_path is not None else file_path
+
+        stat = os.stat(file_path)
+
+        def new_request():
+            media = MediaFileUpload(file_path,
+                                    chunksize=self.chunk_size,
+                                    resumable=True)
+            if file_id is None:
+                return self.service.files().create(body=file_metadata,
+                                                   media_body=media,
+                                                   fields=FILE_INFO_FIELDS)
+            if "appProperties" in file_metadata:
+                return self.service.files().update(fileId=file_id,
+                                                   body={"appProperties": file_metadata["appProperties"]},
+                                                   media_body=media,
+                                                   fields=FILE_INFO_FIELDS)
+            return self.service.files().update(fileId=file_id,
                                                media_body=media,
-                                               fields='id').execute()
+                                               fields=FILE_INFO_FIELDS)
+
+        request = new_request()
+        entry = self.journal.get_upload(file_path) if journaled else None
+        if entry is not None and (entry["file_id"] != file_id or entry["size"] != stat.st_size or
+                                  entry["mtime_ns"] != stat.st_mtime_ns):
+            self.journal.remove_upload(file_path)
+            entry = None
+
+        # Journaled session to resume, Google Drive is first asked how many bytes of it it already received.
+        session_uri = entry["session_uri"] if entry is not None else None
+        # Bytes Google Drive already confirmed, a resumed session does not send them again.
+        confirmed = entry["offset"] if entry is not None else 0
+        file = None
+        while file is None:
+            try:
+                if session_uri is not None:
+                    file = self.call_api(request.methodId, self._resume_upload_session, request, session_uri,
+                                         stat.st_size)
+                    session_uri = None
+                else:
+                    status, file = self.call_api(request.methodId, request.next_chunk)
+            except HttpError as error:
+                if entry is None or error.resp.status not in EXPIRED_SESSION_STATUSES:
+                    raise
+                # The journaled session expired, fall back to a fresh upload.
+                self.metrics.record_retry(request.methodId)
+                if journaled:
+                    self.journal.remove_upload(file_path)
+                entry = None
+                session_uri = None
+                request = new_request()
+                confirmed = 0
+                continue
+            progress = stat.st_size if file is not None else request.resumable_progress
+            self.metrics.add_bytes_uploaded(max(0, progress - confirmed))
+            self.throttle("upload", progress - confirmed)
+            confirmed = progress
+            self.metrics.emit("upload_progress", progress_path, progress, stat.st_size)
+            if file is None and journaled:
+                self.journal.record_upload(file_path, request.resumable_uri, request.resumable_progress, file_id,
+                                           stat.st_size, stat.st_mtime_ns)
+                entry = self.journal.get_upload(file_path)
+        if journaled:
+            self.journal.remove_upload(file_path)
+        return file
+
+    def _resume_upload_session(self, request, session_uri: str, size: int) -> dict:
+        """
+        Ask Google Drive how many bytes of a resumable upload session it received, and point a fresh upload request at
+        the session so its next chunk continues from there.
+
+        :param request: HttpRequest of a resumable upload that was not started yet.
+        :param session_uri: str resumable upload session uri to continue.
+        :param size: int size of the uploaded file.
+        :return: dict file resource if the session already received the whole file, else None.
+        """
+        response, content = request.http.request(session_uri, method="PUT",
+                                                 headers={"Content-Range": "bytes */%d" % size, "Content-Length": "0"})
+        if response.status in (200, 201):
+            return request.postproc(response, content)
+        if response.status != 308:
+            raise HttpError(response, content, uri=session_uri)
+        request.resumable_uri = response.get("location", session_uri)
+        # A missing range header means the session did not receive any byte yet.
+        request.resumable_progress = int(response["range"].split("-")[1]) + 1 if "range" in response else 0
+        return None
+
+    def upload_bytes(self, file_name: str, data: bytes, file_id: str = None, remote_index: RemoteIndex = None,
+                     app_properties: dict = None) -> dict:
+        """
+        Store a small object in Google Drive with a single multipart request.
+
+        :param file_name: str path relative to the sync folder to store the object under.
+        :param data: bytes content.
+        :param file_id: str id of an existing file to replace, None to create a new one.
+        :param remote_index: RemoteIndex to update with the stored file's info.
+        :param app_properties: dict appProperties to set on the object, None values remove a property.
+        :return: dict file resource of the stored file.
+        """
+        from googleapiclient.http import MediaIoBaseUpload
+
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype="application/octet-stream", resumable=False)
+        if file_id is None:
+            body = {"name": base_name(file_name), "parents": [self.ensure_folder(parent_path(file_name))]}
+            if app_properties is not None:
+                body["appProperties"] = {key: value for key, value in app_properties.items() if value is not None}
+            request = self.service.files().create(body=body, media_body=media, fields=FILE_INFO_FIELDS)
+        elif app_properties is not None:
+            request = self.service.files().update(fileId=file_id, body={"appProperties": app_properties},
+                                                  media_body=media, fields=FILE_INFO_FIELDS)
         else:
-            file = self.service.files().update(fileId=file_id,
-                                               media_body=media,
-                                               fields='id').execute()
+            request = self.service.files().update(fileId=file_id, media_body=media, fields=FILE_INFO_FIELDS)
+        file = self.execute(request)
+        self.metrics.add_bytes_uploaded(len(data))
+        self.throttle("upload", len(data))
+        if remote_index is not None:
+            remote_index.set_file_info(file_name, file)
+        return file
+
+    def download_range(self, file_id: str, start: int = None, length: int = None) -> bytes:
+        """
+        Read a file's content, or just a byte range of it, with a single request.
+
+        :param file_id: str represents the Google Drive file id.
+        :param start: int offset of the first byte to read, None to read the whole file.
+        :param length: int number of bytes to read from start. Must be at least 1.
+        :return: bytes content.
+        """
+        request = self.service.files().get_media(fileId=file_id)
+        if start is not None:
+            request.headers["range"] = "bytes=%d-%d" % (start, start + length - 1)
+        data = self.call_api("drive.files.get_media", request.execute)
+        self.metrics.add_bytes_downloaded(len(data))
+        self.throttle("download", len(data))
+        return data
+
+    def upload_pack(self, pack_name: str, members: list, pack_index: PackIndex, remote_index: RemoteIndex = None):
+        """
+        Concatenate local files into a new pack object and upload it with a single request. The pack and the position
+        of every member are recorded in the pack index.
+
+        :param pack_name: str name of the new pack object.
+        :param members: list of (str, str) tuples of file names relative to the sync folder and local file paths.
+        :param pack_index: PackIndex to add the pack to.
+        :param remote_index: RemoteIndex to add the pack object to.
+        :return: None
+        """
+        data = bytearray()
+        pack_members = []
+        for file_name, file_path in members:
+            with open(file_path, "rb") as member_file:
+                content = member_file.read()
+            pack_members.append((file_name, PackMember(pack_name, len(data), len(content),
+                                                       hashlib.md5(content).hexdigest())))
+            data += content
+        with self.metrics.span("upload_pack", pack=pack_name, members=len(members)):
+            self.upload_bytes(pack_name, bytes(data), None, remote_index)
+        pack_index.add_pack(pack_name, len(data), pack_members)
+        for file_name, file_path in members:
+            size = pack_index.get(file_name).length
+            self.metrics.emit("upload_progress", file_path, size, size)
+
+    def download_pack_members(self, pack_id: str, members: list):
+        """
+        Extract packed files from a pack object. A single range request covers every requested member, so single
+        files can be read out of a pack without downloading all of it. Each file is checked against its md5 checksum
+        and written through a temporary file that is atomically renamed into place.
 
-    def delete_file(self, file_id: str):
+        :param pack_id: str Google Drive file id of the pack.
+        :param members: list of (str, PackMember) tuples of local file paths and the members to write to them.
+        :return: None
+        """
+        start = min(member.offset for file_path, member in members)
+        end = max(member.offset + member.length for file_path, member in members)
+        with self.metrics.span("download_pack", members=len(members)):
+            data = self.download_range(pack_id, start, end - start) if end > start else b""
+        for file_path, member in members:
+            content = data[member.offset - start:member.offset - start + member.length]
+            if hashlib.md5(content).hexdigest() != member.md5:
+                raise ValueError("Packed content of " + file_path + " does not match its md5 checksum")
+            file_path_obj = Path(file_path)
+            file_path_obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=str(file_path_obj.parent), prefix="." + file_path_obj.name + ".",
+                                                suffix=PARTIAL_DOWNLOAD_SUFFIX)
+            try:
+                with os.fdopen(tmp_fd, "wb") as out:
+                    out.write(content)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self.metrics.emit("download_progress", file_path, member.length, member.length)
+
+    def upload_chunk(self, file_path: str, chunk: ChunkRef, remote_index: RemoteIndex = None):
+        """
+        Upload a chunk of a local file as a chunk object with a single request.
+
+        :param file_path: str path of the local file containing the chunk.
+        :param chunk: ChunkRef of the chunk in the file.
+        :param remote_index: RemoteIndex to add the chunk object to.
+        :return: None
+        """
+        with open(file_path, "rb") as chunked_file:
+            chunked_file.seek(chunk.offset)
+            data = chunked_file.read(chunk.length)
+        if hashlib.sha256(data).hexdigest() != chunk.digest:
+            raise ValueError(file_path + " changed while it was being uploaded")
+        with self.metrics.span("upload_chunk", file=file_path, offset=chunk.offset):
+            self.upload_bytes(chunk_object_name(chunk.digest), data, None, remote_index)
+
+    def upload_manifest(self, file_path: str, file_name: str, chunks: list, md5: str, remote_index: RemoteIndex,
+                        chunk_index: ChunkIndex = None):
+        """
+        Store the manifest of a chunked file in place of its content, together with the md5 checksum and size of the
+        content in appProperties. Its chunks must already be in Google Drive.
+
+        :param file_path: str path of the local file.
+        :param file_name: str path relative to the sync folder to store the file under.
+        :param chunks: list of ChunkRef of the file.
+        :param md5: str md5 checksum of the file's content.
+        :param remote_index: RemoteIndex used to look up the existing file and updated with the stored one.
+        :param chunk_index: ChunkIndex caching the manifest, so reading it back costs no request.
+        :return: None
+        """
+        size = sum(chunk.length for chunk in chunks)
+        self.upload_bytes(file_name, manifest_to_bytes(chunks), remote_index.get_file_id(file_name), remote_index,
+                          {CODEC_PROPERTY: CHUNKED_CODEC, CONTENT_MD5_PROPERTY: md5, CONTENT_SIZE_PROPERTY: str(size)})
+        if chunk_index is not None:
+            chunk_index.set_manifest(manifest_key(remote_index.get(file_name)), chunks)
+        self.metrics.emit("upload_progress", file_path, size, size)
+
+    def download_manifest(self, remote_file, chunk_index: ChunkIndex = None) -> list:
+        """
+        :param remote_file: RemoteFile of a chunked file.
+        :param chunk_index: ChunkIndex caching manifests. The manifest is only downloaded if it is not cached there.
+        :return: list of ChunkRef of the file.
+        """
+        chunks = chunk_index.get_manifest(manifest_key(remote_file)) if chunk_index is not None else None
+        if chunks is None:
+            chunks = manifest_from_bytes(self.download_range(remote_file.id))
+            if chunk_index is not None:
+                chunk_index.set_manifest(manifest_key(remote_file), chunks)
+        return chunks
+
+    def download_chunked_file(self, remote_file, file_path: str, remote_index: RemoteIndex,
+                              chunk_index: ChunkIndex = None):
+        """
+        Reassemble a chunked file from its manifest. Chunks found in unchanged local files, e.g. the previous version
+        of the same file, are copied from there; only the others are downloaded, one request each. The result is
+        checked against the md5 checksum of the content and written through a temporary file that is atomically
+        renamed into place.
+
+        :param remote_file: RemoteFile of the chunked file.
+        :param file_path: str path to save the file to.
+        :param remote_index: RemoteIndex holding the chunk objects.
+        :param chunk_index: ChunkIndex of the chunks available locally. It is updated with the chunks of the new file.
+        :return: None
+        """
+        with self.metrics.span("download_chunked_file", file=file_path):
+            chunks = self.download_manifest(remote_file, chunk_index)
+            size = sum(chunk.length for chunk in chunks)
+            file_path_obj = Path(file_path)
+            file_path_obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=str(file_path_obj.parent), prefix="." + file_path_obj.name + ".",
+                                                suffix=PARTIAL_DOWNLOAD_SUFFIX)
+            try:
+                md5_hash = hashlib.md5()
+                with os.fdopen(tmp_fd, "wb") as out:
+                    for chunk in chunks:
+                        self.executor.check_cancelled()
+                        data = chunk_index.read_chunk(chunk.digest) if chunk_index is not None else None
+                        if data is None:
+                            chunk_file_info = remote_index.get_chunk_object(chunk_object_name(chunk.digest))
+                            if chunk_file_info is None:
+                                raise FileNotFoundError("Chunk " + chunk.digest + " of " + file_path + " is missing")
+                            data = self.download_range(chunk_file_info.id)
+                            if hashlib.sha256(data).hexdigest() != chunk.digest:
+                                raise ValueError("Chunk " + chunk.digest + " of " + file_path + " is corrupt")
+                        out.write(data)
+                        md5_hash.update(data)
+                        self.metrics.emit("download_progress", file_path, chunk.offset + chunk.length, size)
+                    if remote_file.md5 is not None and md5_hash.hexdigest() != remote_file.md5:
+                        raise ValueError("Chunked content of " + file_path + " does not match its md5 checksum")
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        if chunk_index is not None:
+            chunk_index.record_file(file_path, chunks)
+
+    def upload_files(self, file_paths: list, remote_index: RemoteIndex):
+        """
+        Upload several files to Google Drive using a remote index built from a single listing, so no per-file lookup
+        queries are sent.
+
+        :param file_paths: list of str that represent paths to the files to upload.
+        :param remote_index: RemoteIndex of Google Drive. It is updated as files are created and updated.
+        :return: None
+        """
+        for file_path in file_paths:
+            self.upload_file(file_path, remote_index)
+
+    def delete_file(self, file_id: str, remote_index: RemoteIndex = None):
         """
         Delete file in Google Drive given file id.
 
         :param file_id: str represents file id of file in Google Drive.
+        :param remote_index: RemoteIndex to remove the deleted file from.
         :return: None
         """
-        self.service.files().delete(fileId=file_id).execute()
+        self.execute(self.service.files().delete(fileId=file_id))
+        if remote_index is not None:
+            remote_index.remove_file_id(file_id)
 
-    def reset_all_files(self):
+    def execute_batch(self, requests: list):
         """
-        Delete all files in this apps Google Drive folder.
+        Send metadata-only requests coalesced into Drive batch requests of up to BATCH_SIZE requests each. Requests
+        that fail inside a batch are retried once on their own, except for 404 errors which cannot succeed on retry.
 
-        :return: None
+        :param requests: list of (str, HttpRequest) tuples. The str key identifies the request in the results.
+        :return: (dict, dict) responses of successful requests and errors of failed requests, both indexed by key.
+        """
+        responses = dict()
+        errors = dict()
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+            else:
+                errors[request_id] = exception
+
+        for start in range(0, len(requests), BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for key, request in requests[start:start + BATCH_SIZE]:
+                batch.add(request, request_id=key)
+            self.call_api("drive.batch", batch.execute)
+
+        requests_by_key = dict(requests)
+        for key, error in list(errors.items()):
+            if isinstance(error, HttpError) and error.resp.status == 404:
+                continue
+            try:
+                self.metrics.record_retry(requests_by_key[key].methodId)
+                responses[key] = self.execute(requests_by_key[key])
+                del errors[key]
+            except Exception as retry_error:
+                errors[key] = retry_error
+
+        return responses, errors
+
+    def delete_files(self, file_ids: list, remote_index: RemoteIndex = None) -> list:
+        """
+        Delete several files in Google Drive using batch requests. Files that no longer exist count as deleted.
+
+        :param file_ids: list of str file ids of files in Google Drive.
+        :param remote_index: RemoteIndex to remove the deleted files from.
+        :return: list of TransferResult, one per file id.
+        """
+        requests = [(file_id, self.service.files().delete(fileId=file_id)) for file_id in file_ids]
+        responses, errors = self.execute_batch(requests)
+
+        results = []
+        for file_id in file_ids:
+            error = errors.get(file_id, None)
+            if isinstance(error, HttpError) and error.resp.status == 404:
+                error = None
+            if error is None and remote_index is not None:
+                remote_index.remove_file_id(file_id)
+            results.append(TransferResult(name=file_id, action="delete_file", success=error is None, error=error))
+        return results
+
+    def create_empty_files(self, file_names: list, remote_index: RemoteIndex = None) -> list:
+        """
+        Create several empty files in Google Drive using batch requests.
+
+        :param file_names: list of str paths relative to the sync folder of the files to create.
+        :param remote_index: RemoteIndex to add the created files to.
+        :return: list of TransferResult, one per file name.
+        """
+        requests = []
+        for file_name in file_names:
+            file_metadata = {"name": base_name(file_name), "parents": [self.ensure_folder(parent_path(file_name))]}
+            requests.append((file_name, self.service.files().create(body=file_metadata, fields=FILE_INFO_FIELDS)))
+        responses, errors = self.execute_batch(requests)
+
+        results = []
+        for file_name in file_names:
+            if file_name in responses and remote_index is not None:
+                remote_index.set_file_info(file_name, responses[file_name])
+            results.append(TransferResult(name=file_name, action="create_empty_file", success=file_name in responses,
+                                          error=errors.get(file_name, None)))
+        return results
+
+    def rename_files(self, renames: list, remote_index: RemoteIndex = None) -> list:
+        """
+        Rename several files in Google Drive using batch requests. Files stay in their folder.
+
+        :param renames: list of (str, str) tuples of file id and new base file name.
+        :param remote_index: RemoteIndex to update with the new names.
+        :return: list of TransferResult, one per file id.
+        """
+        requests = [(file_id, self.service.files().update(fileId=file_id, body={"name": new_name},
+                                                          fields=FILE_INFO_FIELDS))
+                    for file_id, new_name in renames]
+        responses, errors = self.execute_batch(requests)
+
+        results = []
+        for file_id, new_name in renames:
+            if file_id in responses and remote_index is not None:
+                old_name = remote_index.get_file_name(file_id)
+                folder_path = parent_path(old_name) if old_name is not None else ""
+                remote_index.remove_file_id(file_id)
+                remote_index.set_file_info(new_name if folder_path == "" else folder_path + "/" + new_name,
+                                           responses[file_id])
+            results.append(TransferResult(name=file_id, action="rename_file", success=file_id in responses,
+                                          error=errors.get(file_id, None)))
+        return results
+
+    def reset_all_files(self) -> list:
+        """
+        Delete all files and folders in this apps Google Drive folder. Deleting a folder deletes everything in it, so
+        only the top level entries are deleted.
+
+        :return: list of TransferResult, one per deleted file or folder.
         """
-        file_dict = self.get_info_on_files()
-        for file_id in file_dict.keys():
-            self.delete_file(file_id)
+        remote_index = self.build_remote_index()
+        file_ids = [remote_file.id for file_name, remote_file in remote_index.items() if "/" not in file_name]
+        file_ids += [self.folder_cache.get_id(folder_path) for folder_path in self.folder_cache.folder_paths()
+                     if "/" not in folder_path]
+        file_ids += [pack_file.id for pack_name, pack_file in remote_index.pack_object_items()]
+        file_ids += [chunk_file_info.id for chunk_name, chunk_file_info in remote_index.chunk_object_items()]
+        results = self.delete_files(file_ids)
+        self.folder_cache.replace_all({"": self.folder_cache.get_id("")})
+        self.folder_cache.save()
+        return results
 
     def _print_file_id_list(self):
         """
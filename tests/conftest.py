@@ -0,0 +1,37 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+# The modules of Simple-Sync live at the top of the repository.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from drive_backend import FakeDriveBackend
+from fake_drive import FakeDriveStore
+from synchronizer import Synchronizer
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    Fake Google Drive account. The working directory is a temporary folder, so state files that are kept there, e.g.
+    the discovery document cache, do not end up in the repository.
+    """
+    monkeypatch.chdir(tmp_path)
+    return FakeDriveStore()
+
+
+@pytest.fixture
+def make_synchronizer(store, tmp_path):
+    """
+    :return: callable taking a str name and keyword arguments of Synchronizer, returning a Synchronizer of the fake
+    account whose files folder is tmp_path/<name> and whose state is kept in tmp_path/<name>-state. A second call with
+    the same name acts like a restart of the same synchronizer.
+    """
+    def make(name, **synchronizer_options):
+        file_dir_path = tmp_path / name
+        file_dir_path.mkdir(exist_ok=True)
+        return Synchronizer(str(file_dir_path), backend=FakeDriveBackend(store), hash_worker_count=1,
+                            state_dir=tmp_path / (name + "-state"), **synchronizer_options)
+
+    return make
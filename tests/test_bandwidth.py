@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from bandwidth import BandwidthLimiter, RateWindow, TokenBucket
+
+
+class FakeClock:
+    def __init__(self, hour: int = 12):
+        """
+        Monotonic clock and sleep that only move when asked, and a local time of day for rate schedules.
+        """
+        self.now = 0.0
+        self.hour = hour
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def localtime(self) -> time.struct_time:
+        return time.struct_time((2020, 1, 31, self.hour, 0, 0, 4, 31, -1))
+
+
+def new_limiter(clock: FakeClock, **rates) -> BandwidthLimiter:
+    return BandwidthLimiter(clock=clock.localtime, monotonic_clock=clock.monotonic, sleep=clock.sleep, **rates)
+
+
+def test_bucket_allows_a_burst_then_charges_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(1000, clock=clock.monotonic)
+
+    assert bucket.reserve(1000) == 0
+    # A chunk larger than what is left still goes through; its debt is paid back by waiting.
+    assert bucket.reserve(1500) == pytest.approx(1.5)
+    clock.now += 1.5
+    assert bucket.reserve(0) == 0
+    clock.now += 10
+    # Idle time refills the bucket up to one burst, not beyond.
+    assert bucket.reserve(1000) == 0
+    assert bucket.reserve(500) == pytest.approx(0.5)
+
+
+def test_unlimited_bucket_never_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(None, clock=clock.monotonic)
+
+    assert bucket.reserve(10 ** 9) == 0
+
+
+def test_limiter_holds_the_average_rate():
+    clock = FakeClock()
+    limiter = new_limiter(clock, upload_rate=1000)
+    for index in range(20):
+        limiter.acquire("upload", 500)
+
+    # 10000 bytes at 1000 bytes per second, less the first second of burst.
+    assert clock.now == pytest.approx(9.0)
+    assert all(seconds <= 0.5 for seconds in clock.slept)
+    assert limiter.acquire("download", 10 ** 6) == 0
+
+
+def test_total_rate_is_shared_by_both_directions():
+    clock = FakeClock()
+    limiter = new_limiter(clock, total_rate=1000, upload_rate=5000)
+    limiter.acquire("upload", 1000)
+
+    assert limiter.acquire("download", 1000) == pytest.approx(1.0)
+    assert limiter.acquire("upload", 2000) == pytest.approx(2.0)
+
+
+def test_schedule_window_replaces_the_limits():
+    clock = FakeClock(hour=10)
+    limiter = new_limiter(clock, upload_rate=1000, schedule=[RateWindow("09:00", "17:00", upload_rate=100)])
+
+    assert limiter.current_rates() == {"total": None, "upload": 100, "download": None}
+    limiter.acquire("upload", 100)
+    assert limiter.acquire("upload", 100) == pytest.approx(1.0)
+    clock.hour = 20
+    clock.now += 60
+    assert limiter.current_rates()["upload"] == 1000
+    limiter.acquire("upload", 1000)
+    assert limiter.acquire("upload", 1000) == pytest.approx(1.0)
+
+
+def test_window_spanning_midnight():
+    window = RateWindow("22:00", "06:00")
+
+    assert window.contains(23 * 60) and window.contains(5 * 60)
+    assert not window.contains(12 * 60)
+
+
+def test_waiting_checks_for_cancellation():
+    clock = FakeClock()
+    limiter = new_limiter(clock, download_rate=1000)
+    checks = []
+
+    def check_cancelled():
+        checks.append(clock.now)
+        if len(checks) == 3:
+            raise RuntimeError("cancelled")
+
+    limiter.acquire("download", 1000)
+    with pytest.raises(RuntimeError):
+        limiter.acquire("download", 5000, check_cancelled)
+    assert checks == [0.0, 0.5, 1.0]
+
+
+def test_limits_round_trip_through_the_configuration():
+    limiter = BandwidthLimiter.from_dict({"total": 1000, "schedule": [{"start": "09:00", "end": "17:00",
+                                                                       "upload": 250}]})
+
+    assert BandwidthLimiter.from_dict(limiter.to_dict()).to_dict() == limiter.to_dict()
+    with pytest.raises(ValueError):
+        TokenBucket(0)
@@ -0,0 +1,56 @@
+import random
+
+from chunk_store import CHUNK_OBJECT_PREFIX, chunk_file
+
+DEDUP_THRESHOLD = 1024 * 1024
+FILE_SIZE = 4 * 1024 * 1024
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size, "little")
+
+
+def chunk_object_names(store):
+    return set(file["name"] for file in store.files.values() if file["name"].startswith(CHUNK_OBJECT_PREFIX))
+
+
+def test_chunks_survive_an_insertion(tmp_path):
+    data = random_bytes(FILE_SIZE, 1)
+    (tmp_path / "before.bin").write_bytes(data)
+    (tmp_path / "after.bin").write_bytes(data[:1000] + b"inserted" + data[1000:])
+
+    before = chunk_file(tmp_path / "before.bin")
+    after = chunk_file(tmp_path / "after.bin")
+
+    assert len(before) > 4
+    assert sum(chunk.length for chunk in before) == FILE_SIZE
+    # Boundaries depend on the content, so only the chunk holding the insertion changes.
+    assert len(set(chunk.digest for chunk in before) - set(chunk.digest for chunk in after)) == 1
+
+
+def test_edited_file_reuses_unchanged_chunks(store, make_synchronizer, tmp_path):
+    data = bytearray(random_bytes(FILE_SIZE, 2))
+    (tmp_path / "local" / "big.bin").parent.mkdir(parents=True, exist_ok=True)
+    (tmp_path / "local" / "big.bin").write_bytes(data)
+    local = make_synchronizer("local", dedup_threshold=DEDUP_THRESHOLD)
+    local.upload()
+    first_chunk_names = chunk_object_names(store)
+    assert len(first_chunk_names) > 4
+
+    data[FILE_SIZE // 2:FILE_SIZE // 2 + 100] = b"e" * 100
+    (tmp_path / "local" / "big.bin").write_bytes(data)
+    store.reset_counters()
+    local.upload()
+
+    new_chunk_names = chunk_object_names(store) - first_chunk_names
+    assert 1 <= len(new_chunk_names) <= 2
+    assert store.bytes_uploaded < FILE_SIZE // 2
+    # Chunks no longer referenced by any manifest are deleted.
+    assert len(chunk_object_names(store)) == len(chunk_file(tmp_path / "local" / "big.bin"))
+
+    mirror = make_synchronizer("mirror", dedup_threshold=DEDUP_THRESHOLD)
+    mirror.download()
+    assert (tmp_path / "mirror" / "big.bin").read_bytes() == bytes(data)
+    with mirror.open_remote("big.bin") as remote_file:
+        remote_file.seek(FILE_SIZE // 2 - 10)
+        assert remote_file.read(120) == bytes(data[FILE_SIZE // 2 - 10:FILE_SIZE // 2 + 110])
@@ -0,0 +1,110 @@
+import io
+import random
+
+import pytest
+
+from compression import COMPRESSION_CODECS, CompressionPolicy, compress_stream, decompress_stream
+from remote_index import CODEC_PROPERTY, CONTENT_MD5_PROPERTY
+
+TEXT = ("Simple-Sync keeps a folder in sync with Google Drive.\n" * 2000).encode("utf-8")
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size, "little")
+
+
+def stored_file(store, name):
+    files = [file for file in store.files.values() if file["name"] == name]
+    assert len(files) == 1
+    return files[0]
+
+
+@pytest.mark.parametrize("codec", COMPRESSION_CODECS)
+@pytest.mark.parametrize("content", [b"", TEXT, b"\0" * (5 * 1024 * 1024)])
+def test_stream_round_trip(codec, content):
+    compressed = io.BytesIO()
+    md5, size = compress_stream(codec, 6, io.BytesIO(content), compressed)
+    restored = io.BytesIO()
+
+    assert decompress_stream(codec, io.BytesIO(compressed.getvalue()), restored) == (md5, size)
+    assert restored.getvalue() == content
+
+
+def test_truncated_stream_is_refused():
+    compressed = io.BytesIO()
+    compress_stream("gzip", 6, io.BytesIO(TEXT), compressed)
+
+    with pytest.raises(ValueError):
+        decompress_stream("gzip", io.BytesIO(compressed.getvalue()[:-10]), io.BytesIO())
+
+
+def test_policy_skips_incompressible_and_small_files(tmp_path):
+    policy = CompressionPolicy()
+    (tmp_path / "text.dat").write_bytes(TEXT)
+    (tmp_path / "noise.dat").write_bytes(random_bytes(100000, 1))
+
+    assert policy.choose_codec(str(tmp_path / "text.dat"), len(TEXT)) == "gzip"
+    assert policy.choose_codec(str(tmp_path / "noise.dat"), 100000) is None
+    assert policy.choose_codec(str(tmp_path / "photo.jpg"), 100000) is None
+    assert policy.choose_codec(str(tmp_path / "small.txt"), 100) is None
+
+
+def test_unknown_codec_is_refused():
+    with pytest.raises(ValueError):
+        CompressionPolicy(codec="zstd")
+
+
+@pytest.mark.parametrize("codec", COMPRESSION_CODECS)
+def test_compressed_upload_round_trip(store, make_synchronizer, tmp_path, codec):
+    local = make_synchronizer("local", compression=CompressionPolicy(codec))
+    (tmp_path / "local" / "notes.txt").write_bytes(TEXT)
+    local.upload()
+
+    stored = stored_file(store, "notes.txt")
+    assert stored["appProperties"][CODEC_PROPERTY] == codec
+    assert len(stored["content"]) < len(TEXT) // 10
+    mirror = make_synchronizer("mirror")
+    mirror.download()
+    assert (tmp_path / "mirror" / "notes.txt").read_bytes() == TEXT
+    with mirror.open_remote("notes.txt") as remote_file:
+        remote_file.seek(1000)
+        assert remote_file.read(100) == TEXT[1000:1100]
+
+
+def test_incompressible_upload_is_stored_raw(store, make_synchronizer, tmp_path):
+    noise = random_bytes(100000, 2)
+    local = make_synchronizer("local", compression=CompressionPolicy())
+    (tmp_path / "local" / "noise.dat").write_bytes(noise)
+    local.upload()
+
+    stored = stored_file(store, "noise.dat")
+    assert stored["content"] == noise
+    assert CODEC_PROPERTY not in stored["appProperties"]
+
+    # Replacing compressed content with incompressible content drops the codec properties.
+    (tmp_path / "local" / "data.dat").write_bytes(TEXT)
+    local.upload()
+    assert stored_file(store, "data.dat")["appProperties"][CODEC_PROPERTY] == "gzip"
+    (tmp_path / "local" / "data.dat").write_bytes(noise)
+    local.upload()
+    stored = stored_file(store, "data.dat")
+    assert stored["content"] == noise
+    assert stored["appProperties"].get(CODEC_PROPERTY) is None
+    assert stored["appProperties"].get(CONTENT_MD5_PROPERTY) is None
+    mirror = make_synchronizer("mirror")
+    mirror.download()
+    assert (tmp_path / "mirror" / "data.dat").read_bytes() == noise
+
+
+def test_unknown_codec_in_drive_is_not_downloaded(store, make_synchronizer, tmp_path):
+    local = make_synchronizer("local", compression=CompressionPolicy())
+    (tmp_path / "local" / "notes.txt").write_bytes(TEXT)
+    local.upload()
+    stored_file(store, "notes.txt")["appProperties"][CODEC_PROPERTY] = "zstd"
+
+    mirror = make_synchronizer("mirror")
+    with pytest.raises(ValueError):
+        mirror.open_remote("notes.txt")
+    with pytest.raises(ValueError):
+        mirror.download_file("notes.txt")
+    assert not (tmp_path / "mirror" / "notes.txt").exists()
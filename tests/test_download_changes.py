@@ -0,0 +1,72 @@
+from remote_state import RemoteState, REMOTE_STATE_PATH
+
+LIST_FILES = "GET /drive/v3/files"
+LIST_CHANGES = "GET /drive/v3/changes"
+
+
+def write_files(dir_path, files):
+    for file_name, content in files.items():
+        file_path = dir_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content)
+
+
+def read_files(dir_path):
+    return {file_path.relative_to(dir_path).as_posix(): file_path.read_text()
+            for file_path in dir_path.rglob("*") if file_path.is_file()}
+
+
+def test_download_applies_adds_edits_and_deletes(store, make_synchronizer, tmp_path):
+    uploader = make_synchronizer("uploader")
+    write_files(tmp_path / "uploader", {"a.txt": "a", "docs/b.txt": "b", "docs/c.txt": "c"})
+    uploader.upload()
+    mirror = make_synchronizer("mirror")
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == {"a.txt": "a", "docs/b.txt": "b", "docs/c.txt": "c"}
+
+    write_files(tmp_path / "uploader", {"a.txt": "edited", "docs/new.txt": "new"})
+    (tmp_path / "uploader" / "docs" / "b.txt").unlink()
+    uploader.upload()
+    store.reset_counters()
+    mirror.download()
+
+    assert read_files(tmp_path / "mirror") == {"a.txt": "edited", "docs/c.txt": "c", "docs/new.txt": "new"}
+    assert store.request_counts.get(LIST_CHANGES, 0) >= 1
+    assert LIST_FILES not in store.request_counts
+
+
+def test_download_changes_leaves_local_only_files_alone(make_synchronizer, tmp_path):
+    uploader = make_synchronizer("uploader")
+    write_files(tmp_path / "uploader", {"a.txt": "a"})
+    uploader.upload()
+    mirror = make_synchronizer("mirror")
+    mirror.download()
+
+    write_files(tmp_path / "mirror", {"local.txt": "never uploaded"})
+    write_files(tmp_path / "uploader", {"a.txt": "edited"})
+    uploader.upload()
+    mirror.download()
+
+    assert read_files(tmp_path / "mirror") == {"a.txt": "edited", "local.txt": "never uploaded"}
+
+
+def test_changes_cursor_persists_across_restarts(store, make_synchronizer, tmp_path):
+    uploader = make_synchronizer("uploader")
+    write_files(tmp_path / "uploader", {"a.txt": "a", "docs/b.txt": "b"})
+    uploader.upload()
+    make_synchronizer("mirror").download()
+    saved_state = RemoteState(tmp_path / "mirror-state" / REMOTE_STATE_PATH.name)
+    assert saved_state.can_update(tmp_path / "mirror")
+    start_page_token = saved_state.start_page_token
+
+    write_files(tmp_path / "uploader", {"docs/b.txt": "edited"})
+    (tmp_path / "uploader" / "a.txt").unlink()
+    uploader.upload()
+    restarted = make_synchronizer("mirror")
+    assert restarted.remote_state.start_page_token == start_page_token
+    store.reset_counters()
+    restarted.download()
+
+    assert read_files(tmp_path / "mirror") == {"docs/b.txt": "edited"}
+    assert LIST_FILES not in store.request_counts
+    assert RemoteState(tmp_path / "mirror-state" / REMOTE_STATE_PATH.name).start_page_token != start_page_token
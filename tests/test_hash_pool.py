@@ -0,0 +1,56 @@
+import hashlib
+import os
+import random
+
+import hash_pool
+from hash_pool import HashPool, MMAP_THRESHOLD, hash_file, plan_batches
+
+FILE_SIZES = {"empty.bin": 0, "small.bin": 1000, "below_mmap.bin": MMAP_THRESHOLD - 1, "mmap.bin": MMAP_THRESHOLD,
+              "large.bin": MMAP_THRESHOLD + 12345}
+
+
+def make_files(dir_path) -> dict:
+    """
+    :return: dict of str path of every file written by its hashlib md5.
+    """
+    generator = random.Random(1)
+    md5s = dict()
+    for file_name, size in FILE_SIZES.items():
+        content = generator.getrandbits(8 * size).to_bytes(size, "little") if size else b""
+        (dir_path / file_name).write_bytes(content)
+        md5s[str(dir_path / file_name)] = hashlib.md5(content).hexdigest()
+    return md5s
+
+
+def test_hash_file_matches_hashlib_on_both_paths(tmp_path, monkeypatch):
+    md5s = make_files(tmp_path)
+    # Several slices of the memory map per file.
+    monkeypatch.setattr(hash_pool, "MMAP_SLICE_SIZE", 1024 * 1024)
+
+    for file_path, md5 in md5s.items():
+        size, mtime_ns, file_md5 = hash_file(file_path)
+        assert file_md5 == md5
+        assert size == os.stat(file_path).st_size
+        assert mtime_ns == os.stat(file_path).st_mtime_ns
+
+
+def test_pool_matches_hashing_in_process(tmp_path, monkeypatch):
+    md5s = make_files(tmp_path)
+    file_sizes = [(file_path, os.path.getsize(file_path)) for file_path in md5s]
+    # One file per task, so the work is spread over the worker processes.
+    monkeypatch.setattr(hash_pool, "BATCH_FILE_COUNT", 1)
+    assert len(plan_batches(file_sizes)) == len(file_sizes)
+
+    in_process = list(HashPool(worker_count=1).iter_hashes(file_sizes))
+    pooled = list(HashPool(worker_count=2, min_pool_bytes=0).iter_hashes(file_sizes))
+
+    assert sorted(pooled) == sorted(in_process)
+    assert {file_path: md5 for file_path, size, mtime_ns, md5 in pooled} == md5s
+    # Hashed in the calling process, results come back smallest file first.
+    assert [os.path.basename(result[0]) for result in in_process] == list(FILE_SIZES)
+
+
+def test_unreadable_files_have_no_hash(tmp_path):
+    missing_path = str(tmp_path / "missing.bin")
+
+    assert list(HashPool(worker_count=1).iter_hashes([(missing_path, 10)])) == [(missing_path, None, None, None)]
@@ -0,0 +1,122 @@
+import pytest
+
+from pack_store import PackIndex, PackMember, PACK_OBJECT_PREFIX, PACK_INDEX_NAME
+
+PACK_THRESHOLD = 4096
+
+
+def write_files(dir_path, files):
+    for file_name, content in files.items():
+        file_path = dir_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(content)
+
+
+def read_files(dir_path):
+    return {file_path.relative_to(dir_path).as_posix(): file_path.read_bytes()
+            for file_path in dir_path.rglob("*") if file_path.is_file()}
+
+
+def pack_object_names(store):
+    return sorted(file["name"] for file in store.files.values()
+                  if file["name"].startswith(PACK_OBJECT_PREFIX) and file["name"] != PACK_INDEX_NAME)
+
+
+def test_pack_index_round_trip(tmp_path):
+    pack_index = PackIndex(tmp_path / "pack_index.json")
+    pack_index.add_pack("pack-a", 30, [("a.txt", PackMember("pack-a", 0, 10, "md5-a")),
+                                       ("docs/b.txt", PackMember("pack-a", 10, 20, "md5-b"))])
+    pack_index.add_pack("pack-b", 0, [("empty.txt", PackMember("pack-b", 0, 0, "md5-empty"))])
+
+    loaded = PackIndex(tmp_path / "other.json")
+    loaded.load_bytes(pack_index.to_bytes(), "remote-md5")
+
+    assert loaded.to_dict() == pack_index.to_dict()
+    assert loaded.get("docs/b.txt") == PackMember("pack-a", 10, 20, "md5-b")
+    assert loaded.remote_md5 == "remote-md5"
+    pack_index.save()
+    saved = PackIndex(tmp_path / "pack_index.json")
+    saved.read_state()
+    assert saved.items() == pack_index.items()
+
+
+def test_small_files_are_packed_and_read_back(store, make_synchronizer, tmp_path):
+    files = {"a.txt": b"a" * 100, "docs/b.txt": b"b" * 200, "big.bin": b"x" * (PACK_THRESHOLD * 2)}
+    write_files(tmp_path / "local", files)
+    make_synchronizer("local", pack_threshold=PACK_THRESHOLD).upload()
+    assert len(pack_object_names(store)) == 1
+
+    mirror = make_synchronizer("mirror", pack_threshold=PACK_THRESHOLD)
+    mirror.download_file("docs/b.txt")
+    assert (tmp_path / "mirror" / "docs" / "b.txt").read_bytes() == files["docs/b.txt"]
+    with mirror.open_remote("a.txt") as remote_file:
+        assert remote_file.read(10) == b"a" * 10
+        remote_file.seek(95)
+        assert remote_file.read() == b"a" * 5
+    with pytest.raises(FileNotFoundError):
+        mirror.download_file("missing.txt")
+    assert not (tmp_path / "mirror" / "missing.txt").exists()
+
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == files
+
+
+def test_mostly_dead_pack_is_rewritten(store, make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", {"f%d.txt" % index: b"%d" % index * 1000 for index in range(10)})
+    local = make_synchronizer("local", pack_threshold=PACK_THRESHOLD)
+    local.upload()
+    old_pack_names = pack_object_names(store)
+
+    for index in range(6):
+        (tmp_path / "local" / ("f%d.txt" % index)).unlink()
+    local.upload()
+
+    new_pack_names = pack_object_names(store)
+    assert len(new_pack_names) == 1 and new_pack_names != old_pack_names
+    assert local.pack_index.pack_size(new_pack_names[0]) == 4000
+    mirror = make_synchronizer("mirror", pack_threshold=PACK_THRESHOLD)
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == read_files(tmp_path / "local")
+
+
+def test_small_packs_are_merged(store, make_synchronizer, tmp_path):
+    local = make_synchronizer("local", pack_threshold=PACK_THRESHOLD)
+    for file_name in ("a.txt", "b.txt", "c.txt"):
+        write_files(tmp_path / "local", {file_name: file_name.encode() * 100})
+        local.upload()
+        assert len(pack_object_names(store)) == 1
+
+    pack_name = pack_object_names(store)[0]
+    assert sorted(file_name for file_name, member in local.pack_index.members_of(pack_name)) == \
+        ["a.txt", "b.txt", "c.txt"]
+    mirror = make_synchronizer("mirror", pack_threshold=PACK_THRESHOLD)
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == read_files(tmp_path / "local")
+
+
+def test_pack_of_empty_files_is_kept(store, make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", {"empty.txt": b""})
+    local = make_synchronizer("local", pack_threshold=PACK_THRESHOLD)
+    local.upload()
+    local.upload()
+
+    assert local.pack_index.get("empty.txt") is not None
+    mirror = make_synchronizer("mirror", pack_threshold=PACK_THRESHOLD)
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == {"empty.txt": b""}
+
+
+def test_empty_file_survives_deleting_its_pack_neighbour(store, make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", {"empty.txt": b"", "full.txt": b"f" * 1000})
+    local = make_synchronizer("local", pack_threshold=PACK_THRESHOLD)
+    local.upload()
+
+    (tmp_path / "local" / "full.txt").unlink()
+    local.upload()
+    local.upload()
+
+    assert local.pack_index.names() == ["empty.txt"]
+    assert len(pack_object_names(store)) == 1
+    mirror = make_synchronizer("mirror", pack_threshold=PACK_THRESHOLD)
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == {"empty.txt": b""}
@@ -0,0 +1,70 @@
+import io
+
+from remote_reader import BlockCache, RangeSource, RemoteFileReader
+
+BLOCK_SIZE = 16
+CONTENT = bytes(range(100))
+
+
+class FakeDriveApi:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.reads = []
+
+    def download_range(self, file_id: str, start: int = 0, length: int = None) -> bytes:
+        self.reads.append((start, length))
+        return self.content[start:start + length if length is not None else None]
+
+
+def open_reader(tmp_path, drive_api, cache=None, content_key="content-1", max_readahead=BLOCK_SIZE * 4):
+    cache = cache if cache is not None else BlockCache(BLOCK_SIZE, disk_budget=0, cache_path=tmp_path / "blocks")
+    return RemoteFileReader("file.bin", len(drive_api.content), content_key, RangeSource(drive_api, "file-id"), cache,
+                            max_readahead)
+
+
+def test_read_crosses_block_boundaries(tmp_path):
+    drive_api = FakeDriveApi(CONTENT)
+    with open_reader(tmp_path, drive_api) as reader:
+        reader.seek(10)
+        assert reader.read(40) == CONTENT[10:50]
+        assert reader.tell() == 50
+        reader.seek(-5, io.SEEK_CUR)
+        assert reader.read(20) == CONTENT[45:65]
+
+
+def test_read_past_end_of_file(tmp_path):
+    drive_api = FakeDriveApi(CONTENT)
+    with open_reader(tmp_path, drive_api) as reader:
+        reader.seek(95)
+        assert reader.read(100) == CONTENT[95:]
+        assert reader.read(10) == b""
+        reader.seek(500)
+        assert reader.read() == b""
+        reader.seek(-20, io.SEEK_END)
+        assert reader.read() == CONTENT[80:]
+    # Nothing beyond the content is requested.
+    assert all(start + length <= len(CONTENT) for start, length in drive_api.reads)
+
+
+def test_sequential_reads_grow_the_readahead(tmp_path):
+    drive_api = FakeDriveApi(CONTENT)
+    with open_reader(tmp_path, drive_api) as reader:
+        assert reader.read() == CONTENT
+    assert drive_api.reads == [(0, 16), (16, 32), (48, 52)]
+
+
+def test_cached_blocks_are_not_fetched_again(tmp_path):
+    drive_api = FakeDriveApi(CONTENT)
+    cache = BlockCache(BLOCK_SIZE, disk_budget=0, cache_path=tmp_path / "blocks")
+    with open_reader(tmp_path, drive_api, cache) as reader:
+        reader.read(40)
+    read_count = len(drive_api.reads)
+
+    with open_reader(tmp_path, drive_api, cache) as reader:
+        reader.seek(20)
+        assert reader.read(20) == CONTENT[20:40]
+    assert len(drive_api.reads) == read_count
+    # A new version of the content has a new key and is fetched again.
+    with open_reader(tmp_path, drive_api, cache, content_key="content-2") as reader:
+        assert reader.read(20) == CONTENT[:20]
+    assert len(drive_api.reads) > read_count
@@ -0,0 +1,139 @@
+import json
+import threading
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import request_executor
+from metrics import Metrics
+from request_executor import RequestExecutor, SyncCancelled, DECREASE_FACTOR
+
+
+def http_error(status: int, reason: str = None, headers=None) -> HttpError:
+    response = httplib2.Response(dict(headers or {}, status=status))
+    content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}] if reason else []}})
+    return HttpError(response, content.encode("utf-8"))
+
+
+class FlakyCall:
+    def __init__(self, errors):
+        """
+        Drive api call failing with the given errors, one per call, and succeeding once they are used up.
+        """
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+def new_executor(**executor_options):
+    executor = RequestExecutor(metrics=Metrics(), base_delay=0.001, max_delay=0.01, **executor_options)
+    executor.random.seed(1)
+    return executor
+
+
+def test_retryable_errors_are_retried_until_success():
+    executor = new_executor(max_concurrency=4)
+    call = FlakyCall([http_error(503), http_error(500), ConnectionError("reset")])
+
+    assert executor.call("drive.files.list", call) == "done"
+    assert call.calls == 4
+    assert executor.metrics.retries == {"drive.files.list": 3}
+    # Server errors are not throttling; the limits stay where they were.
+    assert executor.concurrency_limit == 4
+    assert executor.rate_limit is None
+
+
+def test_other_errors_are_raised_at_once():
+    executor = new_executor()
+    call = FlakyCall([http_error(404)])
+
+    with pytest.raises(HttpError):
+        executor.call("drive.files.get", call)
+    assert call.calls == 1
+
+
+def test_retries_give_up_after_max_retries():
+    executor = new_executor(max_retries=2)
+    call = FlakyCall([http_error(503)] * 5)
+
+    with pytest.raises(HttpError):
+        executor.call("drive.files.get", call)
+    assert call.calls == 3
+
+
+def test_backoff_is_jittered_exponential_and_honours_retry_after():
+    executor = RequestExecutor(base_delay=1.0, max_delay=64.0)
+    executor.random.seed(1)
+    error = http_error(503)
+    for attempt in range(10):
+        delays = [executor.backoff_delay(attempt, error) for index in range(50)]
+        assert all(0 <= delay <= min(64.0, 2 ** attempt) for delay in delays)
+        assert len(set(delays)) > 1
+    assert executor.backoff_delay(0, http_error(429, headers={"retry-after": "5"})) >= 5.0
+    assert executor.backoff_delay(0, http_error(429, headers={"retry-after": "600"})) <= 64.0
+
+
+def test_throttling_cuts_concurrency_and_successes_restore_it():
+    executor = new_executor(max_concurrency=8)
+    call = FlakyCall([http_error(429), http_error(403, "userRateLimitExceeded")])
+
+    assert executor.call("drive.files.create", call) == "done"
+    assert executor.metrics.throttles == {"drive.files.create": 2}
+    # The second error came from a call started after the first decrease, so both cut the limit.
+    lowest = 8 * DECREASE_FACTOR * DECREASE_FACTOR
+    assert lowest < executor.concurrency_limit < lowest + 1
+    assert executor.rate_limit is not None
+    assert executor.metrics.gauges["request_concurrency_limit"] == int(executor.concurrency_limit)
+
+    successes = 0
+    while executor.concurrency_limit < 8:
+        executor.on_success()
+        successes += 1
+    assert successes < 50
+    assert executor.concurrency_limit == 8
+
+
+def test_throttling_of_calls_sent_under_the_old_limits_counts_once():
+    executor = new_executor(max_concurrency=10)
+    start_times = [executor.acquire() for index in range(3)]
+    for start_time in start_times:
+        executor.release()
+        executor.on_throttle("drive.files.get", start_time)
+
+    assert executor.concurrency_limit == pytest.approx(10 * DECREASE_FACTOR)
+
+
+def test_calls_wait_for_the_concurrency_limit(monkeypatch):
+    # Keep the rate limit set by throttling high, so only the concurrency limit makes calls wait.
+    monkeypatch.setattr(request_executor, "MIN_RATE", 1000.0)
+    executor = new_executor(max_concurrency=4)
+    executor.on_throttle("drive.files.get", executor.acquire())
+    executor.release()
+    assert int(executor.concurrency_limit) == 2
+    executor.acquire()
+    executor.acquire()
+
+    waiting = threading.Thread(target=executor.acquire)
+    waiting.start()
+    waiting.join(0.2)
+    assert waiting.is_alive()
+    executor.release()
+    waiting.join(5)
+    assert not waiting.is_alive()
+    assert executor.in_flight == 2
+
+
+def test_cancel_stops_retries():
+    executor = RequestExecutor(base_delay=30.0, max_delay=30.0)
+    call = FlakyCall([http_error(503)] * 5)
+    threading.Timer(0.1, executor.cancel).start()
+
+    with pytest.raises(SyncCancelled):
+        executor.call("drive.files.get", call)
+    assert call.calls == 1
@@ -0,0 +1,69 @@
+from selective_sync import SelectiveSync, SELECTIVE_SYNC_PATH
+
+FILES = {"docs/a.txt": "a", "docs/b.txt": "b", "photos/p.jpg": "p", "notes.txt": "n"}
+
+
+def write_files(dir_path, files):
+    for file_name, content in files.items():
+        file_path = dir_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content)
+
+
+def read_files(dir_path):
+    return {file_path.relative_to(dir_path).as_posix(): file_path.read_text()
+            for file_path in dir_path.rglob("*") if file_path.is_file()}
+
+
+def test_wants_matches_patterns_and_accessed_files(tmp_path):
+    selective_sync = SelectiveSync(["docs/*"], tmp_path / "selective_sync.json")
+    selective_sync.record_access("notes.txt")
+    selective_sync.save()
+
+    restored = SelectiveSync(state_path=tmp_path / "selective_sync.json")
+    assert restored.wants("docs/a.txt")
+    assert restored.wants("notes.txt")
+    assert not restored.wants("photos/p.jpg")
+    restored.forget("notes.txt")
+    assert not restored.wants("notes.txt")
+
+
+def test_download_skips_files_outside_the_patterns(make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", FILES)
+    make_synchronizer("local").upload()
+
+    mirror = make_synchronizer("mirror", selective_patterns=["docs/*"])
+    mirror.download()
+
+    assert read_files(tmp_path / "mirror") == {"docs/a.txt": "a", "docs/b.txt": "b"}
+    assert (tmp_path / "mirror-state" / SELECTIVE_SYNC_PATH.name).is_file()
+    # A skipped file is left in Google Drive by the next upload.
+    mirror.upload()
+    assert set(mirror.get_drive_file_names()) == set(FILES)
+
+
+def test_opened_file_is_brought_in_by_the_next_download(make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", FILES)
+    make_synchronizer("local").upload()
+    mirror = make_synchronizer("mirror", selective_patterns=["docs/*"])
+    mirror.download()
+
+    with mirror.open_remote("notes.txt") as remote_file:
+        assert remote_file.read() == b"n"
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == {"docs/a.txt": "a", "docs/b.txt": "b", "notes.txt": "n"}
+
+    mirror.evict_file("notes.txt")
+    mirror.download()
+    assert read_files(tmp_path / "mirror") == {"docs/a.txt": "a", "docs/b.txt": "b"}
+    assert set(mirror.get_drive_file_names()) == set(FILES)
+
+
+def test_excluded_files_are_never_downloaded(make_synchronizer, tmp_path):
+    write_files(tmp_path / "local", FILES)
+    make_synchronizer("local").upload()
+
+    mirror = make_synchronizer("mirror", selective_patterns=["*"], exclude=["photos/*"])
+    mirror.download()
+
+    assert read_files(tmp_path / "mirror") == {"docs/a.txt": "a", "docs/b.txt": "b", "notes.txt": "n"}
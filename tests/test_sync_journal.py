@@ -0,0 +1,93 @@
+import sync_journal
+from sync_journal import SyncJournal, SYNC_JOURNAL_PATH
+
+OPERATIONS = [("delete", "a.txt", "id-a"), ("delete", "b.txt", "id-b"), ("upload", "c.txt", None)]
+
+
+def test_interrupted_pass_resumes_with_the_operations_left(tmp_path):
+    journal = SyncJournal(tmp_path / "journal.db")
+    journal.begin("upload", tmp_path, OPERATIONS, detail="snapshot")
+    journal.complete("delete", "a.txt")
+    journal.suspend()
+    journal.close()
+
+    restarted = SyncJournal(tmp_path / "journal.db")
+    detail, operations = restarted.resume("upload", tmp_path)
+
+    assert detail == "snapshot"
+    assert sorted(operations) == [("delete", "b.txt", "id-b"), ("upload", "c.txt", None)]
+    assert restarted.pending_count() == 2
+
+
+def test_unflushed_completions_are_replayed(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_journal, "FLUSH_SECONDS", 3600.0)
+    journal = SyncJournal(tmp_path / "journal.db")
+    journal.begin("upload", tmp_path, OPERATIONS)
+    journal.complete("delete", "a.txt")
+
+    # A crash loses the completions that were not flushed; the operation is replayed.
+    detail, operations = SyncJournal(tmp_path / "journal.db").resume("upload", tmp_path)
+    assert len(operations) == 3
+
+
+def test_passes_are_kept_per_kind_and_folder(tmp_path):
+    journal = SyncJournal(tmp_path / "journal.db")
+    journal.begin("upload", tmp_path / "one", OPERATIONS[:1])
+    journal.begin("upload", tmp_path / "two", OPERATIONS[1:2])
+    journal.begin("sync", tmp_path / "one", OPERATIONS[2:])
+    journal.begin("upload", tmp_path / "one", OPERATIONS[1:])
+
+    assert sorted(journal.resume("upload", tmp_path / "one")[1]) == sorted(OPERATIONS[1:])
+    assert journal.resume("upload", tmp_path / "two")[1] == OPERATIONS[1:2]
+    assert journal.resume("sync", tmp_path / "one")[1] == OPERATIONS[2:]
+    assert journal.resume("download", tmp_path / "one") is None
+
+
+def test_finished_pass_is_not_resumed(tmp_path):
+    journal = SyncJournal(tmp_path / "journal.db")
+    journal.begin("upload", tmp_path, OPERATIONS)
+    for action, name, argument in OPERATIONS:
+        journal.complete(action, name)
+    journal.finish()
+
+    assert journal.pending_count() == 0
+    assert SyncJournal(tmp_path / "journal.db").resume("upload", tmp_path) is None
+
+
+def test_journal_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_journal, "FLUSH_COUNT", 100)
+    monkeypatch.setattr(sync_journal, "COMPACT_COUNT", 1000)
+    journal_path = tmp_path / "journal.db"
+    journal = SyncJournal(journal_path)
+    operations = [("delete", "file%05d.txt" % index, "x" * 200) for index in range(3000)]
+    journal.begin("upload", tmp_path, operations)
+    journal.compact()
+    full_size = journal_path.stat().st_size
+    for action, name, argument in operations[:2000]:
+        journal.complete(action, name)
+
+    assert journal.completed_since_compact == 0
+    assert journal_path.with_name(journal_path.name + "-wal").stat().st_size == 0
+    assert journal.connect().execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert journal_path.stat().st_size < full_size
+    assert journal.pending_count() == 1000
+
+
+def test_upload_resumes_deletions_then_uploads(store, make_synchronizer, tmp_path):
+    uploader = make_synchronizer("local")
+    for file_name in ("keep.txt", "old.txt"):
+        (tmp_path / "local" / file_name).write_text(file_name)
+    uploader.upload()
+    old_id = uploader.get_remote_index().get("old.txt").id
+
+    # The upload that deleted old.txt was interrupted before sending the deletion.
+    (tmp_path / "local" / "old.txt").unlink()
+    journal = SyncJournal(tmp_path / "local-state" / SYNC_JOURNAL_PATH.name)
+    journal.begin("upload", tmp_path / "local", [("delete", "old.txt", old_id)])
+    journal.close()
+    (tmp_path / "local" / "new.txt").write_text("new.txt")
+    restarted = make_synchronizer("local")
+    restarted.upload()
+
+    assert set(restarted.get_drive_file_names()) == {"keep.txt", "new.txt"}
+    assert restarted.journal.resume("upload", tmp_path / "local") is None
@@ -0,0 +1,147 @@
+from sync_planner import SyncSnapshot, conflict_name, plan_sync
+
+STAMP = "2020-01-31 120000"
+
+
+def make_snapshot(tmp_path, files=None, folders=()):
+    snapshot = SyncSnapshot(tmp_path / "sync_snapshot.json")
+    snapshot.files = dict(files or {})
+    snapshot.folders = set(folders)
+    return snapshot
+
+
+def plan(tmp_path, local_files, remote_files, snapshot_files=None, local_folders=(), remote_folders=(),
+         snapshot_folders=(), skipped_names=()):
+    return plan_sync(local_files, set(local_folders), remote_files, set(remote_folders),
+                     make_snapshot(tmp_path, snapshot_files, snapshot_folders), STAMP, skipped_names)
+
+
+def test_first_sync_merges_both_sides_without_deleting(tmp_path):
+    sync_plan = plan(tmp_path, {"local.txt": "l", "same.txt": "s"}, {"remote.txt": "r", "same.txt": "s"})
+
+    assert sync_plan.uploads == ["local.txt"]
+    assert sync_plan.downloads == ["remote.txt"]
+    assert not (sync_plan.local_deletes or sync_plan.remote_deletes or sync_plan.conflicts)
+    assert sync_plan.snapshot_files == {"local.txt": "l", "remote.txt": "r", "same.txt": "s"}
+
+
+def test_unchanged_files_need_nothing(tmp_path):
+    sync_plan = plan(tmp_path, {"a.txt": "a"}, {"a.txt": "a"}, {"a.txt": "a"})
+
+    assert sync_plan.is_empty()
+    assert sync_plan.snapshot_files == {"a.txt": "a"}
+
+
+def test_change_on_one_side_is_copied_to_the_other(tmp_path):
+    sync_plan = plan(tmp_path, {"local.txt": "l2", "remote.txt": "r"}, {"local.txt": "l", "remote.txt": "r2"},
+                     {"local.txt": "l", "remote.txt": "r"})
+
+    assert sync_plan.uploads == ["local.txt"]
+    assert sync_plan.downloads == ["remote.txt"]
+    assert sync_plan.snapshot_files == {"local.txt": "l2", "remote.txt": "r2"}
+
+
+def test_delete_on_one_side_is_applied_to_the_other(tmp_path):
+    sync_plan = plan(tmp_path, {"remote_deleted.txt": "r"}, {"local_deleted.txt": "l"},
+                     {"local_deleted.txt": "l", "remote_deleted.txt": "r"})
+
+    assert sync_plan.remote_deletes == ["local_deleted.txt"]
+    assert sync_plan.local_deletes == ["remote_deleted.txt"]
+    assert sync_plan.snapshot_files == {}
+
+
+def test_both_sides_changed_is_a_conflict(tmp_path):
+    sync_plan = plan(tmp_path, {"docs/a.txt": "local"}, {"docs/a.txt": "remote"}, {"docs/a.txt": "base"})
+
+    copy_name = "docs/a (conflict %s).txt" % STAMP
+    assert sync_plan.conflicts == [("docs/a.txt", copy_name)]
+    assert sync_plan.downloads == ["docs/a.txt"]
+    assert sync_plan.uploads == [copy_name]
+    assert sync_plan.snapshot_files == {"docs/a.txt": "remote", copy_name: "local"}
+
+
+def test_conflict_name_skips_names_in_use(tmp_path):
+    first_name = conflict_name("a.txt", STAMP, ())
+    sync_plan = plan(tmp_path, {"a.txt": "local", first_name: "x"}, {"a.txt": "remote", first_name: "x"},
+                     {"a.txt": "base", first_name: "x"})
+
+    assert sync_plan.conflicts == [("a.txt", "a (conflict %s 2).txt" % STAMP)]
+
+
+def test_both_sides_changed_the_same_way_is_no_conflict(tmp_path):
+    sync_plan = plan(tmp_path, {"a.txt": "new"}, {"a.txt": "new"}, {"a.txt": "base"})
+
+    assert sync_plan.is_empty()
+    assert sync_plan.snapshot_files == {"a.txt": "new"}
+
+
+def test_edit_wins_over_delete(tmp_path):
+    sync_plan = plan(tmp_path, {"local_edit.txt": "l2"}, {"remote_edit.txt": "r2"},
+                     {"local_edit.txt": "l", "remote_edit.txt": "r"})
+
+    assert sync_plan.uploads == ["local_edit.txt"]
+    assert sync_plan.downloads == ["remote_edit.txt"]
+    assert not (sync_plan.local_deletes or sync_plan.remote_deletes or sync_plan.conflicts)
+    assert sync_plan.snapshot_files == {"local_edit.txt": "l2", "remote_edit.txt": "r2"}
+
+
+def test_deleted_on_both_sides_is_dropped(tmp_path):
+    sync_plan = plan(tmp_path, {}, {}, {"gone.txt": "g"}, snapshot_folders=("old",))
+
+    assert sync_plan.is_empty()
+    assert sync_plan.snapshot_files == {}
+    assert sync_plan.snapshot_folders == set()
+
+
+def test_deleted_folder_goes_with_its_files(tmp_path):
+    sync_plan = plan(tmp_path, {}, {"docs/a.txt": "a", "docs/sub/b.txt": "b"},
+                     {"docs/a.txt": "a", "docs/sub/b.txt": "b"}, remote_folders=("docs", "docs/sub"),
+                     snapshot_folders=("docs", "docs/sub"))
+
+    assert sync_plan.remote_folder_deletes == ["docs"]
+    assert sync_plan.remote_deletes == []
+
+
+def test_deleted_folder_is_recreated_for_a_new_file(tmp_path):
+    sync_plan = plan(tmp_path, {}, {"docs/a.txt": "a", "docs/new.txt": "n"}, {"docs/a.txt": "a"},
+                     remote_folders=("docs",), snapshot_folders=("docs",))
+
+    assert sync_plan.local_folder_creates == ["docs"]
+    assert sync_plan.remote_folder_deletes == []
+    assert sync_plan.remote_deletes == ["docs/a.txt"]
+    assert sync_plan.downloads == ["docs/new.txt"]
+
+
+def test_skipped_files_are_left_alone(tmp_path):
+    sync_plan = plan(tmp_path, {}, {"big/video.mp4": "v"}, {"big/video.mp4": "v"}, remote_folders=("big",),
+                     snapshot_folders=("big",), skipped_names={"big/video.mp4"})
+
+    assert not (sync_plan.uploads or sync_plan.downloads or sync_plan.local_deletes or sync_plan.remote_deletes)
+    assert sync_plan.remote_folder_deletes == []
+    # The folder holding a skipped file is kept on both sides.
+    assert sync_plan.local_folder_creates == ["big"]
+    assert sync_plan.snapshot_files == {"big/video.mp4": "v"}
+
+
+def test_sync_applies_the_plan_in_both_directions(store, make_synchronizer, tmp_path):
+    local = make_synchronizer("local")
+    (tmp_path / "local" / "both.txt").write_text("base")
+    (tmp_path / "local" / "delete_me.txt").write_text("old")
+    local.sync()
+    other = make_synchronizer("other")
+    other.download()
+
+    (tmp_path / "local" / "both.txt").write_text("local")
+    (tmp_path / "local" / "delete_me.txt").unlink()
+    (tmp_path / "other" / "both.txt").write_text("remote")
+    other.upload()
+    sync_plan = local.sync()
+
+    assert len(sync_plan.conflicts) == 1
+    file_name, copy_name = sync_plan.conflicts[0]
+    assert file_name == "both.txt" and copy_name.startswith("both (conflict ")
+    assert sync_plan.remote_deletes == ["delete_me.txt"]
+    assert (tmp_path / "local" / "both.txt").read_text() == "remote"
+    assert (tmp_path / "local" / copy_name).read_text() == "local"
+    assert set(local.get_drive_file_names()) == {"both.txt", copy_name}
+    assert local.sync().is_empty()
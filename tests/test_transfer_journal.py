@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from synchronizer import GoogleDriveApiHandler
+from transfer_scheduler import TransferError
+
+CHUNK_SIZE = 256 * 1024
+CONTENT = random.Random(1).getrandbits(8 * (5 * CHUNK_SIZE + 1000)).to_bytes(5 * CHUNK_SIZE + 1000, "little")
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, method_name: str, call_count: int):
+    """
+    Make a method of GoogleDriveApiHandler raise Interrupted once it was called call_count times, like a process that
+    dies halfway through a transfer.
+    """
+    method = getattr(GoogleDriveApiHandler, method_name)
+    calls = []
+
+    def interrupted(self, *args, **kwargs):
+        if len(calls) == call_count:
+            raise Interrupted()
+        calls.append(args)
+        return method(self, *args, **kwargs)
+
+    monkeypatch.setattr(GoogleDriveApiHandler, method_name, interrupted)
+
+
+def test_interrupted_download_resumes_from_its_offset(store, make_synchronizer, tmp_path, monkeypatch):
+    local = make_synchronizer("local", chunk_size=CHUNK_SIZE)
+    (tmp_path / "local" / "data.bin").write_bytes(CONTENT)
+    local.upload()
+
+    mirror = make_synchronizer("mirror", chunk_size=CHUNK_SIZE)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, "_download_chunk", 2)
+        with pytest.raises(Interrupted):
+            mirror.download_file("data.bin")
+    assert not (tmp_path / "mirror" / "data.bin").exists()
+
+    store.bytes_downloaded = 0
+    restarted = make_synchronizer("mirror", chunk_size=CHUNK_SIZE)
+    restarted.download_file("data.bin")
+    assert (tmp_path / "mirror" / "data.bin").read_bytes() == CONTENT
+    # Only the bytes after the two chunks written before the interruption are downloaded again.
+    assert store.bytes_downloaded == len(CONTENT) - 2 * CHUNK_SIZE
+    assert [path.name for path in (tmp_path / "mirror").iterdir()] == ["data.bin"]
+    assert restarted.drive_api.journal.get_download(str(tmp_path / "mirror" / "data.bin")) is None
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK_SIZE, 2 * CHUNK_SIZE + 1])
+def test_download_chunk_boundaries(store, make_synchronizer, tmp_path, size):
+    local = make_synchronizer("local", chunk_size=CHUNK_SIZE)
+    (tmp_path / "local" / "data.bin").write_bytes(CONTENT[:size])
+    local.upload()
+
+    mirror = make_synchronizer("mirror", chunk_size=CHUNK_SIZE)
+    mirror.download_file("data.bin")
+    assert (tmp_path / "mirror" / "data.bin").read_bytes() == CONTENT[:size]
+
+
+def interrupted_upload(store, make_synchronizer, tmp_path, monkeypatch):
+    """
+    Upload CONTENT in chunks and interrupt the upload right after Google Drive received its third chunk, before the
+    third chunk was journaled.
+
+    :return: str path of the uploaded file.
+    """
+    local = make_synchronizer("local", chunk_size=CHUNK_SIZE)
+    (tmp_path / "local" / "data.bin").write_bytes(CONTENT)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, "throttle", 2)
+        # A failed transfer does not stop the others, the pass reports it once they are done.
+        with pytest.raises(TransferError):
+            local.upload()
+    assert len(store.sessions) == 1
+    assert not any(file["name"] == "data.bin" for file in store.files.values())
+    return str(tmp_path / "local" / "data.bin")
+
+
+def stored_content(store):
+    return [file["content"] for file in store.files.values() if file["name"] == "data.bin"]
+
+
+def test_interrupted_upload_resumes_from_what_google_drive_received(store, make_synchronizer, tmp_path, monkeypatch):
+    file_path = interrupted_upload(store, make_synchronizer, tmp_path, monkeypatch)
+    assert make_synchronizer("local").drive_api.journal.get_upload(file_path)["offset"] == 2 * CHUNK_SIZE
+
+    store.bytes_uploaded = 0
+    restarted = make_synchronizer("local", chunk_size=CHUNK_SIZE)
+    restarted.upload()
+    assert stored_content(store) == [CONTENT]
+    assert store.bytes_uploaded == len(CONTENT) - 3 * CHUNK_SIZE
+    assert restarted.drive_api.journal.get_upload(file_path) is None
+
+
+def test_expired_upload_session_starts_over(store, make_synchronizer, tmp_path, monkeypatch):
+    file_path = interrupted_upload(store, make_synchronizer, tmp_path, monkeypatch)
+    store.sessions.clear()
+
+    store.bytes_uploaded = 0
+    restarted = make_synchronizer("local", chunk_size=CHUNK_SIZE)
+    restarted.upload()
+    assert stored_content(store) == [CONTENT]
+    assert store.bytes_uploaded == len(CONTENT)
+    assert restarted.drive_api.journal.get_upload(file_path) is None
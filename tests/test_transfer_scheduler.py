@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from transfer_scheduler import TransferPriority, TransferQueue
+
+
+def run_in_queue_order(keys):
+    """
+    Queue one call per key behind a call that holds the only worker, then let them run.
+
+    :return: list of the keys in the order their calls ran.
+    """
+    queue = TransferQueue(worker_count=1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    queue.submit((0,), hold)
+    assert started.wait(5)
+    futures = [queue.submit(key, ran.append, (key, index)) for index, key in enumerate(keys)]
+    release.set()
+    for future in futures:
+        future.result(5)
+    queue.shutdown()
+    return ran
+
+
+def test_queue_runs_smallest_key_first_and_ties_in_queue_order():
+    keys = [(1, 300), (1, 10), (0, 500), (1, 10), (1, 0), (0, 20)]
+
+    assert run_in_queue_order(keys) == [((0, 20), 5), ((0, 500), 2), ((1, 0), 4), ((1, 10), 1), ((1, 10), 3),
+                                        ((1, 300), 0)]
+
+
+def test_priority_ranks_requested_files_then_small_files():
+    priority = TransferPriority(patterns=["config/*"])
+    priority.request(["big/urgent.bin"])
+    sizes = {"big/movie.mkv": 10 ** 9, "notes.txt": 100, "config/app.ini": 5000, "big/urgent.bin": 10 ** 8,
+             "photo.jpg": 10 ** 6}
+
+    ordered = [key[1] for key in run_in_queue_order([priority.key(name, size) for name, size in sizes.items()])]
+    names = list(sizes)
+    assert [names[index] for index in ordered] == ["config/app.ini", "big/urgent.bin", "notes.txt", "photo.jpg",
+                                                   "big/movie.mkv"]
+
+
+def test_weights_rank_transfers_of_different_roots():
+    light = TransferPriority(weight=1.0)
+    heavy = TransferPriority(weight=4.0)
+
+    assert heavy.key("a", 4000) == light.key("b", 1000)
+    assert heavy.key("a", 3000) < light.key("b", 1000)
+    fifo_light = TransferPriority(small_files_first=False, weight=1.0)
+    fifo_heavy = TransferPriority(small_files_first=False, weight=2.0)
+    assert fifo_heavy.key("a", 10 ** 9) < fifo_light.key("b", 1)
+    with pytest.raises(ValueError):
+        TransferPriority(weight=0)
+
+
+def test_failed_call_reports_its_error():
+    queue = TransferQueue(worker_count=2)
+
+    def fail():
+        raise IOError("disk full")
+
+    future = queue.submit((0,), fail)
+    with pytest.raises(IOError):
+        future.result(5)
+    queue.shutdown()
+    with pytest.raises(RuntimeError):
+        queue.submit((0,), fail)
@@ -0,0 +1,124 @@
+from pathlib import Path
+import json
+import os
+import threading
+
+
+TRANSFER_JOURNAL_PATH = Path("transfer_journal.json")
+
+
+class TransferJournal:
+    def __init__(self, journal_path: Path = TRANSFER_JOURNAL_PATH):
+        """
+        Persistent record of in-flight transfers so they can be resumed after a crash or restart. Uploads record their
+        resumable session uri and confirmed byte offset, downloads record their temporary file and the number of
+        bytes written to it. Entries are removed once a transfer completes, so the journal only ever holds the
+        transfers that are currently running. Safe to share between transfer worker threads.
+
+        :param journal_path: Path to the json file the journal is stored in.
+        """
+        self.journal_path = Path(journal_path)
+        self.lock = threading.Lock()
+        self.entries = {"uploads": dict(), "downloads": dict()}
+        self.read_journal()
+
+    def read_journal(self):
+        """
+        Read journal entries from disk. A missing or corrupt journal results in an empty journal.
+
+        :return: None
+        """
+        try:
+            with open(self.journal_path, "r") as journal_file:
+                entries = json.load(journal_file)
+            self.entries = {"uploads": entries.get("uploads", dict()),
+                            "downloads": entries.get("downloads", dict())}
+        except (OSError, ValueError, AttributeError):
+            self.entries = {"uploads": dict(), "downloads": dict()}
+
+    def save(self):
+        """
+        Write journal entries to disk through a temporary file so a crash never leaves a truncated journal.
+
+        :return: None
+        """
+        tmp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with open(tmp_path, "w") as journal_file:
+            json.dump(self.entries, journal_file)
+        os.replace(str(tmp_path), str(self.journal_path))
+
+    def get_upload(self, file_path: str) -> dict:
+        """
+        :param file_path: str path of the local file being uploaded.
+        :return: dict with session_uri, offset, file_id, size and mtime_ns or None if no upload is in flight.
+        """
+        with self.lock:
+            return self.entries["uploads"].get(str(Path(file_path).resolve()), None)
+
+    def record_upload(self, file_path: str, session_uri: str, offset: int, file_id: str, size: int, mtime_ns: int):
+        """
+        Record the resumable session and confirmed byte offset of an upload in progress.
+
+        :param file_path: str path of the local file being uploaded.
+        :param session_uri: str resumable upload session uri returned by Google Drive.
+        :param offset: int number of bytes Google Drive confirmed receiving.
+        :param file_id: str id of the Google Drive file being updated or None if a new file is being created.
+        :param size: int size of the local file when the upload started.
+        :param mtime_ns: int modification time of the local file when the upload started.
+        :return: None
+        """
+        with self.lock:
+            self.entries["uploads"][str(Path(file_path).resolve())] = {"session_uri": session_uri,
+                                                                       "offset": offset,
+                                                                       "file_id": file_id,
+                                                                       "size": size,
+                                                                       "mtime_ns": mtime_ns}
+            self.save()
+
+    def remove_upload(self, file_path: str):
+        """
+        Forget an upload after it completed or its session expired.
+
+        :param file_path: str path of the local file being uploaded.
+        :return: None
+        """
+        with self.lock:
+            if self.entries["uploads"].pop(str(Path(file_path).resolve()), None) is not None:
+                self.save()
+
+    def get_download(self, file_path: str) -> dict:
+        """
+        :param file_path: str path the file is being downloaded to.
+        :return: dict with file_id, md5, tmp_path and offset or None if no download is in flight.
+        """
+        with self.lock:
+            return self.entries["downloads"].get(str(Path(file_path).resolve()), None)
+
+    def record_download(self, file_path: str, file_id: str, md5: str, tmp_path: str, offset: int):
+        """
+        Record the temporary file and number of bytes written of a download in progress.
+
+        :param file_path: str path the file is being downloaded to.
+        :param file_id: str id of the Google Drive file being downloaded.
+        :param md5: str md5 checksum of the Google Drive file being downloaded.
+        :param tmp_path: str path of the temporary file the content is written to.
+        :param offset: int number of bytes written to the temporary file.
+        :return: None
+        """
+        with self.lock:
+            self.entries["downloads"][str(Path(file_path).resolve())] = {"file_id": file_id,
+                                                                         "md5": md5,
+                                                                         "tmp_path": tmp_path,
+                                                                         "offset": offset}
+            self.save()
+
+    def remove_download(self, file_path: str):
+        """
+        Forget a download after it completed or could not be resumed.
+
+        :param file_path: str path the file is being downloaded to.
+        :return: None
+        """
+        with self.lock:
+            if self.entries["downloads"].pop(str(Path(file_path).resolve()), None) is not None:
+                self.save()
@@ -0,0 +1,235 @@
+from collections import namedtuple
+from concurrent.futures import Future, wait
+import fnmatch
+import heapq
+import itertools
+import threading
+
+
+DEFAULT_WORKER_COUNT = 8
+
+TransferResult = namedtuple("TransferResult", ["name", "action", "success", "error"])
+
+
+class TransferError(Exception):
+    def __init__(self, failed_results: list):
+        """
+        Raised when one or more transfers of a sync pass failed.
+
+        :param failed_results: list of TransferResult for the transfers that failed.
+        """
+        self.failed_results = failed_results
+        super().__init__("%d transfer(s) failed: %s" % (len(failed_results),
+                                                          ", ".join(result.name for result in failed_results)))
+
+
+class TransferPriority:
+    def __init__(self, small_files_first: bool = True, patterns=(), weight: float = 1.0):
+        """
+        Rules deciding which queued transfer runs next. Requested files come first: files passed to request() and
+        files matching one of the patterns. Then, with small_files_first, smaller files come before larger ones, so a
+        small file is never stuck behind a large one that happened to be queued earlier. Transfers that rank the same
+        run in the order they were queued. Safe to share between threads.
+
+        :param small_files_first: bool True to run smaller transfers first, False to run them in queue order.
+        :param patterns: iterable of str fnmatch patterns of paths relative to the sync folder whose transfers always
+        come first, e.g. "config/*".
+        :param weight: float weight of these transfers against those of other synchronizers sharing a TransferQueue,
+        e.g. of other sync roots. With small_files_first a transfer ranks like one weight times smaller, otherwise
+        transfers with a higher weight come first.
+        """
+        if weight <= 0:
+            raise ValueError("Transfer weights must be positive, got %r" % weight)
+        self.small_files_first = small_files_first
+        self.patterns = list(patterns)
+        self.weight = weight
+        self.lock = threading.Lock()
+        self.requested = set()
+
+    def request(self, file_names):
+        """
+        Move the transfers of files ahead of every other transfer, e.g. because a user is waiting for them.
+
+        :param file_names: iterable of str paths relative to the sync folder.
+        :return: None
+        """
+        with self.lock:
+            self.requested.update(file_names)
+
+    def is_requested(self, file_name: str) -> bool:
+        with self.lock:
+            if file_name in self.requested:
+                return True
+        return any(fnmatch.fnmatchcase(file_name, pattern) for pattern in self.patterns)
+
+    def key(self, file_name: str, size: int = None) -> tuple:
+        """
+        :param file_name: str path relative to the sync folder of the file transferred.
+        :param size: int number of bytes transferred, None if unknown, which ranks like an empty file.
+        :return: tuple that sorts before the keys of the transfers that should run later.
+        """
+        rank = 0 if self.is_requested(file_name) else 1
+        if self.small_files_first:
+            return rank, (size or 0) / self.weight
+        return rank, -self.weight
+
+
+class TransferQueue:
+    def __init__(self, worker_count: int = DEFAULT_WORKER_COUNT, thread_name_prefix: str = "simple-sync-transfer"):
+        """
+        Pool of worker threads running queued functions in priority order rather than in the order they were
+        submitted. Threads are started as work arrives, up to worker_count. Several TransferSchedulers can share one
+        queue, e.g. those of every sync root, so their transfers are ranked against each other. Safe to share between
+        threads.
+
+        :param worker_count: int maximum number of functions running at the same time.
+        :param thread_name_prefix: str prefix of the names of the worker threads.
+        """
+        self.worker_count = max(1, worker_count)
+        self.thread_name_prefix = thread_name_prefix
+        self.condition = threading.Condition()
+        self.pending = []
+        self.sequence = itertools.count()
+        self.threads = []
+        self.idle_count = 0
+        self.shutting_down = False
+
+    def submit(self, key: tuple, function, *args) -> Future:
+        """
+        Queue a function call.
+
+        :param key: tuple priority of the call, e.g. from TransferPriority.key. Smaller keys run first.
+        :param function: callable to run on a worker thread.
+        :return: Future of the result of the call.
+        """
+        future = Future()
+        with self.condition:
+            if self.shutting_down:
+                raise RuntimeError("Cannot queue transfers after shutdown")
+            heapq.heappush(self.pending, (key, next(self.sequence), future, function, args))
+            if self.idle_count > 0:
+                # The woken thread is no longer idle, even before it gets to run.
+                self.idle_count -= 1
+                self.condition.notify()
+            elif len(self.threads) < self.worker_count:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name="%s_%d" % (self.thread_name_prefix, len(self.threads)))
+                self.threads.append(thread)
+                thread.start()
+        return future
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.shutting_down:
+                    self.idle_count += 1
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                key, sequence, future, function, args = heapq.heappop(self.pending)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the worker threads once every queued call ran.
+
+        :param wait: bool True to wait for the worker threads to stop.
+        :return: None
+        """
+        with self.condition:
+            self.shutting_down = True
+            self.idle_count = 0
+            self.condition.notify_all()
+            threads = list(self.threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+class TransferScheduler:
+    def __init__(self, api_handler_factory, worker_count: int = DEFAULT_WORKER_COUNT, on_result=None,
+                 queue: TransferQueue = None, priority: TransferPriority = None):
+        """
+        Run transfers on a bounded pool of worker threads, most important first. The Google api service object is not
+        thread-safe, so each worker lazily creates its own api handler from the given factory the first time it runs
+        a transfer.
+
+        :param api_handler_factory: callable returning a new GoogleDriveApiHandler for the calling thread.
+        :param worker_count: int maximum number of transfers running at the same time.
+        :param on_result: callable taking the TransferResult of each transfer as soon as it finishes, called on the
+        worker thread. None to only collect results in wait().
+        :param queue: TransferQueue shared with other schedulers, e.g. DriveClient.transfer_queue(), to queue the
+        transfers on instead of starting worker_count threads of its own. It is left running on exit.
+        :param priority: TransferPriority ranking the transfers, None to run them in the order they are submitted.
+        """
+        self.api_handler_factory = api_handler_factory
+        self.worker_count = max(1, worker_count)
+        self.shared_queue = queue is not None
+        self.queue = queue if queue is not None else TransferQueue(self.worker_count)
+        self.priority = priority
+        self.thread_local = threading.local()
+        self.on_result = on_result
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.shared_queue:
+            wait([future for name, action, future in self.futures])
+        else:
+            self.queue.shutdown(wait=True)
+
+    def get_worker_api_handler(self):
+        """
+        :return: GoogleDriveApiHandler owned by the calling worker thread.
+        """
+        api_handler = getattr(self.thread_local, "api_handler", None)
+        if api_handler is None:
+            api_handler = self.api_handler_factory()
+            self.thread_local.api_handler = api_handler
+        return api_handler
+
+    def submit(self, name: str, action: str, *args, size: int = None):
+        """
+        Queue a transfer. The action is the name of a GoogleDriveApiHandler method that is called with the given
+        arguments on the worker's own api handler.
+
+        :param name: str name of the file being transferred, used for result reporting and ranking.
+        :param action: str name of the GoogleDriveApiHandler method to call, e.g. "upload_file".
+        :param size: int number of bytes the transfer moves, None if unknown. Used for ranking.
+        :return: None
+        """
+        key = self.priority.key(name, size) if self.priority is not None else (0,)
+        self.futures.append((name, action, self.queue.submit(key, self._run, name, action, args)))
+
+    def _run(self, name: str, action: str, args: tuple):
+        try:
+            result = getattr(self.get_worker_api_handler(), action)(*args)
+        except Exception as error:
+            if self.on_result is not None:
+                self.on_result(TransferResult(name=name, action=action, success=False, error=error))
+            raise
+        if self.on_result is not None:
+            self.on_result(TransferResult(name=name, action=action, success=True, error=None))
+        return result
+
+    def wait(self) -> list:
+        """
+        Wait for every queued transfer to finish.
+
+        :return: list of TransferResult in submission order.
+        """
+        results = []
+        for name, action, future in self.futures:
+            error = future.exception()
+            results.append(TransferResult(name=name, action=action, success=error is None, error=error))
+        self.futures = []
+        return results
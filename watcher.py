@@ -0,0 +1,356 @@
+from pathlib import Path
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_REMOTE_POLL_INTERVAL = 60.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_inotify():
+    """
+    :return: ctypes libc handle exposing inotify or None if inotify is not available on this platform.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyEventSource:
+    def __init__(self, dir_path: Path, on_change, libc):
+        """
+        Report changes below a folder using Linux inotify. Every folder in the tree gets its own watch and folders
+        that are created later are watched as they appear, so no directory scans are needed in steady state.
+
+        :param dir_path: Path of the folder to watch.
+        :param on_change: callable taking a str path relative to dir_path, or None if events were lost and the whole
+        folder has to be rescanned.
+        :param libc: ctypes libc handle exposing inotify.
+        """
+        self.dir_path = Path(dir_path)
+        self.on_change = on_change
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths_by_watch = dict()
+        self.lock = threading.Lock()
+        self.add_watches("")
+
+    def add_watches(self, folder_name: str):
+        """
+        Watch a folder and every folder below it.
+
+        :param folder_name: str folder path relative to the watched folder, "" for the watched folder itself.
+        :return: None
+        """
+        folder_path = self.dir_path / folder_name if folder_name != "" else self.dir_path
+        watch = self.libc.inotify_add_watch(self.fd, os.fsencode(str(folder_path)), WATCH_MASK)
+        if watch < 0:
+            return
+        self.paths_by_watch[watch] = folder_name
+        try:
+            with os.scandir(str(folder_path)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.add_watches(entry.name if folder_name == "" else folder_name + "/" + entry.name)
+        except OSError:
+            pass
+
+    def run(self, stop_event: threading.Event):
+        """
+        Read inotify events until the stop event is set.
+
+        :param stop_event: threading.Event that ends the loop.
+        :return: None
+        """
+        try:
+            while not stop_event.is_set():
+                select.select([self.fd], [], [], 0.5)
+                self.check()
+        finally:
+            with self.lock:
+                os.close(self.fd)
+
+    def check(self):
+        """
+        Report every event that is already queued without waiting for new ones.
+
+        :return: None
+        """
+        with self.lock:
+            while select.select([self.fd], [], [], 0)[0]:
+                self.handle_events(os.read(self.fd, 64 * 1024))
+
+    def handle_events(self, buffer: bytes):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            watch, mask, cookie, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            name_start = offset + EVENT_HEADER.size
+            name = os.fsdecode(buffer[name_start:name_start + name_length].rstrip(b"\0"))
+            offset = name_start + name_length
+
+            if mask & IN_Q_OVERFLOW:
+                self.on_change(None)
+                continue
+            if mask & IN_IGNORED:
+                self.paths_by_watch.pop(watch, None)
+                continue
+            folder_name = self.paths_by_watch.get(watch, None)
+            if folder_name is None or mask & IN_DELETE_SELF:
+                continue
+            file_name = name if folder_name == "" else folder_name + "/" + name
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(file_name)
+            self.on_change(file_name)
+
+
+class PollingEventSource:
+    def __init__(self, dir_path: Path, on_change, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        """
+        Report changes below a folder by comparing snapshots of file sizes and modification times. Used where inotify
+        is not available. Each poll is a single os.scandir pass using the stat information the directory listing
+        already provides where the platform supports it.
+
+        :param dir_path: Path of the folder to watch.
+        :param on_change: callable taking a str path relative to dir_path.
+        :param poll_interval: float seconds between snapshots.
+        """
+        self.dir_path = Path(dir_path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> dict:
+        """
+        :return: dict of (size, mtime_ns) for files and None for folders, indexed by relative path.
+        """
+        snapshot = dict()
+        pending = [(str(self.dir_path), "")]
+        while pending:
+            folder_path, folder_name = pending.pop()
+            try:
+                with os.scandir(folder_path) as entries:
+                    for entry in entries:
+                        file_name = entry.name if folder_name == "" else folder_name + "/" + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            snapshot[file_name] = None
+                            pending.append((entry.path, file_name))
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            snapshot[file_name] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                pass
+        return snapshot
+
+    def run(self, stop_event: threading.Event):
+        """
+        Poll for changes until the stop event is set.
+
+        :param stop_event: threading.Event that ends the loop.
+        :return: None
+        """
+        while not stop_event.wait(self.poll_interval):
+            self.check()
+
+    def check(self):
+        """
+        Take a snapshot now and report every path that changed since the previous one.
+
+        :return: None
+        """
+        with self.lock:
+            snapshot = self.take_snapshot()
+            for file_name, state in snapshot.items():
+                if self.snapshot.get(file_name, False) != state:
+                    self.on_change(file_name)
+            for file_name in self.snapshot:
+                if file_name not in snapshot:
+                    self.on_change(file_name)
+            self.snapshot = snapshot
+
+
+class SyncWatcher:
+    def __init__(self, synchronizer, debounce: float = DEFAULT_DEBOUNCE, max_delay: float = DEFAULT_MAX_DELAY,
+                 remote_poll_interval: float = DEFAULT_REMOTE_POLL_INTERVAL,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, use_inotify: bool = True):
+        """
+        Long running incremental sync. Local changes are collected from inotify, or from polling where inotify is not
+        available, debounced and pushed as one batch through Synchronizer.upload_changes. Google Drive is polled for
+        remote changes at a fixed interval.
+
+        :param synchronizer: Synchronizer of the folder to watch.
+        :param debounce: float seconds without new events before a batch of changes is pushed.
+        :param max_delay: float maximum seconds a change waits while events keep arriving.
+        :param remote_poll_interval: float seconds between checks for changes in Google Drive.
+        :param poll_interval: float seconds between local snapshots when polling.
+        :param use_inotify: bool False to always poll.
+        """
+        self.synchronizer = synchronizer
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.remote_poll_interval = remote_poll_interval
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.stop_event = threading.Event()
+        self.condition = threading.Condition()
+        self.pending_file_names = set()
+        self.rescan_needed = False
+        self.first_event_time = None
+        self.last_event_time = None
+
+    def on_local_change(self, file_name: str):
+        """
+        Record a changed local path. Called from the event source thread.
+
+        :param file_name: str path relative to the sync folder or None if the whole folder has to be rescanned.
+        :return: None
+        """
+        with self.condition:
+            if file_name is None:
+                self.rescan_needed = True
+            else:
+                self.pending_file_names.add(file_name)
+            now = time.monotonic()
+            if self.first_event_time is None:
+                self.first_event_time = now
+            self.last_event_time = now
+            self.condition.notify()
+
+    def new_event_source(self):
+        """
+        :return: InotifyEventSource if inotify is available, otherwise PollingEventSource.
+        """
+        libc = _load_inotify() if self.use_inotify else None
+        if libc is not None:
+            try:
+                return InotifyEventSource(self.synchronizer.dir_path, self.on_local_change, libc)
+            except OSError:
+                pass
+        return PollingEventSource(self.synchronizer.dir_path, self.on_local_change, self.poll_interval)
+
+    def stop(self):
+        """
+        Stop watching. run() returns after pushing changes that are already pending.
+
+        :return: None
+        """
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+
+    def run(self):
+        """
+        Run a full upload, then watch until stop() is called.
+
+        :return: None
+        """
+        event_source = self.new_event_source()
+        source_thread = threading.Thread(target=event_source.run, args=(self.stop_event,), daemon=True)
+        source_thread.start()
+        self.synchronizer.metrics.emit("watching", str(self.synchronizer.dir_path),
+                                       message="Watching " + str(self.synchronizer.dir_path) + " using " +
+                                               type(event_source).__name__)
+
+        self.run_sync_step(self.synchronizer.upload)
+        next_remote_poll = time.monotonic() + self.remote_poll_interval
+        while not self.stop_event.is_set():
+            with self.condition:
+                self.condition.wait(self.seconds_until_due(next_remote_poll))
+            now = time.monotonic()
+            if self.local_changes_due(now):
+                self.push_local_changes()
+            if now >= next_remote_poll:
+                # Local changes must reach Google Drive first, or the download would undo them.
+                event_source.check()
+                self.push_local_changes()
+                self.run_sync_step(self.synchronizer.download)
+                next_remote_poll = time.monotonic() + self.remote_poll_interval
+
+        self.push_local_changes()
+        source_thread.join()
+
+    def seconds_until_due(self, next_remote_poll: float) -> float:
+        with self.condition:
+            now = time.monotonic()
+            timeout = next_remote_poll - now
+            if self.last_event_time is not None:
+                timeout = min(timeout, self.last_event_time + self.debounce - now,
+                              self.first_event_time + self.max_delay - now)
+            return max(0.05, timeout)
+
+    def local_changes_due(self, now: float) -> bool:
+        with self.condition:
+            if self.last_event_time is None:
+                return False
+            return now - self.last_event_time >= self.debounce or now - self.first_event_time >= self.max_delay
+
+    def push_local_changes(self):
+        """
+        Push every pending local change as one batch.
+
+        :return: None
+        """
+        with self.condition:
+            file_names = self.pending_file_names
+            rescan_needed = self.rescan_needed
+            self.pending_file_names = set()
+            self.rescan_needed = False
+            self.first_event_time = None
+            self.last_event_time = None
+        if rescan_needed:
+            succeeded = self.run_sync_step(self.synchronizer.upload)
+        elif file_names:
+            succeeded = self.run_sync_step(self.synchronizer.upload_changes, file_names)
+        else:
+            return
+        if not succeeded:
+            # Keep the changes pending so they are retried after the next debounce period.
+            with self.condition:
+                self.pending_file_names |= file_names
+                self.rescan_needed = self.rescan_needed or rescan_needed
+                now = time.monotonic()
+                self.first_event_time = now if self.first_event_time is None else self.first_event_time
+                self.last_event_time = now
+
+    def run_sync_step(self, sync_function, *args) -> bool:
+        """
+        Run a sync operation, reporting instead of raising errors so the watcher keeps running.
+
+        :return: True if the operation succeeded.
+        """
+        try:
+            sync_function(*args)
+        except Exception as error:
+            self.synchronizer.metrics.emit("sync_failed", message="Sync failed: " + str(error))
+            return False
+        return True